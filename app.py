@@ -2,18 +2,95 @@ from flask import Flask, request, jsonify, render_template, redirect
 import requests
 import re
 import json
+import os
+import hashlib
 from urllib.parse import urlparse, unquote
 import time
 from datetime import datetime, timedelta
 import threading
-from rule_converter import RuleConverter, convert_clash_to_singbox, validate_singbox_rules
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from rule_converter import (RuleConverter, StreamLineReader, ContentTooLargeError,
+                            convert_clash_to_singbox, validate_singbox_rules)
+from rule_cache import RuleCache, normalize_url
+from refresh_scheduler import RefreshScheduler
+from preload import Warmup
+from incremental import IncrementalStore
+from singleflight import SingleFlight
+from shared_store import create_store
+from sources import BEHAVIORS, SourceError, parse_source
+from upstream import UpstreamClient, response_encoding
+from srs import write_rule_set
+from clash_config import ClashConfigError, load_config, provider_intervals, provider_sources, translate_config
+from conversion_pool import (ConversionPool, PoolBusyError, convert_to_json, convert_with_state, merge_json,
+                             serialize_rules, update_with_state)
+from compression import SUPPORTED_ENCODINGS, MIN_COMPRESS_SIZE, compress, negotiate, precompress
 from collections import defaultdict
 
 app = Flask(__name__)
 
 # 配置
 MAX_CONTENT_SIZE = 10 * 1024 * 1024  # 10MB
-RATE_LIMIT_PER_MINUTE = 20
+RATE_LIMIT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_PER_MINUTE', 20))
+RATE_LIMIT_MESSAGE = f'Rate limit exceeded. Maximum {RATE_LIMIT_PER_MINUTE} requests per minute per IP.'
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # 流式下载块大小
+
+# 转换结果缓存配置
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 600))  # 新鲜期(秒)
+CACHE_STALE_TTL = int(os.environ.get('CACHE_STALE_TTL', 3600))  # 过期后仍可返回旧结果的宽限期(秒)
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_MB', 128)) * 1024 * 1024
+SRS_CACHE_MAX_BYTES = int(os.environ.get('SRS_CACHE_MAX_MB', 32)) * 1024 * 1024
+MERGE_CACHE_MAX_BYTES = int(os.environ.get('MERGE_CACHE_MAX_MB', 32)) * 1024 * 1024
+CONVERT_CACHE_MAX_BYTES = int(os.environ.get('CONVERT_CACHE_MAX_MB', 32)) * 1024 * 1024
+
+# 多源合并：每个请求最多的上游数
+MERGE_MAX_SOURCES = int(os.environ.get('MERGE_MAX_SOURCES', 16))
+# Clash配置转换：每个配置最多下载的规则集数
+CONFIG_MAX_PROVIDERS = int(os.environ.get('CONFIG_MAX_PROVIDERS', 64))
+
+# 输出格式
+SRS_MIMETYPE = 'application/octet-stream'
+OUTPUT_FORMATS = ('json', 'srs')
+
+# 上游连接配置
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 5))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 25))
+UPSTREAM_PER_HOST_LIMIT = int(os.environ.get('UPSTREAM_PER_HOST_LIMIT', 4))
+DNS_CACHE_TTL = int(os.environ.get('DNS_CACHE_TTL', 300))
+
+# 去掉被 domain_suffix 覆盖的 domain 和 domain_suffix
+OPTIMIZE_DOMAINS = os.environ.get('OPTIMIZE_DOMAINS', '').lower() in ('1', 'true', 'yes')
+# 把相邻和重叠的IP网段合并为最少的网段
+AGGREGATE_CIDRS = os.environ.get('AGGREGATE_CIDRS', '').lower() in ('1', 'true', 'yes')
+
+# 转换进程池：每个worker的子进程数、最多排队的任务数
+CONVERT_PROCESSES = int(os.environ.get('CONVERT_PROCESSES', 2))
+CONVERT_QUEUE_SIZE = int(os.environ.get('CONVERT_QUEUE_SIZE', 8))
+# 达到此大小的输入在进程池中转换，较小的输入直接在请求线程中转换
+CONVERT_OFFLOAD_MIN_BYTES = int(os.environ.get('CONVERT_OFFLOAD_MIN_KB', 256)) * 1024
+# 每个worker保存上游解析状态的内存上限，上游内容变化时只转换变化的行(0为关闭)
+INCREMENTAL_MAX_BYTES = int(os.environ.get('INCREMENTAL_MAX_MB', 64)) * 1024 * 1024
+
+# 后台刷新：每个worker提前刷新请求最多的前N个上游(0为关闭)、同时刷新数、
+# 未声明 interval 的上游的刷新周期(秒，0为使用缓存新鲜期)、刷新时间的随机抖动比例
+REFRESH_TOP_N = int(os.environ.get('REFRESH_TOP_N', 20))
+REFRESH_CONCURRENCY = int(os.environ.get('REFRESH_CONCURRENCY', 2))
+REFRESH_INTERVAL = int(os.environ.get('REFRESH_INTERVAL', 0))
+REFRESH_JITTER = float(os.environ.get('REFRESH_JITTER', 0.1))
+# /config 中规则集声明的 interval 的下限(秒)
+REFRESH_MIN_INTERVAL = int(os.environ.get('REFRESH_MIN_INTERVAL', 300))
+
+# 启动预热：worker启动时下载并转换清单中的上游规则，完成前 /ready 返回503
+PRELOAD_MANIFEST = os.environ.get('PRELOAD_MANIFEST', '')
+PRELOAD_CONCURRENCY = int(os.environ.get('PRELOAD_CONCURRENCY', 4))
+
+# 共享存储：memory 为进程内存储；sqlite 让同一主机上的所有gunicorn worker共用统计、限流和转换结果
+STORE_BACKEND = os.environ.get('STORE_BACKEND', 'memory')
+STORE_PATH = os.environ.get('STORE_PATH', os.path.join(tempfile.gettempdir(), 'clash-to-singbox.db'))
+
+UPSTREAM_HEADERS = {
+    'User-Agent': 'clash-to-singbox-converter/1.0'
+}
 
 # Flask配置
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_SIZE
@@ -36,7 +113,9 @@ class GlobalStats:
         self.response_times = []  # 响应时间记录
         self.minute_requests = defaultdict(int)  # 每分钟请求数
     
-    def update(self, success=True, response_time=None, is_api_call=False):
+    def update(self, success=True, response_time=None, is_api_call=False, now=None):
+        # now 为请求发生的时间，缓冲后写入时仍按请求时间统计
+        now = now or datetime.now()
         self.data['total_conversions'] += 1
         if success:
             self.data['successful_conversions'] += 1
@@ -50,7 +129,7 @@ class GlobalStats:
             self.data['text_conversions'] += 1
             
         # 更新当前小时的请求数
-        current_hour = datetime.now().hour
+        current_hour = now.hour
         if current_hour != self.data['last_hour_index']:
             # 向前移动所有小时数据
             self.data['hourly_requests'] = self.data['hourly_requests'][1:] + [0]
@@ -59,7 +138,7 @@ class GlobalStats:
         self.data['hourly_requests'][-1] += 1
         
         # 更新每分钟请求数
-        minute_key = datetime.now().strftime('%Y-%m-%d %H:%M')
+        minute_key = now.strftime('%Y-%m-%d %H:%M')
         self.minute_requests[minute_key] += 1
         
         # 更新峰值
@@ -76,7 +155,7 @@ class GlobalStats:
             self.data['avg_response_time'] = int(sum(self.response_times) / len(self.response_times))
             
         # 清理旧的分钟请求数据
-        current_time = datetime.now()
+        current_time = now
         keys_to_remove = []
         for key in self.minute_requests:
             time_obj = datetime.strptime(key, '%Y-%m-%d %H:%M')
@@ -86,38 +165,495 @@ class GlobalStats:
         for key in keys_to_remove:
             del self.minute_requests[key]
     
+    def to_state(self):
+        """导出为可写入共享存储的状态"""
+        return {
+            'data': self.data,
+            'response_times': self.response_times,
+            'minute_requests': dict(self.minute_requests)
+        }
+    
+    @classmethod
+    def from_state(cls, state):
+        """从共享存储的状态恢复，没有状态时返回初始统计"""
+        stats = cls()
+        if state:
+            stats.data.update(state['data'])
+            stats.response_times = state['response_times']
+            stats.minute_requests = defaultdict(int, state['minute_requests'])
+        return stats
+    
     def get_api_percentage(self):
         """计算API调用占比"""
         if self.data['total_conversions'] == 0:
             return 0
         return round((self.data['api_calls'] / self.data['total_conversions']) * 100, 1)
 
-conversion_stats = GlobalStats()
+# 统计、限流记录和转换结果保存在共享存储中，所有worker读写同一份
+shared_store = create_store(STORE_BACKEND, STORE_PATH)
+artifact_store = shared_store if shared_store.shared else None
+
+# 第一个启动的worker写入初始统计
+shared_store.update_state('conversion_stats', lambda state: state or GlobalStats().to_state())
+
+# 上游规则转换结果缓存
+# 写入时同时保存 gzip / brotli 压缩版本
+rule_cache = RuleCache(ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL, max_bytes=CACHE_MAX_BYTES, compressor=precompress,
+                       shared_store=artifact_store, namespace='rules')
+
+# 二进制规则集缓存，以JSON结果的ETag为键，相同的转换结果只编码一次
+srs_cache = RuleCache(ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL, max_bytes=SRS_CACHE_MAX_BYTES,
+                      shared_store=artifact_store, namespace='srs')
+
+# 多源合并结果缓存，以各来源结果的ETag组合为键，来源均未变化时直接返回
+merge_cache = RuleCache(ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL, max_bytes=MERGE_CACHE_MAX_BYTES,
+                        compressor=precompress, shared_store=artifact_store, namespace='merge')
+
+# 文本转换结果缓存，以内容哈希和behavior为键，重复提交相同内容时直接返回
+convert_cache = RuleCache(ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL, max_bytes=CONVERT_CACHE_MAX_BYTES,
+                          compressor=precompress, shared_store=artifact_store, namespace='convert')
 
-# IP限速追踪
-rate_limit_tracker = defaultdict(list)
+# 上游规则上次转换时的解析状态，以缓存键为键，只在当前worker中保存
+incremental_states = IncrementalStore(INCREMENTAL_MAX_BYTES)
 
-# 线程锁
-stats_lock = threading.Lock()
-rate_limit_lock = threading.Lock()
+# 每个worker共享的上游连接池
+upstream_client = UpstreamClient(
+    per_host_limit=UPSTREAM_PER_HOST_LIMIT,
+    connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+    read_timeout=UPSTREAM_READ_TIMEOUT,
+    dns_ttl=DNS_CACHE_TTL,
+    headers=UPSTREAM_HEADERS
+)
+
+# 合并并发的相同转换请求
+rules_flight = SingleFlight()
+convert_flight = SingleFlight()
+srs_flight = SingleFlight()
+merge_flight = SingleFlight()
+
+# 多源合并时并发下载各来源
+merge_executor = ThreadPoolExecutor(max_workers=MERGE_MAX_SOURCES, thread_name_prefix='merge')
+
+# 大文件转换使用的进程池，由 gunicorn.conf.py / asgi.py 在worker启动时预热
+conversion_pool = ConversionPool(CONVERT_PROCESSES, CONVERT_QUEUE_SIZE)
+
+# 其他服务模式追加到 /api/stats 的统计，名称 -> 返回统计字典的函数
+stats_providers = {}
+
+class ConversionError(Exception):
+    """转换流程错误，携带返回给客户端的HTTP状态码"""
+    def __init__(self, message: str, status_code: int = 500, retry_after: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def conversion_error_response(error: ConversionError):
+    """转换错误的JSON响应，服务繁忙时附带 Retry-After"""
+    headers = {'Retry-After': str(error.retry_after)} if error.retry_after else {}
+    return jsonify({'error': str(error)}), error.status_code, headers
+
+def server_busy_error(error: PoolBusyError) -> ConversionError:
+    """转换进程池排队已满的错误"""
+    return ConversionError('Server is busy converting other rules. Please retry later.', 503, error.retry_after)
+
+def offload_conversion(data: bytes, encoding: str = 'utf-8', behavior: str = None) -> bytes:
+    """在进程池中转换，返回序列化后的结果"""
+    try:
+        body = conversion_pool.submit(convert_to_json, data, encoding, OPTIMIZE_DOMAINS, AGGREGATE_CIDRS, behavior)
+    except PoolBusyError as e:
+        raise server_busy_error(e) from None
+    if body is None:
+        raise ConversionError('Invalid conversion result', 500)
+    return body
 
 def check_rate_limit(ip: str) -> bool:
-    with rate_limit_lock:
-        now = time.time()
-        rate_limit_tracker[ip] = [
-            timestamp for timestamp in rate_limit_tracker[ip]
-            if now - timestamp < 60
-        ]
+    # 所有worker共用同一个限流窗口
+    return shared_store.rate_limit_hit(f'rate:{ip}', RATE_LIMIT_PER_MINUTE, 60)
+
+def update_stats(success=True, response_time=None, is_api_call=False):
+    now = datetime.now()
+    
+    def apply(state):
+        stats = GlobalStats.from_state(state)
+        stats.update(success, response_time, is_api_call, now)
+        return stats.to_state()
+    
+    # 不在请求路径上写数据库，与其他计数一起批量写入
+    shared_store.update_state_later('conversion_stats', apply)
+
+def current_stats() -> GlobalStats:
+    """读取所有worker汇总的统计"""
+    return GlobalStats.from_state(shared_store.get_state('conversion_stats'))
+
+def encoded_response(body: bytes, encoded, mimetype: str = 'application/json', etag: str = None):
+    """按 Accept-Encoding 返回预压缩的版本，ETag 随编码区分"""
+    encoding = negotiate(request.accept_encodings, encoded)
+    response = app.response_class(encoded[encoding] if encoding else body, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(f'{etag}-{encoding}' if encoding else etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
+def validated_body(singbox_rules) -> bytes:
+    """校验转换结果并序列化"""
+    if not validate_singbox_rules(singbox_rules):
+        raise ConversionError('Invalid conversion result', 500)
+    
+    return serialize_rules(singbox_rules)
+
+def convert_content(content: str, content_bytes: bytes, behavior: str = None) -> bytes:
+    """转换文本内容，返回序列化后的结果；较大的内容在进程池中转换"""
+    if len(content_bytes) >= CONVERT_OFFLOAD_MIN_BYTES:
+        return offload_conversion(content_bytes, behavior=behavior)
+    
+    converter = RuleConverter(optimize_domains=OPTIMIZE_DOMAINS, aggregate_cidrs=AGGREGATE_CIDRS)
+    return validated_body(converter.convert(content, behavior))
+
+def convert_request():
+    """解析文本转换请求，返回 (内容, 内容字节, behavior)"""
+    data = request.get_json()
+    if not data or 'content' not in data:
+        raise ConversionError('Missing content field', 400)
+    
+    behavior = data.get('behavior')
+    if behavior is not None and behavior not in BEHAVIORS:
+        raise ConversionError(f"Unsupported behavior. Supported behaviors: {', '.join(BEHAVIORS)}", 400)
+    
+    content = data['content']
+    content_bytes = content.encode('utf-8')
+    if len(content_bytes) > MAX_CONTENT_SIZE:
+        raise content_too_large_error()
+    return content, content_bytes, behavior
+
+def content_cache_key(content_bytes: bytes, behavior: str = None) -> str:
+    """文本转换结果的缓存键，转换选项对整个服务相同，不计入键"""
+    return f"{behavior or 'auto'}|{hashlib.blake2b(content_bytes, digest_size=16).hexdigest()}"
+
+def cached_content_hit(entry, content_bytes: bytes):
+    """记录缓存命中省去转换的输入字节数"""
+    shared_store.incr('convert_cache.saved_bytes', len(content_bytes))
+    return entry
+
+def store_converted(cache_key: str, content: str, content_bytes: bytes, behavior: str = None):
+    """转换文本内容并写入缓存"""
+    return convert_cache.store(cache_key, convert_content(content, content_bytes, behavior))
+
+def converted_entry_for(content: str, content_bytes: bytes, behavior: str = None):
+    """获取文本内容的转换结果，相同内容的并发请求只转换一次"""
+    cache_key = content_cache_key(content_bytes, behavior)
+    entry, state = convert_cache.lookup(cache_key)
+    if state in ('fresh', 'stale'):
+        return cached_content_hit(entry, content_bytes)
+    return convert_flight.do(cache_key, store_converted, cache_key, content, content_bytes, behavior)
+
+def convert_cache_stats() -> dict:
+    """文本转换缓存统计，附带命中时省去转换的输入字节数"""
+    stats = convert_cache.get_stats()
+    stats['saved_bytes'] = shared_store.counters('convert_cache.').get('saved_bytes', 0)
+    return stats
+
+def content_too_large_error() -> ConversionError:
+    """内容超过大小限制的错误"""
+    return ConversionError(f'Content too large. Maximum size is {MAX_CONTENT_SIZE//1024//1024}MB', 413)
+
+def apply_incremental(cache_key: str, state, data: bytes, encoding: str = 'utf-8'):
+    """按上次的解析状态只转换变化的行，返回序列化后的结果；需要完整转换时返回None"""
+    converter = RuleConverter(optimize_domains=OPTIMIZE_DOMAINS, aggregate_cidrs=AGGREGATE_CIDRS)
+    singbox_rules = state.update(data.decode(encoding, errors='replace'), converter)
+    if singbox_rules is None:
+        incremental_states.count('fallbacks')
+        return None
+    
+    return keep_updated(cache_key, validated_body(singbox_rules), state)
+
+def keep_updated(cache_key: str, body: bytes, state) -> bytes:
+    """保存增量转换后的解析状态，返回序列化后的结果"""
+    if body is None:
+        raise ConversionError('Invalid conversion result', 500)
+    incremental_states.put(cache_key, state)
+    incremental_states.count('incremental')
+    incremental_states.count('changed_lines', state.changed_lines)
+    return body
+
+def keep_incremental(cache_key: str, body: bytes, state) -> bytes:
+    """保存完整转换时建立的解析状态，返回序列化后的结果"""
+    if body is None:
+        raise ConversionError('Invalid conversion result', 500)
+    incremental_states.count('full')
+    if state is not None:
+        incremental_states.put(cache_key, state)
+    return body
+
+def keep_pooled_update(cache_key: str, result) -> bytes:
+    """保存进程池中 update_with_state 的结果"""
+    body, state, incremental = result
+    if incremental:
+        return keep_updated(cache_key, body, state)
+    incremental_states.count('fallbacks')
+    return keep_incremental(cache_key, body, state)
+
+def convert_downloaded(cache_key: str, data: bytes, encoding: str = 'utf-8', behavior: str = None) -> bytes:
+    """转换下载完成的上游内容；已有上次的解析状态时只转换变化的行，否则完整转换并建立状态
+
+    较大的内容连同解析状态交给进程池，按行比较、重建结果和序列化都不占用请求线程的GIL
+    """
+    state = incremental_states.take(cache_key)
+    args = (data, encoding, OPTIMIZE_DOMAINS, AGGREGATE_CIDRS, behavior)
+    if len(data) >= CONVERT_OFFLOAD_MIN_BYTES:
+        try:
+            if state is None:
+                body, state = conversion_pool.submit(convert_with_state, *args)
+                return keep_incremental(cache_key, body, state)
+            result = conversion_pool.submit(update_with_state, state, *args)
+        except PoolBusyError as e:
+            # 子进程中修改的是状态的副本，未完成时放回原状态
+            if state is not None:
+                incremental_states.put(cache_key, state)
+            raise server_busy_error(e) from None
+        return keep_pooled_update(cache_key, result)
+    
+    if state is not None:
+        body = apply_incremental(cache_key, state, data, encoding)
+        if body is not None:
+            return body
+    return keep_incremental(cache_key, *convert_with_state(*args))
+
+def fetch_and_convert(cache_key: str, url: str, entry=None, behavior: str = None):
+    """流式下载上游规则并转换，结果写入缓存；已有缓存时发送条件请求，上游返回304则复用旧结果"""
+    headers = entry.conditional_headers() if entry is not None else None
+    
+    with upstream_client.stream(url, headers=headers) as response:
+        if response.status_code == 304 and entry is not None:
+            return rule_cache.renew(cache_key, entry)
+        response.raise_for_status()
+        
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > MAX_CONTENT_SIZE:
+            raise content_too_large_error()
+        
+        chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+        encoding = response_encoding(response.headers)
         
-        if len(rate_limit_tracker[ip]) >= RATE_LIMIT_PER_MINUTE:
-            return False
+        # 先读取到进程池阈值为止，判断在哪里转换
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= CONVERT_OFFLOAD_MIN_BYTES:
+                break
         
-        rate_limit_tracker[ip].append(now)
-        return True
+        if size >= CONVERT_OFFLOAD_MIN_BYTES or cache_key in incremental_states:
+            # 大文件下载完成后在进程池中转换，超过大小限制时立即中止下载；
+            # 增量转换需要完整内容，小文件只在已有上次的解析状态时读取完整内容，首次下载仍逐行转换
+            for chunk in chunks:
+                size += len(chunk)
+                if size > MAX_CONTENT_SIZE:
+                    raise content_too_large_error()
+                head.append(chunk)
+            if incremental_states.enabled:
+                body = convert_downloaded(cache_key, b''.join(head), encoding, behavior)
+            else:
+                body = offload_conversion(b''.join(head), encoding, behavior)
+        else:
+            reader = StreamLineReader(iter(head), encoding=encoding, max_bytes=MAX_CONTENT_SIZE)
+            converter = RuleConverter(optimize_domains=OPTIMIZE_DOMAINS, aggregate_cidrs=AGGREGATE_CIDRS)
+            try:
+                body = validated_body(converter.convert_lines(reader, behavior))
+            except ContentTooLargeError:
+                raise content_too_large_error() from None
+        
+        return rule_cache.store(
+            cache_key,
+            body,
+            upstream_etag=response.headers.get('ETag'),
+            upstream_last_modified=response.headers.get('Last-Modified')
+        )
 
-def update_stats(success=True, response_time=None, is_api_call=False):
-    with stats_lock:
-        conversion_stats.update(success, response_time, is_api_call)
+def requested_format() -> str:
+    """输出格式：优先使用 format 查询参数，其次根据 Accept 请求头协商"""
+    output_format = request.args.get('format')
+    if output_format:
+        output_format = output_format.lower()
+        if output_format not in OUTPUT_FORMATS:
+            raise ConversionError(f"Unsupported format. Supported formats: {', '.join(OUTPUT_FORMATS)}", 400)
+        return output_format
+    
+    if request.accept_mimetypes.best_match(['application/json', SRS_MIMETYPE]) == SRS_MIMETYPE:
+        return 'srs'
+    return 'json'
+
+def encode_srs(entry):
+    """把缓存的JSON结果编码为二进制规则集"""
+    return srs_cache.store(entry.etag, write_rule_set(json.loads(entry.body)))
+
+def srs_entry_for(entry):
+    """获取JSON结果对应的二进制规则集，内容相同的结果只编码一次"""
+    srs_entry, state = srs_cache.lookup(entry.etag)
+    if state in ('fresh', 'stale'):
+        return srs_entry
+    return srs_flight.do(entry.etag, encode_srs, entry)
+
+def refresh_cached_rules(cache_key: str, url: str, entry, behavior: str = None):
+    """后台刷新过期的缓存条目，失败时保留旧结果"""
+    try:
+        rules_flight.do(cache_key, fetch_and_convert, cache_key, url, entry, behavior)
+    except Exception as e:
+        print(f"后台刷新失败 {url}: {e}")
+    finally:
+        rule_cache.end_refresh(cache_key)
+
+# 按请求频率在缓存过期前提前刷新热门上游，由 gunicorn / ASGI 启动时开启
+refresh_scheduler = RefreshScheduler(rule_cache, refresh_cached_rules, top_n=REFRESH_TOP_N,
+                                     concurrency=REFRESH_CONCURRENCY, interval=REFRESH_INTERVAL or None,
+                                     jitter=REFRESH_JITTER, min_interval=REFRESH_MIN_INTERVAL)
+
+def record_provider_intervals(config):
+    """记录配置中规则集声明的 interval，后台刷新按该周期刷新"""
+    sources = provider_sources(config)
+    for name, interval in provider_intervals(config).items():
+        refresh_scheduler.set_interval(source_cache_key(*sources[name]), interval)
+
+def source_cache_key(url: str, behavior: str = None) -> str:
+    """上游来源的缓存键，未指定behavior时与 /rules 共用同一缓存条目"""
+    cache_key = normalize_url(url)
+    return f'{behavior}|{cache_key}' if behavior else cache_key
+
+def merge_sources() -> list:
+    """解析合并请求中的来源列表，返回 [(url, behavior)]
+    
+    GET 使用重复的 url 参数，可以用 behavior, 前缀指定行为，如 url=domain,https://example.com/list.txt；
+    POST 使用 JSON: {"sources": ["https://...", {"url": "https://...", "behavior": "domain"}]}
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        items = data.get('sources') if isinstance(data, dict) else None
+        if not isinstance(items, list):
+            raise ConversionError('Missing sources field', 400)
+    else:
+        items = request.args.getlist('url')
+    
+    sources = []
+    for item in items:
+        try:
+            source = parse_source(item)
+        except SourceError as e:
+            raise ConversionError(str(e), 400) from None
+        if source not in sources:
+            sources.append(source)
+    
+    if not sources:
+        raise ConversionError('Missing url parameter', 400)
+    if len(sources) > MERGE_MAX_SOURCES:
+        raise ConversionError(f'Too many sources. Maximum is {MERGE_MAX_SOURCES}', 400)
+    return sources
+
+def fetch_source(cache_key: str, url: str, entry, behavior: str):
+    """下载并转换一个来源，下载失败时在错误信息中注明来源"""
+    try:
+        return rules_flight.do(cache_key, fetch_and_convert, cache_key, url, entry, behavior)
+    except requests.RequestException as e:
+        raise ConversionError(f'Failed to fetch rules from {url}: {str(e)}', 500) from None
+
+def source_entries(sources: list) -> list:
+    """获取各来源的转换结果，各来源独立缓存，未命中缓存的来源并发下载"""
+    entries = []
+    pending = []
+    for index, (url, behavior) in enumerate(sources):
+        cache_key = source_cache_key(url, behavior)
+        refresh_scheduler.record(cache_key, url, behavior)
+        entry, state = rule_cache.lookup(cache_key)
+        
+        if state == 'stale' and rule_cache.begin_refresh(cache_key):
+            threading.Thread(target=refresh_cached_rules, args=(cache_key, url, entry, behavior), daemon=True).start()
+        
+        if state not in ('fresh', 'stale'):
+            pending.append((index, cache_key, url, entry, behavior))
+        entries.append(entry)
+    
+    if len(pending) == 1:
+        index, *args = pending[0]
+        entries[index] = fetch_source(*args)
+    elif pending:
+        futures = [(index, merge_executor.submit(fetch_source, *args)) for index, *args in pending]
+        for index, future in futures:
+            entries[index] = future.result()
+    return entries
+
+def preload_source(url: str, behavior: str = None):
+    """预热一个来源，其他worker已写入共享存储的新鲜结果直接使用"""
+    cache_key = source_cache_key(url, behavior)
+    entry = rule_cache.peek(cache_key)
+    if entry is not None and entry.state() == 'fresh':
+        return entry
+    return fetch_source(cache_key, url, entry, behavior)
+
+def source_is_warm(url: str, behavior: str = None) -> bool:
+    """来源已在共享缓存中且新鲜，同时载入本worker的缓存"""
+    entry = rule_cache.peek(source_cache_key(url, behavior))
+    return entry is not None and entry.state() == 'fresh'
+
+# 启动预热进度，由 gunicorn / ASGI 启动时开始，各worker通过共享存储协调
+warmup = Warmup(PRELOAD_MANIFEST or None, preload_source, concurrency=PRELOAD_CONCURRENCY,
+                store=shared_store, is_warm=source_is_warm)
+
+def merge_cache_key(entries: list) -> str:
+    """合并结果与来源顺序无关，以排序后的各来源ETag为键"""
+    return hashlib.blake2b('\n'.join(sorted(entry.etag for entry in entries)).encode('ascii'), digest_size=16).hexdigest()
+
+def build_merged(merge_key: str, entries: list):
+    """合并各来源的转换结果并写入缓存；较大的合并在进程池中执行"""
+    bodies = [entry.body for entry in entries]
+    if sum(len(body) for body in bodies) >= CONVERT_OFFLOAD_MIN_BYTES:
+        try:
+            body = conversion_pool.submit(merge_json, bodies, OPTIMIZE_DOMAINS, AGGREGATE_CIDRS)
+        except PoolBusyError as e:
+            raise server_busy_error(e) from None
+    else:
+        body = merge_json(bodies, OPTIMIZE_DOMAINS, AGGREGATE_CIDRS)
+    return merge_cache.store(merge_key, body)
+
+def merged_entry_for(entries: list):
+    """获取多个来源合并后的结果，来源均未变化时直接返回缓存"""
+    merge_key = merge_cache_key(entries)
+    entry, state = merge_cache.lookup(merge_key)
+    if state in ('fresh', 'stale'):
+        return entry
+    return merge_flight.do(merge_key, build_merged, merge_key, entries)
+
+def config_request():
+    """解析配置转换请求，返回 (Clash配置, 远程规则集地址)
+    
+    请求体为 JSON {"content": "<配置>", "rule_set": "inline|remote"}，或直接提交YAML配置；
+    rule_set 为 remote 时规则集输出为指向本服务的远程二进制规则集
+    """
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('content'), str):
+            raise ConversionError('Missing content field', 400)
+        content, mode = data['content'], data.get('rule_set', 'inline')
+    else:
+        content, mode = request.get_data(as_text=True), request.args.get('rule_set', 'inline')
+    
+    if mode not in ('inline', 'remote'):
+        raise ConversionError('Unsupported rule_set mode. Supported modes: inline, remote', 400)
+    try:
+        config = load_config(content)
+    except ClashConfigError as e:
+        raise ConversionError(str(e), 400) from None
+    if len(provider_sources(config)) > CONFIG_MAX_PROVIDERS:
+        raise ConversionError(f'Too many rule providers. Maximum is {CONFIG_MAX_PROVIDERS}', 400)
+    return config, request.host_url if mode == 'remote' else None
+
+def translated_config(config, entries: list, remote_base: str = None) -> bytes:
+    """用各规则集的转换结果生成Sing-box路由配置，转换警告放在 warnings 字段"""
+    provider_rules = {name: json.loads(entry.body)['rules'] for name, entry in zip(provider_sources(config), entries)}
+    converter = RuleConverter(optimize_domains=OPTIMIZE_DOMAINS, aggregate_cidrs=AGGREGATE_CIDRS)
+    result, warnings = translate_config(config, provider_rules, converter, remote_base)
+    result['warnings'] = warnings
+    return json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
 
 @app.errorhandler(413)
 def request_entity_too_large(error):
@@ -128,46 +664,72 @@ def request_entity_too_large(error):
 def index():
     return render_template('index.html')
 
+@app.route('/ready')
+def ready():
+    # 就绪检查：启动预热完成前返回503，不计入限流
+    status = warmup.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
 @app.route('/stats')
 def stats():
-    return render_template('stats.html', stats=conversion_stats.data)
+    return render_template('stats.html', stats=current_stats().data)
 
 @app.route('/api/stats')
 def api_stats():
+    conversion_stats = current_stats()
     stats_data = conversion_stats.data.copy()
     stats_data['api_percentage'] = conversion_stats.get_api_percentage()
+    stats_data['cache'] = rule_cache.get_stats()
+    stats_data['srs_cache'] = srs_cache.get_stats()
+    stats_data['merge_cache'] = merge_cache.get_stats()
+    stats_data['convert_cache'] = convert_cache_stats()
+    stats_data['coalescing'] = {
+        'rules': rules_flight.get_stats(),
+        'convert': convert_flight.get_stats(),
+        'srs': srs_flight.get_stats(),
+        'merge': merge_flight.get_stats()
+    }
+    stats_data['upstream'] = upstream_client.get_stats()
+    stats_data['process_pool'] = conversion_pool.get_stats()
+    stats_data['refresh_scheduler'] = refresh_scheduler.get_stats()
+    stats_data['incremental'] = incremental_states.get_stats()
+    stats_data['warmup'] = warmup.status()
+    stats_data['store'] = STORE_BACKEND
+    for name, provider in stats_providers.items():
+        stats_data[name] = provider()
     return jsonify(stats_data)
 
 @app.route('/api/hourly_stats')
 def hourly_stats():
     """获取24小时请求统计数据"""
-    with stats_lock:
-        current_hour = datetime.now().hour
-        hours = [(current_hour - i) % 24 for i in range(24, 0, -1)]
-        
-        # 调整数据顺序使其匹配小时顺序
-        data = []
-        for i, hour in enumerate(hours):
-            offset = (current_hour - hour) % 24
-            if offset < len(conversion_stats.data['hourly_requests']):
-                data.append(conversion_stats.data['hourly_requests'][-offset-1])
-            else:
-                data.append(0)
-                
-        return jsonify({
-            'hours': hours,
-            'data': data,
-            'avg_per_hour': sum(data) // 24 if sum(data) > 0 else 0
-        })
+    hourly_requests = current_stats().data['hourly_requests']
+    current_hour = datetime.now().hour
+    hours = [(current_hour - i) % 24 for i in range(24, 0, -1)]
+    
+    # 调整数据顺序使其匹配小时顺序
+    data = []
+    for i, hour in enumerate(hours):
+        offset = (current_hour - hour) % 24
+        if offset < len(hourly_requests):
+            data.append(hourly_requests[-offset-1])
+        else:
+            data.append(0)
+            
+    return jsonify({
+        'hours': hours,
+        'data': data,
+        'avg_per_hour': sum(data) // 24 if sum(data) > 0 else 0
+    })
 
 @app.route('/rules/<path:url>')
 def convert_rules(url):
     client_ip = request.remote_addr or request.environ.get('HTTP_X_FORWARDED_FOR', '127.0.0.1')
     if not check_rate_limit(client_ip):
-        return jsonify({'error': 'Rate limit exceeded. Maximum 20 requests per minute per IP.'}), 429
+        return jsonify({'error': RATE_LIMIT_MESSAGE}), 429
     
     start_time = time.time()
     try:
+        output_format = requested_format()
         decoded_url = unquote(url)
         
         parsed = urlparse(decoded_url)
@@ -175,28 +737,32 @@ def convert_rules(url):
             update_stats(False, (time.time() - start_time) * 1000, True)
             return jsonify({'error': 'Invalid URL format'}), 400
         
-        headers = {
-            'User-Agent': 'clash-to-singbox-converter/1.0'
-        }
-        
-        response = requests.get(decoded_url, headers=headers, timeout=30)
-        response.raise_for_status()
+        cache_key = normalize_url(decoded_url)
+        refresh_scheduler.record(cache_key, decoded_url)
+        entry, state = rule_cache.lookup(cache_key)
         
-        if len(response.content) > MAX_CONTENT_SIZE:
-            update_stats(False, (time.time() - start_time) * 1000, True)
-            return jsonify({'error': f'Content too large. Maximum size is {MAX_CONTENT_SIZE//1024//1024}MB'}), 413
+        if state == 'stale' and rule_cache.begin_refresh(cache_key):
+            threading.Thread(target=refresh_cached_rules, args=(cache_key, decoded_url, entry), daemon=True).start()
         
-        converter = RuleConverter()
-        singbox_rules = converter.convert(response.text)
+        if state not in ('fresh', 'stale'):
+            # 过期条目仍携带上游校验值，用于条件请求
+            entry = rules_flight.do(cache_key, fetch_and_convert, cache_key, decoded_url, entry)
         
-        if not validate_singbox_rules(singbox_rules):
-            update_stats(False, (time.time() - start_time) * 1000, True)
-            return jsonify({'error': 'Invalid conversion result'}), 500
+        if output_format == 'srs':
+            entry = srs_entry_for(entry)
+            response = encoded_response(entry.body, entry.encoded, SRS_MIMETYPE, entry.etag)
+        else:
+            response = encoded_response(entry.body, entry.encoded, etag=entry.etag)
         
         update_stats(True, (time.time() - start_time) * 1000, True)
         
-        return jsonify(singbox_rules)
+        response.vary.add('Accept')
+        # 客户端携带 If-None-Match 且内容未变化时返回304
+        return response.make_conditional(request)
         
+    except ConversionError as e:
+        update_stats(False, (time.time() - start_time) * 1000, True)
+        return conversion_error_response(e)
     except requests.RequestException as e:
         update_stats(False, (time.time() - start_time) * 1000, True)
         return jsonify({'error': f'Failed to fetch rules: {str(e)}'}), 500
@@ -204,36 +770,80 @@ def convert_rules(url):
         update_stats(False, (time.time() - start_time) * 1000, True)
         return jsonify({'error': f'Conversion failed: {str(e)}'}), 500
 
-@app.route('/convert', methods=['POST'])
-def convert_text():
+@app.route('/merge', methods=['GET', 'POST'])
+def merge_rule_sets():
     client_ip = request.remote_addr or request.environ.get('HTTP_X_FORWARDED_FOR', '127.0.0.1')
     if not check_rate_limit(client_ip):
-        return jsonify({'error': 'Rate limit exceeded. Maximum 20 requests per minute per IP.'}), 429
+        return jsonify({'error': RATE_LIMIT_MESSAGE}), 429
     
     start_time = time.time()
     try:
-        data = request.get_json()
-        if not data or 'content' not in data:
-            update_stats(False, (time.time() - start_time) * 1000, False)
-            return jsonify({'error': 'Missing content field'}), 400
+        output_format = requested_format()
+        entry = merged_entry_for(source_entries(merge_sources()))
         
-        content = data['content']
+        if output_format == 'srs':
+            entry = srs_entry_for(entry)
+            response = encoded_response(entry.body, entry.encoded, SRS_MIMETYPE, entry.etag)
+        else:
+            response = encoded_response(entry.body, entry.encoded, etag=entry.etag)
         
-        if len(content.encode('utf-8')) > MAX_CONTENT_SIZE:
-            update_stats(False, (time.time() - start_time) * 1000, False)
-            return jsonify({'error': f'Content too large. Maximum size is {MAX_CONTENT_SIZE//1024//1024}MB'}), 413
+        update_stats(True, (time.time() - start_time) * 1000, True)
         
-        converter = RuleConverter()
-        singbox_rules = converter.convert(content)
+        response.vary.add('Accept')
+        return response.make_conditional(request)
         
-        if not validate_singbox_rules(singbox_rules):
-            update_stats(False, (time.time() - start_time) * 1000, False)
-            return jsonify({'error': 'Invalid conversion result'}), 500
+    except ConversionError as e:
+        update_stats(False, (time.time() - start_time) * 1000, True)
+        return conversion_error_response(e)
+    except Exception as e:
+        update_stats(False, (time.time() - start_time) * 1000, True)
+        return jsonify({'error': f'Conversion failed: {str(e)}'}), 500
+
+@app.route('/config', methods=['POST'])
+def convert_config():
+    client_ip = request.remote_addr or request.environ.get('HTTP_X_FORWARDED_FOR', '127.0.0.1')
+    if not check_rate_limit(client_ip):
+        return jsonify({'error': RATE_LIMIT_MESSAGE}), 429
+    
+    start_time = time.time()
+    try:
+        config, remote_base = config_request()
+        record_provider_intervals(config)
+        # 规则集与 /merge 共用按来源的缓存，已转换过的规则集直接使用缓存；远程模式下同时预热客户端随后请求的缓存
+        entries = source_entries(list(provider_sources(config).values()))
+        body = translated_config(config, entries, remote_base)
         
         update_stats(True, (time.time() - start_time) * 1000, False)
         
-        return jsonify(singbox_rules)
+        encoding = negotiate(request.accept_encodings, SUPPORTED_ENCODINGS) if len(body) >= MIN_COMPRESS_SIZE else None
+        return encoded_response(body, {encoding: compress(body, encoding)} if encoding else {})
         
+    except ConversionError as e:
+        update_stats(False, (time.time() - start_time) * 1000, False)
+        return conversion_error_response(e)
+    except Exception as e:
+        update_stats(False, (time.time() - start_time) * 1000, False)
+        return jsonify({'error': f'Conversion failed: {str(e)}'}), 500
+
+@app.route('/convert', methods=['POST'])
+def convert_text():
+    client_ip = request.remote_addr or request.environ.get('HTTP_X_FORWARDED_FOR', '127.0.0.1')
+    if not check_rate_limit(client_ip):
+        return jsonify({'error': RATE_LIMIT_MESSAGE}), 429
+    
+    start_time = time.time()
+    try:
+        content, content_bytes, behavior = convert_request()
+        entry = converted_entry_for(content, content_bytes, behavior)
+        
+        update_stats(True, (time.time() - start_time) * 1000, False)
+        
+        # 命中时直接返回缓存的序列化结果和预压缩版本
+        return encoded_response(entry.body, entry.encoded, etag=entry.etag)
+        
+    except ConversionError as e:
+        update_stats(False, (time.time() - start_time) * 1000, False)
+        return conversion_error_response(e)
     except Exception as e:
         update_stats(False, (time.time() - start_time) * 1000, False)
         return jsonify({'error': f'Conversion failed: {str(e)}'}), 500
@@ -242,7 +852,7 @@ def convert_text():
 def validate_rules():
     client_ip = request.remote_addr or request.environ.get('HTTP_X_FORWARDED_FOR', '127.0.0.1')
     if not check_rate_limit(client_ip):
-        return jsonify({'error': 'Rate limit exceeded. Maximum 20 requests per minute per IP.'}), 429
+        return jsonify({'error': RATE_LIMIT_MESSAGE}), 429
     
     try:
         data = request.get_json()
@@ -259,4 +869,6 @@ def validate_rules():
         return jsonify({'error': f'Validation failed: {str(e)}'}), 500
 
 if __name__ == '__main__':
+    warmup.start()
+    refresh_scheduler.start()
     app.run(host='0.0.0.0', port=8080, debug=False) 
\ No newline at end of file
@@ -0,0 +1,526 @@
+"""
+异步服务模式 (ASGI)
+
+提供与 app.py 相同的路由，其中 /rules/<url>、/merge、/config 和 /convert 使用异步实现：
+- 上游下载使用 httpx.AsyncClient，等待慢速上游时不占用worker，单个worker可同时处理大量下载
+- 较大的规则转换、合并和二进制规则集编码在有上限的进程池中执行，较小的在线程中执行，都不阻塞事件循环
+- 其余路由(页面、/api/*)在线程中交给Flask处理
+
+缓存、统计、限流与同步模式共用 app.py 中的对象和共享存储；sqlite 后端的读写可能等待其他worker的写锁，
+都通过 run_store 在线程中执行，不阻塞事件循环。
+
+启动: uvicorn asgi:app --host 0.0.0.0 --port 8080 --workers 2
+"""
+
+import asyncio
+import io
+import sys
+import time
+from typing import Optional
+from urllib.parse import unquote, urlparse
+
+import httpx
+from flask import jsonify, request
+from werkzeug.exceptions import HTTPException
+
+import app as core
+from app import ConversionError
+from compression import MIN_COMPRESS_SIZE, SUPPORTED_ENCODINGS, compress, negotiate
+from conversion_pool import (PoolBusyError, convert_to_json, convert_with_state, encode_srs, merge_json,
+                             update_with_state)
+from rule_cache import normalize_url
+from singleflight import AsyncSingleFlight
+from upstream import AsyncUpstreamClient, response_encoding
+
+flask_app = core.app
+
+# 与同步模式共用转换进程池，超过 CONVERT_OFFLOAD_MIN_BYTES 的转换在进程池中执行
+pool = core.conversion_pool
+
+# 合并同一事件循环内并发的相同请求
+rules_flight = AsyncSingleFlight()
+convert_flight = AsyncSingleFlight()
+srs_flight = AsyncSingleFlight()
+merge_flight = AsyncSingleFlight()
+
+# 在事件循环中创建
+upstream_client: Optional[AsyncUpstreamClient] = None
+
+# 持有后台刷新任务的引用，避免任务被回收
+background_tasks = set()
+
+
+def get_upstream_client() -> AsyncUpstreamClient:
+    global upstream_client
+    if upstream_client is None:
+        upstream_client = AsyncUpstreamClient(
+            per_host_limit=core.UPSTREAM_PER_HOST_LIMIT,
+            connect_timeout=core.UPSTREAM_CONNECT_TIMEOUT,
+            read_timeout=core.UPSTREAM_READ_TIMEOUT,
+            headers=core.UPSTREAM_HEADERS
+        )
+    return upstream_client
+
+
+def async_stats():
+    """异步模式的统计，追加到 /api/stats 的 async 字段"""
+    return {
+        'coalescing': {
+            'rules': rules_flight.get_stats(),
+            'convert': convert_flight.get_stats(),
+            'srs': srs_flight.get_stats(),
+            'merge': merge_flight.get_stats()
+        },
+        'upstream': upstream_client.get_stats() if upstream_client is not None else {}
+    }
+
+
+core.stats_providers['async'] = async_stats
+
+
+async def startup():
+    await asyncio.to_thread(pool.prewarm)
+    get_upstream_client()
+    core.warmup.start()
+    core.refresh_scheduler.start()
+
+
+async def shutdown():
+    global upstream_client
+    core.refresh_scheduler.stop()
+    if upstream_client is not None:
+        await upstream_client.aclose()
+        upstream_client = None
+    await asyncio.to_thread(pool.shutdown)
+    await asyncio.to_thread(core.shared_store.flush)
+
+
+async def run_store(fn, *args):
+    """执行访问共享存储的调用，sqlite 后端在线程中执行；进程内存储不会等待，直接调用"""
+    if core.shared_store.shared:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+async def run_in_pool(fn, *args):
+    """在进程池中执行，排队已满时返回503"""
+    try:
+        return await pool.run(fn, *args)
+    except PoolBusyError as e:
+        raise core.server_busy_error(e) from None
+
+
+async def run_converter(size: int, fn, *args):
+    """执行转换：与同步模式相同，小于 CONVERT_OFFLOAD_MIN_BYTES 的输入在线程中转换，
+    不占用进程池的排队名额，并发的小文件转换不会因排队已满返回503；较大的输入在进程池中转换"""
+    if size < core.CONVERT_OFFLOAD_MIN_BYTES:
+        return await asyncio.to_thread(fn, *args)
+    return await run_in_pool(fn, *args)
+
+
+async def fetch_and_convert(cache_key: str, url: str, entry=None, behavior: Optional[str] = None):
+    """异步下载上游规则并在进程池中转换，结果写入缓存；上游返回304时复用旧结果"""
+    headers = entry.conditional_headers() if entry is not None else None
+
+    async with get_upstream_client().stream(url, headers=headers) as response:
+        if response.status_code == 304 and entry is not None:
+            return await run_store(core.rule_cache.renew, cache_key, entry)
+        response.raise_for_status()
+
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > core.MAX_CONTENT_SIZE:
+            raise core.content_too_large_error()
+
+        # 超过大小限制时立即中止下载
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes(core.DOWNLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > core.MAX_CONTENT_SIZE:
+                raise core.content_too_large_error()
+            chunks.append(chunk)
+
+        encoding = response_encoding(response.headers)
+        upstream_etag = response.headers.get('ETag')
+        upstream_last_modified = response.headers.get('Last-Modified')
+
+    data = b''.join(chunks)
+    args = (data, encoding, core.OPTIMIZE_DOMAINS, core.AGGREGATE_CIDRS, behavior)
+    state = core.incremental_states.take(cache_key)
+    large = len(data) >= core.CONVERT_OFFLOAD_MIN_BYTES
+    body = None
+    if state is not None and large:
+        # 与同步模式相同，较大的内容连同解析状态交给进程池按行比较，排队已满时放回原状态
+        try:
+            result = await run_in_pool(update_with_state, state, *args)
+        except ConversionError:
+            core.incremental_states.put(cache_key, state)
+            raise
+        body = core.keep_pooled_update(cache_key, result)
+    elif state is not None:
+        # 已有上次的解析状态时只转换变化的行，在线程中执行，不阻塞事件循环
+        body = await asyncio.to_thread(core.apply_incremental, cache_key, state, data, encoding)
+    if body is None:
+        # 与同步模式相同，只为较大的内容建立解析状态
+        if core.incremental_states.enabled and (large or state is not None):
+            body, state = await run_converter(len(data), convert_with_state, *args)
+            body = core.keep_incremental(cache_key, body, state)
+        else:
+            body = await run_converter(len(data), convert_to_json, *args)
+            if body is None:
+                raise ConversionError('Invalid conversion result', 500)
+
+    # 写入缓存时生成压缩版本，放到线程中执行
+    return await asyncio.to_thread(core.rule_cache.store, cache_key, body, upstream_etag, upstream_last_modified)
+
+
+async def refresh_cached_rules(cache_key: str, url: str, entry, behavior: Optional[str] = None):
+    """后台刷新过期的缓存条目，失败时保留旧结果"""
+    try:
+        await rules_flight.do(cache_key, fetch_and_convert, cache_key, url, entry, behavior)
+    except Exception as e:
+        print(f"后台刷新失败 {url}: {e}")
+    finally:
+        await run_store(core.rule_cache.end_refresh, cache_key)
+
+
+def start_refresh(cache_key: str, url: str, entry, behavior: Optional[str] = None):
+    """在后台任务中刷新过期的缓存条目"""
+    task = asyncio.create_task(refresh_cached_rules(cache_key, url, entry, behavior))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def fetch_source(cache_key: str, url: str, entry, behavior: Optional[str]):
+    """下载并转换一个来源，下载失败时在错误信息中注明来源"""
+    try:
+        return await rules_flight.do(cache_key, fetch_and_convert, cache_key, url, entry, behavior)
+    except httpx.HTTPError as e:
+        raise ConversionError(f'Failed to fetch rules from {url}: {str(e)}', 500) from None
+
+
+async def source_entries(sources: list) -> list:
+    """获取各来源的转换结果，未命中缓存的来源并发下载"""
+    entries = []
+    pending = {}
+    for index, (url, behavior) in enumerate(sources):
+        cache_key = core.source_cache_key(url, behavior)
+        core.refresh_scheduler.record(cache_key, url, behavior)
+        entry, state = await run_store(core.rule_cache.lookup, cache_key)
+
+        if state == 'stale' and await run_store(core.rule_cache.begin_refresh, cache_key):
+            start_refresh(cache_key, url, entry, behavior)
+
+        if state not in ('fresh', 'stale'):
+            pending[index] = fetch_source(cache_key, url, entry, behavior)
+        entries.append(entry)
+
+    for index, entry in zip(pending, await asyncio.gather(*pending.values())):
+        entries[index] = entry
+    return entries
+
+
+async def build_merged(merge_key: str, entries: list):
+    """合并各来源的转换结果并写入缓存"""
+    bodies = [entry.body for entry in entries]
+    body = await run_converter(sum(len(body) for body in bodies), merge_json, bodies, core.OPTIMIZE_DOMAINS,
+                               core.AGGREGATE_CIDRS)
+    return await asyncio.to_thread(core.merge_cache.store, merge_key, body)
+
+
+async def merged_entry_for(entries: list):
+    """获取多个来源合并后的结果，来源均未变化时直接返回缓存"""
+    merge_key = core.merge_cache_key(entries)
+    entry, state = await run_store(core.merge_cache.lookup, merge_key)
+    if state in ('fresh', 'stale'):
+        return entry
+    return await merge_flight.do(merge_key, build_merged, merge_key, entries)
+
+
+async def encode_srs_entry(entry):
+    """把JSON结果编码为二进制规则集"""
+    body = await run_converter(len(entry.body), encode_srs, entry.body)
+    return await asyncio.to_thread(core.srs_cache.store, entry.etag, body)
+
+
+async def srs_entry_for(entry):
+    """获取JSON结果对应的二进制规则集，内容相同的结果只编码一次"""
+    srs_entry, state = await run_store(core.srs_cache.lookup, entry.etag)
+    if state in ('fresh', 'stale'):
+        return srs_entry
+    return await srs_flight.do(entry.etag, encode_srs_entry, entry)
+
+
+async def store_converted(cache_key: str, content_bytes: bytes, behavior: Optional[str] = None):
+    """转换文本内容并写入缓存"""
+    body = await run_converter(len(content_bytes), convert_to_json, content_bytes, 'utf-8', core.OPTIMIZE_DOMAINS,
+                               core.AGGREGATE_CIDRS, behavior)
+    if body is None:
+        raise ConversionError('Invalid conversion result', 500)
+    return await asyncio.to_thread(core.convert_cache.store, cache_key, body)
+
+
+async def converted_entry_for(content_bytes: bytes, behavior: Optional[str] = None):
+    """获取文本内容的转换结果，与同步模式共用缓存"""
+    cache_key = core.content_cache_key(content_bytes, behavior)
+    entry, state = await run_store(core.convert_cache.lookup, cache_key)
+    if state in ('fresh', 'stale'):
+        return await run_store(core.cached_content_hit, entry, content_bytes)
+    return await convert_flight.do(cache_key, store_converted, cache_key, content_bytes, behavior)
+
+
+async def convert_rules(url):
+    client_ip = request.remote_addr or request.environ.get('HTTP_X_FORWARDED_FOR', '127.0.0.1')
+    if not await run_store(core.check_rate_limit, client_ip):
+        return jsonify({'error': core.RATE_LIMIT_MESSAGE}), 429
+
+    start_time = time.time()
+    try:
+        output_format = core.requested_format()
+        decoded_url = unquote(url)
+
+        parsed = urlparse(decoded_url)
+        if not parsed.scheme or not parsed.netloc:
+            await run_store(core.update_stats, False, (time.time() - start_time) * 1000, True)
+            return jsonify({'error': 'Invalid URL format'}), 400
+
+        cache_key = normalize_url(decoded_url)
+        core.refresh_scheduler.record(cache_key, decoded_url)
+        entry, state = await run_store(core.rule_cache.lookup, cache_key)
+
+        if state == 'stale' and await run_store(core.rule_cache.begin_refresh, cache_key):
+            start_refresh(cache_key, decoded_url, entry)
+
+        if state not in ('fresh', 'stale'):
+            # 过期条目仍携带上游校验值，用于条件请求
+            entry = await rules_flight.do(cache_key, fetch_and_convert, cache_key, decoded_url, entry)
+
+        if output_format == 'srs':
+            entry = await srs_entry_for(entry)
+            response = core.encoded_response(entry.body, entry.encoded, core.SRS_MIMETYPE, entry.etag)
+        else:
+            response = core.encoded_response(entry.body, entry.encoded, etag=entry.etag)
+
+        await run_store(core.update_stats, True, (time.time() - start_time) * 1000, True)
+
+        response.vary.add('Accept')
+        # 客户端携带 If-None-Match 且内容未变化时返回304
+        return response.make_conditional(request)
+
+    except ConversionError as e:
+        await run_store(core.update_stats, False, (time.time() - start_time) * 1000, True)
+        return core.conversion_error_response(e)
+    except httpx.HTTPError as e:
+        await run_store(core.update_stats, False, (time.time() - start_time) * 1000, True)
+        return jsonify({'error': f'Failed to fetch rules: {str(e)}'}), 500
+    except Exception as e:
+        await run_store(core.update_stats, False, (time.time() - start_time) * 1000, True)
+        return jsonify({'error': f'Conversion failed: {str(e)}'}), 500
+
+
+async def merge_rule_sets():
+    client_ip = request.remote_addr or request.environ.get('HTTP_X_FORWARDED_FOR', '127.0.0.1')
+    if not await run_store(core.check_rate_limit, client_ip):
+        return jsonify({'error': core.RATE_LIMIT_MESSAGE}), 429
+
+    start_time = time.time()
+    try:
+        output_format = core.requested_format()
+        entry = await merged_entry_for(await source_entries(core.merge_sources()))
+
+        if output_format == 'srs':
+            entry = await srs_entry_for(entry)
+            response = core.encoded_response(entry.body, entry.encoded, core.SRS_MIMETYPE, entry.etag)
+        else:
+            response = core.encoded_response(entry.body, entry.encoded, etag=entry.etag)
+
+        await run_store(core.update_stats, True, (time.time() - start_time) * 1000, True)
+
+        response.vary.add('Accept')
+        return response.make_conditional(request)
+
+    except ConversionError as e:
+        await run_store(core.update_stats, False, (time.time() - start_time) * 1000, True)
+        return core.conversion_error_response(e)
+    except Exception as e:
+        await run_store(core.update_stats, False, (time.time() - start_time) * 1000, True)
+        return jsonify({'error': f'Conversion failed: {str(e)}'}), 500
+
+
+async def convert_config():
+    client_ip = request.remote_addr or request.environ.get('HTTP_X_FORWARDED_FOR', '127.0.0.1')
+    if not await run_store(core.check_rate_limit, client_ip):
+        return jsonify({'error': core.RATE_LIMIT_MESSAGE}), 429
+
+    start_time = time.time()
+    try:
+        # 解析请求体(最大 MAX_CONTENT_SIZE 的 JSON 或 YAML)在线程中执行，不阻塞事件循环
+        config, remote_base = await asyncio.to_thread(core.config_request)
+        core.record_provider_intervals(config)
+        entries = await source_entries(list(core.provider_sources(config).values()))
+        body = await asyncio.to_thread(core.translated_config, config, entries, remote_base)
+
+        await run_store(core.update_stats, True, (time.time() - start_time) * 1000, False)
+
+        encoding = negotiate(request.accept_encodings, SUPPORTED_ENCODINGS) if len(body) >= MIN_COMPRESS_SIZE else None
+        encoded = {encoding: await asyncio.to_thread(compress, body, encoding)} if encoding else {}
+        return core.encoded_response(body, encoded)
+
+    except ConversionError as e:
+        await run_store(core.update_stats, False, (time.time() - start_time) * 1000, False)
+        return core.conversion_error_response(e)
+    except Exception as e:
+        await run_store(core.update_stats, False, (time.time() - start_time) * 1000, False)
+        return jsonify({'error': f'Conversion failed: {str(e)}'}), 500
+
+
+async def convert_text():
+    client_ip = request.remote_addr or request.environ.get('HTTP_X_FORWARDED_FOR', '127.0.0.1')
+    if not await run_store(core.check_rate_limit, client_ip):
+        return jsonify({'error': core.RATE_LIMIT_MESSAGE}), 429
+
+    start_time = time.time()
+    try:
+        _, content_bytes, behavior = await asyncio.to_thread(core.convert_request)
+        entry = await converted_entry_for(content_bytes, behavior)
+
+        await run_store(core.update_stats, True, (time.time() - start_time) * 1000, False)
+
+        return core.encoded_response(entry.body, entry.encoded, etag=entry.etag)
+
+    except ConversionError as e:
+        await run_store(core.update_stats, False, (time.time() - start_time) * 1000, False)
+        return core.conversion_error_response(e)
+    except Exception as e:
+        await run_store(core.update_stats, False, (time.time() - start_time) * 1000, False)
+        return jsonify({'error': f'Conversion failed: {str(e)}'}), 500
+
+
+# 使用异步实现的Flask端点，其余端点交给Flask处理
+ASYNC_VIEWS = {
+    'convert_rules': convert_rules,
+    'merge_rule_sets': merge_rule_sets,
+    'convert_config': convert_config,
+    'convert_text': convert_text
+}
+
+
+def build_environ(scope, body: bytes):
+    """把ASGI请求转换为WSGI environ，供Flask的请求上下文和路由匹配使用"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('127.0.0.1', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def call_wsgi(environ):
+    """同步调用Flask应用，返回 (状态码, 响应头, 响应体)"""
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(' ', 1)[0]), headers]
+
+    result = flask_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return started[0], started[1], body
+
+
+async def read_body(receive, limit: int) -> Optional[bytes]:
+    """读取请求体，超过上限时返回None"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_response(send, status: int, headers, body: bytes):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await startup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI入口"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    body = await read_body(receive, core.MAX_CONTENT_SIZE)
+    if body is None:
+        with flask_app.app_context():
+            response = flask_app.make_response(core.request_entity_too_large(None))
+        await send_response(send, response.status_code, response.headers.items(), response.get_data())
+        return
+
+    environ = build_environ(scope, body)
+    try:
+        endpoint, args = flask_app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        endpoint, args = None, {}
+
+    view = ASYNC_VIEWS.get(endpoint)
+    if view is None:
+        status, headers, response_body = await asyncio.to_thread(call_wsgi, environ)
+        await send_response(send, status, headers, response_body)
+        return
+
+    with flask_app.request_context(environ):
+        try:
+            response = flask_app.make_response(await view(**args))
+        except Exception as e:
+            response = flask_app.make_response((jsonify({'error': f'Conversion failed: {str(e)}'}), 500))
+        response_body = b'' if scope['method'] == 'HEAD' else response.get_data()
+    await send_response(send, response.status_code, response.headers.items(), response_body)
@@ -0,0 +1,268 @@
+"""
+批量转换
+
+在一个进程中转换清单文件或目录中的全部规则集，省去逐个调用命令行时的解释器启动和模块导入：
+- 清单文件为YAML或JSON格式，逐项指定输入、输出和behavior
+- 目录模式转换目录下全部规则文件，按相对路径写入输出目录
+- 状态文件记录每个输出对应的输入内容哈希和转换选项，未变化的输入直接跳过
+
+清单文件示例::
+
+    output_dir: dist        # 可选，相对于清单文件所在目录，默认为清单文件所在目录
+    format: srs             # 可选，各条目的默认输出格式
+    rules:
+      - input: lists/ads.txt
+        output: ads.srs
+        behavior: domain
+      - input: lists/cn.yaml  # 省略 output 时为 <输入文件名>.json 或 .srs
+"""
+
+import functools
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from rule_converter import RuleConverter, render_rules
+from sources import BEHAVIORS
+
+# 目录模式下转换的文件扩展名
+RULE_FILE_SUFFIXES = ('.txt', '.list', '.yaml', '.yml')
+
+# 默认状态文件名，位于输出目录中
+STATE_FILE_NAME = '.rule_converter_state.json'
+
+STATE_VERSION = 1
+
+OUTPUT_FORMATS = ('json', 'srs')
+
+
+class BatchError(ValueError):
+    """清单或目录无法解析"""
+
+
+def output_name(input_path: str, output_format: str) -> str:
+    """省略输出路径时，输出文件名为输入文件名换成对应格式的扩展名"""
+    return os.path.splitext(os.path.basename(input_path))[0] + '.' + output_format
+
+
+def load_manifest(path: str, output_dir: Optional[str], defaults: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], str]:
+    """解析清单文件，返回转换条目和输出目录"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    if isinstance(data, list):
+        data = {'rules': data}
+    if not isinstance(data, dict) or not isinstance(data.get('rules'), list):
+        raise BatchError("清单文件应为规则列表，或包含 rules 列表的对象")
+
+    if output_dir is None:
+        output_dir = os.path.join(base_dir, data.get('output_dir') or '.')
+    default_format = data.get('format', defaults['output_format'])
+
+    entries = []
+    for index, item in enumerate(data['rules'], 1):
+        if isinstance(item, str):
+            item = {'input': item}
+        if not isinstance(item, dict) or not isinstance(item.get('input'), str):
+            raise BatchError(f"清单第 {index} 项缺少 input")
+
+        output_format = item.get('format', default_format)
+        behavior = item.get('behavior', defaults['behavior'])
+        if output_format not in OUTPUT_FORMATS:
+            raise BatchError(f"清单第 {index} 项的 format 无效: {output_format}")
+        if behavior is not None and behavior not in BEHAVIORS:
+            raise BatchError(f"清单第 {index} 项的 behavior 无效: {behavior}")
+
+        output = item.get('output') or output_name(item['input'], output_format)
+        entries.append({
+            'input': os.path.normpath(os.path.join(base_dir, item['input'])),
+            'output': os.path.normpath(os.path.join(output_dir, output)),
+            'behavior': behavior,
+            'format': output_format
+        })
+    return entries, output_dir
+
+
+def scan_directory(path: str, output_dir: Optional[str], defaults: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], str]:
+    """收集目录下的全部规则文件，输出按相对路径写入输出目录"""
+    if output_dir is None:
+        raise BatchError("目录模式需要使用 -o 指定输出目录")
+
+    output_dir = os.path.abspath(output_dir)
+    entries = []
+    for root, dirs, files in os.walk(path):
+        # 输出目录位于输入目录内时不再转换已生成的文件
+        dirs[:] = sorted(name for name in dirs if os.path.abspath(os.path.join(root, name)) != output_dir)
+        for name in sorted(files):
+            if not name.lower().endswith(RULE_FILE_SUFFIXES):
+                continue
+            input_path = os.path.join(root, name)
+            relative_dir = os.path.relpath(root, path)
+            entries.append({
+                'input': input_path,
+                'output': os.path.normpath(os.path.join(output_dir, relative_dir,
+                                                        output_name(name, defaults['output_format']))),
+                'behavior': defaults['behavior'],
+                'format': defaults['output_format']
+            })
+    return entries, output_dir
+
+
+def file_digest(path: str) -> str:
+    """计算文件内容的哈希"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_state(path: str) -> Dict[str, Any]:
+    """读取状态文件，文件不存在或格式不符时视为空状态"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+        return {}
+    return state.get('outputs') or {}
+
+
+def save_state(path: str, outputs: Dict[str, Any]):
+    """先写临时文件再替换，转换中断时不会留下不完整的状态文件"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': STATE_VERSION, 'outputs': outputs}, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def convert_entry(entry: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+    """转换一个条目并写入输出文件，在进程池的子进程中执行"""
+    start = time.perf_counter()
+    converter = RuleConverter(optimize_domains=options['optimize_domains'],
+                              aggregate_cidrs=options['aggregate_cidrs'])
+    result = converter.convert_file(entry['input'], entry['behavior'])
+    body = render_rules(result, entry['format'], options['pretty'])
+
+    os.makedirs(os.path.dirname(entry['output']) or '.', exist_ok=True)
+    temp_path = entry['output'] + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(body)
+    os.replace(temp_path, entry['output'])
+
+    stats = converter.get_conversion_stats()
+    return {
+        'rules': stats['converted_rules'],
+        'size': len(body),
+        'elapsed': time.perf_counter() - start
+    }
+
+
+def run_batch(source: str, output_dir: Optional[str] = None, jobs: int = 1, state_path: Optional[str] = None,
+              force: bool = False, behavior: Optional[str] = None, output_format: str = 'json',
+              pretty: bool = False, optimize_domains: bool = False, aggregate_cidrs: bool = False) -> int:
+    """批量转换清单文件或目录中的规则集，打印每个文件的耗时，有转换失败时返回1"""
+    start = time.perf_counter()
+    defaults = {'behavior': behavior, 'output_format': output_format}
+    options = {'pretty': pretty, 'optimize_domains': optimize_domains, 'aggregate_cidrs': aggregate_cidrs}
+
+    try:
+        if os.path.isdir(source):
+            entries, output_dir = scan_directory(source, output_dir, defaults)
+        elif os.path.isfile(source):
+            entries, output_dir = load_manifest(source, output_dir, defaults)
+        else:
+            raise BatchError(f"清单文件或目录 '{source}' 不存在")
+    except (BatchError, OSError, yaml.YAMLError) as e:
+        print(f"错误: {e}")
+        return 1
+
+    duplicates = sorted(output for output, count in Counter(entry['output'] for entry in entries).items() if count > 1)
+    if duplicates:
+        print(f"错误: 多个输入写入同一输出文件: {', '.join(duplicates)}")
+        return 1
+
+    state_path = state_path or os.path.join(output_dir, STATE_FILE_NAME)
+    previous = {} if force else load_state(state_path)
+    state = {}
+    results = {}
+
+    # 输入内容和转换选项都未变化且输出文件仍存在时跳过
+    pending = []
+    for entry in entries:
+        try:
+            digest = file_digest(entry['input'])
+        except OSError as e:
+            results[entry['output']] = {'status': '失败', 'error': str(e)}
+            continue
+        record = {
+            'input': os.path.abspath(entry['input']),
+            'digest': digest,
+            'behavior': entry['behavior'],
+            'format': entry['format'],
+            **options
+        }
+        if previous.get(entry['output']) == record and os.path.exists(entry['output']):
+            state[entry['output']] = record
+            results[entry['output']] = {'status': '跳过'}
+        else:
+            pending.append((entry, record))
+
+    # 多个条目时在进程池中并行转换，只有一个进程时直接在当前进程中转换
+    executor = None
+    if jobs > 1 and len(pending) > 1:
+        executor = ProcessPoolExecutor(min(jobs, len(pending)))
+        waits = [executor.submit(convert_entry, entry, options).result for entry, _ in pending]
+    else:
+        waits = [functools.partial(convert_entry, entry, options) for entry, _ in pending]
+    try:
+        for (entry, record), wait in zip(pending, waits):
+            try:
+                summary = wait()
+            except Exception as e:
+                results[entry['output']] = {'status': '失败', 'error': str(e)}
+                continue
+            state[entry['output']] = record
+            results[entry['output']] = {'status': '转换', **summary}
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    try:
+        save_state(state_path, state)
+    except OSError as e:
+        print(f"警告: 无法写入状态文件: {e}")
+
+    print_summary(entries, results, time.perf_counter() - start)
+    return 1 if any(result['status'] == '失败' for result in results.values()) else 0
+
+
+def print_summary(entries: List[Dict[str, Any]], results: Dict[str, Dict[str, Any]], elapsed: float):
+    """打印每个文件的转换结果和耗时"""
+    print(f"{'状态':<4}{'耗时':>10}{'规则数':>10}{'输出大小':>12}  输入 -> 输出")
+    counts = {'转换': 0, '跳过': 0, '失败': 0}
+    convert_time = 0.0
+    for entry in entries:
+        result = results[entry['output']]
+        status = result['status']
+        counts[status] += 1
+        if status == '转换':
+            convert_time += result['elapsed']
+            print(f"{status:<4}{result['elapsed']:>9.3f}s{result['rules']:>10,}{result['size'] / 1024:>10.1f}KB"
+                  f"  {entry['input']} -> {entry['output']}")
+        elif status == '跳过':
+            print(f"{status:<4}{'-':>10}{'-':>10}{'-':>12}  {entry['input']} -> {entry['output']}")
+        else:
+            print(f"{status:<4}{'-':>10}{'-':>10}{'-':>12}  {entry['input']}: {result['error']}")
+
+    print(f"共 {len(entries)} 个: 转换 {counts['转换']}，跳过 {counts['跳过']}，失败 {counts['失败']}；"
+          f"转换耗时合计 {convert_time:.3f}s，总耗时 {elapsed:.3f}s")
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+转换器性能基准测试
+
+生成与线上规模相近的合成规则文件，分别统计格式检测耗时和完整转换耗时：
+- text-domain: 纯域名列表
+- text-classical: Clash classical 规则列表
+- yaml: payload 形式的 Rule Provider
+"""
+
+import argparse
+import gzip
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from conversion_pool import serialize_rules
+from incremental import IncrementalState
+from rule_converter import DOMAIN_BATCH_SIZE, RuleConverter
+from srs import read_rule_set, write_rule_set
+
+
+def generate_domain_list(count: int) -> str:
+    """生成纯域名列表"""
+    lines = ['# domain list']
+    for i in range(count):
+        prefix = '.' if i % 3 == 0 else ''
+        lines.append(f"{prefix}host{i}.example{i % 997}.com")
+    return '\n'.join(lines) + '\n'
+
+
+def generate_classical_list(count: int) -> str:
+    """生成classical规则列表"""
+    rng = random.Random(42)
+    templates = [
+        'DOMAIN-SUFFIX,site{}.com',
+        'DOMAIN,www.host{}.net',
+        'DOMAIN-KEYWORD,keyword{}',
+        'IP-CIDR,10.{}.0.0/16,no-resolve',
+        'IP-CIDR6,2001:db8:{:x}::/48,no-resolve',
+        'DST-PORT,{}',
+        'PROCESS-PATH,/usr/bin/app{}',
+    ]
+    lines = ['# classical list']
+    for i in range(count):
+        template = rng.choice(templates)
+        value = i % 250 if 'IP-CIDR,' in template else i % 60000 + 1 if 'PORT' in template else i
+        lines.append(template.format(value))
+    return '\n'.join(lines) + '\n'
+
+
+def generate_yaml_provider(count: int) -> str:
+    """生成YAML格式的Rule Provider"""
+    lines = ['payload:']
+    for i in range(count):
+        if i % 2:
+            lines.append(f"  - 'DOMAIN-SUFFIX,site{i}.com'")
+        else:
+            lines.append(f"  - DOMAIN,www.host{i}.net")
+    return '\n'.join(lines) + '\n'
+
+
+def time_call(func, repeat: int) -> float:
+    """多次执行取最短耗时"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_format_detection(inputs, repeat: int):
+    """格式检测与完整转换耗时"""
+    print("输入                    大小        检测格式    检测耗时    转换耗时")
+    for name, content in inputs.items():
+        converter = RuleConverter()
+        detected = converter.detect_rule_provider_format(content)
+        detect_time = time_call(lambda: converter.detect_rule_provider_format(content), repeat)
+        convert_time = time_call(lambda: RuleConverter().convert(content), repeat)
+        size_kb = len(content.encode('utf-8')) / 1024
+        print(f"{name:<16}{size_kb:>10.1f}KB{str(detected):>16}{detect_time:>11.4f}s{convert_time:>11.4f}s")
+    print()
+
+
+def legacy_classical(rules):
+    """逐行 parse_rule_line + convert_single_rule + merge_rules 的转换路径，作为对照"""
+    converter = RuleConverter()
+    converted_rules = []
+    for rule in rules:
+        parsed_rule = converter.parse_rule_line(rule)
+        if parsed_rule:
+            converted_rule = converter.convert_single_rule(parsed_rule)
+            if converted_rule:
+                converted_rules.append(converted_rule)
+    return converter.merge_rules(converted_rules)
+
+
+def bench_classical_throughput(count: int, repeat: int):
+    """classical规则逐行转换吞吐量"""
+    rules = generate_classical_list(count).split('\n')[1:-1]
+
+    legacy_time = time_call(lambda: legacy_classical(rules), repeat)
+    dispatch_time = time_call(lambda: RuleConverter().convert_by_behavior(rules, 'classical'), repeat)
+
+    print(f"classical 逐行转换吞吐量 ({len(rules):,} 行)")
+    print(f"  逐行解析+合并: {legacy_time:.4f}s  {len(rules) / legacy_time:>12,.0f} 行/秒")
+    print(f"  分发表:        {dispatch_time:.4f}s  {len(rules) / dispatch_time:>12,.0f} 行/秒")
+    print(f"  加速比:        {legacy_time / dispatch_time:.2f}x")
+    print()
+
+
+def bench_parallel(count: int, repeat: int):
+    """命令行 --jobs 分块并行转换大文件的耗时"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'classical.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(generate_classical_list(count))
+        size = os.path.getsize(path)
+
+        print(f"classical 大文件并行转换 ({count:,} 行, {size / 1024 / 1024:.1f} MB, {os.cpu_count()} 核)")
+        baseline = None
+        for jobs in (1, 2, 4, 8):
+            elapsed = time_call(lambda: RuleConverter().convert_file(path, jobs=jobs), repeat)
+            baseline = baseline or elapsed
+            print(f"  {jobs} 进程: {elapsed:.4f}s  {count / elapsed:>12,.0f} 行/秒  加速比 {baseline / elapsed:.2f}x")
+    print()
+
+
+def bench_domain_validation(count: int, repeat: int):
+    """域名格式校验吞吐量"""
+    domains = generate_domain_list(count).split('\n')[1:-1]
+    domains = [domain.lstrip('.') for domain in domains]
+    converter = RuleConverter()
+
+    def per_line():
+        return [converter.is_valid_domain(domain) for domain in domains]
+
+    def bulk():
+        for start in range(0, len(domains), DOMAIN_BATCH_SIZE):
+            batch = domains[start:start + DOMAIN_BATCH_SIZE]
+            valid = converter.filter_valid_domains(batch)
+            [domain in valid for domain in batch]
+
+    per_line_time = time_call(per_line, repeat)
+    bulk_time = time_call(bulk, repeat)
+
+    print(f"域名格式校验 ({len(domains):,} 个)")
+    print(f"  逐个校验: {per_line_time:.4f}s  {len(domains) / per_line_time:>12,.0f} 个/秒")
+    print(f"  批量校验: {bulk_time:.4f}s  {len(domains) / bulk_time:>12,.0f} 个/秒")
+    print()
+
+
+def bench_srs(inputs, repeat: int):
+    """JSON源格式与二进制规则集的体积和编码/解码耗时"""
+    print("输出格式            JSON大小   JSON(gzip)     SRS大小    JSON编码     SRS编码     SRS解码")
+    for name, content in inputs.items():
+        result = RuleConverter().convert(content)
+        json_body = json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        srs_body = write_rule_set(result)
+
+        json_time = time_call(lambda: json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), repeat)
+        srs_time = time_call(lambda: write_rule_set(result), repeat)
+        read_time = time_call(lambda: read_rule_set(srs_body), repeat)
+        gzip_size = len(gzip.compress(json_body))
+        print(f"{name:<16}{len(json_body) / 1024:>10.1f}KB{gzip_size / 1024:>11.1f}KB{len(srs_body) / 1024:>10.1f}KB"
+              f"{json_time:>11.4f}s{srs_time:>11.4f}s{read_time:>11.4f}s")
+    print()
+
+
+def bench_incremental(count: int, repeat: int):
+    """上游内容小幅变化时，增量重新转换与完整转换(含序列化)的耗时"""
+    generators = {
+        'text-domain': generate_domain_list,
+        'text-classical': generate_classical_list,
+        'yaml': generate_yaml_provider,
+    }
+    print(f"增量重新转换 ({count:,} 行，新增和删除相同行数)")
+    print("输入              变化行数    完整转换    增量转换    加速比")
+    for name, generate in generators.items():
+        old = generate(count)
+        for changed in (20, count // 100, count // 10):
+            # 追加 changed 行新规则，并删去开头之后的 changed 行
+            lines = generate(count + changed).split('\n')
+            del lines[20:20 + changed]
+            new = '\n'.join(lines)
+
+            converter = RuleConverter()
+            full_time = time_call(lambda: serialize_rules(converter.convert(new)), repeat)
+            state = IncrementalState.build(old, None, converter)
+            contents = itertools.cycle([new, old])
+            incremental_time = time_call(lambda: serialize_rules(state.update(next(contents), converter)), repeat)
+            print(f"{name:<16}{changed * 2:>10,}{full_time:>11.4f}s{incremental_time:>11.4f}s"
+                  f"{full_time / incremental_time:>9.2f}x")
+    print()
+
+
+def bench_memory(counts, repeat: int):
+    """转换(含序列化)过程中 tracemalloc 记录的内存峰值，不含输入内容本身"""
+    generators = {
+        'text-domain': generate_domain_list,
+        'text-classical': generate_classical_list,
+        'yaml': generate_yaml_provider,
+    }
+    print("转换内存占用")
+    print("输入                  行数    输入大小    内存峰值    峰值/输入      耗时")
+    for count in counts:
+        for name, generate in generators.items():
+            content = generate(count)
+            tracemalloc.start()
+            serialize_rules(RuleConverter().convert(content))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            # tracemalloc 会拖慢分配，耗时单独测量
+            elapsed = time_call(lambda: serialize_rules(RuleConverter().convert(content)), repeat)
+            print(f"{name:<16}{count:>10,}{len(content) / 1048576:>10.1f}MB{peak / 1048576:>10.1f}MB"
+                  f"{peak / len(content):>11.1f}x{elapsed:>9.2f}s")
+            del content
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='规则转换器性能基准测试')
+    parser.add_argument('--lines', type=int, default=39531, help='每种输入的规则行数 (默认: 39531)')
+    parser.add_argument('--repeat', type=int, default=3, help='每项测试重复次数，取最短耗时 (默认: 3)')
+    parser.add_argument('--throughput-lines', type=int, default=1000000,
+                        help='classical吞吐量测试的规则行数 (默认: 1000000)')
+    parser.add_argument('--parallel-lines', type=int, default=2000000,
+                        help='并行转换测试的规则行数 (默认: 2000000)')
+    parser.add_argument('--memory-lines', default='100000,1000000,5000000',
+                        help='内存峰值测试的规则行数，逗号分隔 (默认: 100000,1000000,5000000)')
+    args = parser.parse_args()
+
+    print("规则转换器性能基准测试")
+    print("=" * 68)
+
+    inputs = {
+        'text-domain': generate_domain_list(args.lines),
+        'text-classical': generate_classical_list(args.lines),
+        'yaml': generate_yaml_provider(args.lines),
+    }
+    bench_format_detection(inputs, args.repeat)
+    bench_classical_throughput(args.throughput_lines, args.repeat)
+    bench_domain_validation(args.throughput_lines, args.repeat)
+    bench_parallel(args.parallel_lines, args.repeat)
+    bench_srs(inputs, args.repeat)
+    bench_incremental(args.lines, args.repeat)
+    bench_memory([int(count) for count in args.memory_lines.split(',')], args.repeat)
+
+
+if __name__ == '__main__':
+    main()
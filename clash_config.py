@@ -0,0 +1,257 @@
+"""
+Clash配置到Sing-box路由的转换
+
+解析完整的Clash配置，把 rule-providers 和 rules 转换为Sing-box的 route.rule_set + route.rules：
+- 规则集按声明的 behavior 通过 convert_by_behavior 转换，下载和缓存由调用方负责
+- RULE-SET,name,policy 转换为引用同名规则集的路由规则
+- 其他规则按原顺序转换，连续使用同一策略的规则合并为一组
+- MATCH 转换为 route.final
+
+规则集默认内联到输出中；指定远程地址时输出为指向本服务的远程二进制规则集，由客户端按 interval 更新。
+"""
+
+import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlparse
+
+import requests
+import yaml
+
+from rule_converter import RuleConverter
+from sources import BEHAVIORS
+
+# Clash内置策略对应的Sing-box路由动作
+BUILTIN_POLICIES = {
+    'DIRECT': {'outbound': 'direct'},
+    'REJECT': {'action': 'reject'},
+    'REJECT-DROP': {'action': 'reject', 'method': 'drop'}
+}
+
+
+class ClashConfigError(ValueError):
+    """配置无法解析"""
+
+
+def load_config(content: str) -> Dict[str, Any]:
+    """解析Clash配置，至少需要包含 rules 列表"""
+    try:
+        config = yaml.safe_load(content)
+    except yaml.YAMLError as e:
+        raise ClashConfigError(f'Invalid YAML: {e}') from None
+    if not isinstance(config, dict) or not isinstance(config.get('rules'), list):
+        raise ClashConfigError('Config must contain a rules list')
+    providers = config.get('rule-providers') or {}
+    if not isinstance(providers, dict):
+        raise ClashConfigError('rule-providers must be a mapping')
+    return config
+
+
+def split_rule(rule: str) -> Tuple[str, str, Optional[str]]:
+    """拆分规则为 (类型, 参数, 策略)，MATCH 没有参数"""
+    parts = [part.strip() for part in str(rule).split(',')]
+    rule_type = parts[0].upper()
+    if rule_type == 'MATCH':
+        return rule_type, '', parts[1] if len(parts) > 1 else None
+    if len(parts) < 3:
+        return rule_type, parts[1] if len(parts) > 1 else '', None
+    return rule_type, parts[1], parts[2]
+
+
+def provider_behavior(provider: Dict[str, Any]) -> str:
+    """规则集声明的behavior，未声明时Clash默认为 classical"""
+    return str(provider.get('behavior') or 'classical').lower()
+
+
+def provider_sources(config: Dict[str, Any]) -> Dict[str, Tuple[str, str]]:
+    """rules 中引用的需要下载的规则集，名称 -> (url, behavior)"""
+    providers = config.get('rule-providers') or {}
+    sources = {}
+    for rule in config['rules']:
+        rule_type, name, _ = split_rule(rule)
+        provider = providers.get(name) if rule_type == 'RULE-SET' else None
+        if not isinstance(provider, dict) or name in sources:
+            continue
+        url = provider.get('url')
+        parsed = urlparse(url) if isinstance(url, str) else None
+        if (provider.get('type', 'http') == 'http' and parsed and parsed.scheme and parsed.netloc
+                and provider_behavior(provider) in BEHAVIORS and provider.get('format') != 'mrs'):
+            sources[name] = (url, provider_behavior(provider))
+    return sources
+
+
+def provider_intervals(config: Dict[str, Any]) -> Dict[str, int]:
+    """需要下载的规则集声明的更新间隔(秒)，名称 -> interval"""
+    providers = config.get('rule-providers') or {}
+    return {name: providers[name]['interval'] for name in provider_sources(config)
+            if isinstance(providers[name].get('interval'), int) and providers[name]['interval'] > 0}
+
+
+def route_action(policy: str) -> Dict[str, Any]:
+    """策略对应的路由动作，非内置策略直接作为出站标签"""
+    return dict(BUILTIN_POLICIES.get(policy.upper(), {'outbound': policy}))
+
+
+def remote_rule_set_url(base_url: str, url: str, behavior: str) -> str:
+    """指向本服务 /merge 接口的远程二进制规则集地址，单个来源时可以携带 behavior"""
+    return f"{base_url.rstrip('/')}/merge?url={quote(f'{behavior},{url}', safe=':/')}&format=srs"
+
+
+def translate_config(config: Dict[str, Any], provider_rules: Dict[str, List[Dict[str, Any]]],
+                     converter: Optional[RuleConverter] = None,
+                     remote_base: Optional[str] = None) -> Tuple[Dict[str, Any], List[str]]:
+    """把Clash配置转换为Sing-box路由配置，返回 (配置, 警告列表)
+
+    provider_rules 为已下载并转换的规则集，名称 -> Sing-box规则列表；
+    remote_base 不为空时规则集输出为指向该地址的远程二进制规则集
+    """
+    converter = converter or RuleConverter()
+    providers = config.get('rule-providers') or {}
+    sources = provider_sources(config)
+    warnings = []
+    rule_sets = {}
+    rules = []
+    final = None
+
+    def add_rule_set(name: str) -> bool:
+        """输出规则集定义，无法转换的规则集返回False"""
+        if name in rule_sets:
+            return True
+        provider = providers.get(name)
+        if not isinstance(provider, dict):
+            warnings.append(f'Unknown rule provider: {name}')
+            return False
+
+        behavior = provider_behavior(provider)
+        if name in sources and remote_base:
+            rule_set = {'tag': name, 'type': 'remote', 'format': 'binary',
+                        'url': remote_rule_set_url(remote_base, sources[name][0], behavior)}
+            if isinstance(provider.get('interval'), int):
+                rule_set['update_interval'] = f"{provider['interval']}s"
+        elif name in sources and name in provider_rules:
+            rule_set = {'tag': name, 'type': 'inline', 'rules': provider_rules[name]}
+        elif provider.get('type') == 'inline' and isinstance(provider.get('payload'), list):
+            converted = converter.convert_by_behavior([str(item).strip() for item in provider['payload']], behavior)
+            rule_set = {'tag': name, 'type': 'inline', 'rules': converted['rules']}
+        else:
+            warnings.append(f'Unsupported rule provider: {name}')
+            return False
+        rule_sets[name] = rule_set
+        return True
+
+    # 连续使用同一策略的普通规则先聚合为字段集合，遇到其他策略或规则集时输出
+    pending_fields = {}
+    pending_policy = None
+
+    def flush():
+        if pending_policy is not None and pending_fields:
+            action = route_action(pending_policy)
+            rules.extend({**rule, **action} for rule in converter.build_rules(pending_fields))
+        pending_fields.clear()
+
+    for rule in config['rules']:
+        rule_type, argument, policy = split_rule(rule)
+        if rule_type == 'MATCH':
+            # route.final 只能是出站标签，拒绝类策略无法表示
+            outbound = route_action(policy).get('outbound') if policy else None
+            if outbound:
+                final = outbound
+            else:
+                warnings.append(f'Unsupported MATCH policy: {rule}')
+            # Clash在MATCH处结束匹配
+            break
+
+        if policy is None:
+            warnings.append(f'Invalid rule: {rule}')
+            continue
+
+        if rule_type == 'RULE-SET':
+            flush()
+            if not add_rule_set(argument):
+                continue
+            action = route_action(policy)
+            previous = rules[-1] if rules else None
+            if previous is not None and 'rule_set' in previous and len(previous) == len(action) + 1 and \
+                    all(previous.get(key) == value for key, value in action.items()):
+                previous['rule_set'].append(argument)
+            else:
+                rules.append({'rule_set': [argument], **action})
+            continue
+
+        if policy != pending_policy:
+            flush()
+            pending_policy = policy
+        fields = defaultdict(set)
+        _, converted = converter.collect_by_behavior([f'{rule_type},{argument}'], 'classical', fields)
+        if not converted:
+            warnings.append(f'Unsupported rule: {rule}')
+            continue
+        for key, values in fields.items():
+            pending_fields.setdefault(key, set()).update(values)
+    flush()
+
+    route = {'rule_set': list(rule_sets.values()), 'rules': rules}
+    if final:
+        route['final'] = final
+    return {'route': route}, warnings
+
+
+def fetch_provider_rules(url: str, behavior: str, optimize_domains: bool = False,
+                         aggregate_cidrs: bool = False, timeout: float = 30) -> List[Dict[str, Any]]:
+    """下载并转换一个规则集，命令行使用"""
+    response = requests.get(url, timeout=timeout, headers={'User-Agent': 'clash-to-singbox-converter/1.0'})
+    response.raise_for_status()
+    converter = RuleConverter(optimize_domains=optimize_domains, aggregate_cidrs=aggregate_cidrs)
+    return converter.convert(response.text, behavior)['rules']
+
+
+def resolve_providers(sources: Dict[str, Tuple[str, str]], fetch: Callable[[str, str], List[Dict[str, Any]]],
+                      max_workers: int = 8) -> Dict[str, List[Dict[str, Any]]]:
+    """并发下载并转换全部规则集，fetch(url, behavior) 返回转换后的规则列表"""
+    if not sources:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(sources))) as executor:
+        futures = {name: executor.submit(fetch, url, behavior) for name, (url, behavior) in sources.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def run_cli(path: str, output: Optional[str] = None, jobs: int = 8, remote_base: Optional[str] = None,
+            pretty: bool = False, optimize_domains: bool = False, aggregate_cidrs: bool = False) -> int:
+    """命令行转换Clash配置"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = load_config(f.read())
+    except (OSError, ClashConfigError) as e:
+        print(f"错误: 无法读取配置文件: {e}")
+        return 1
+
+    sources = provider_sources(config)
+    provider_rules = {}
+    if not remote_base:
+        def fetch(url, behavior):
+            return fetch_provider_rules(url, behavior, optimize_domains, aggregate_cidrs)
+        try:
+            provider_rules = resolve_providers(sources, fetch, jobs)
+        except requests.RequestException as e:
+            print(f"错误: 无法下载规则集: {e}")
+            return 1
+
+    converter = RuleConverter(optimize_domains=optimize_domains, aggregate_cidrs=aggregate_cidrs)
+    result, warnings = translate_config(config, provider_rules, converter, remote_base)
+    body = json.dumps(result, ensure_ascii=False, indent=2 if pretty else None)
+
+    for warning in warnings:
+        print(f"警告: {warning}")
+    if output:
+        try:
+            with open(output, 'w', encoding='utf-8') as f:
+                f.write(body)
+        except OSError as e:
+            print(f"错误: 无法写入输出文件: {e}")
+            return 1
+        route = result['route']
+        print(f"转换完成: {len(route['rule_set'])} 个规则集，{len(route['rules'])} 条路由规则，结果已保存到: {output}")
+    else:
+        print(body)
+    return 0
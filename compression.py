@@ -0,0 +1,50 @@
+"""
+响应压缩
+
+转换结果写入缓存时预先压缩为 gzip / brotli，命中缓存时按 Accept-Encoding 直接返回对应的字节，
+不再为每个请求重复压缩。brotli 为可选依赖，未安装时只提供 gzip。
+"""
+
+import gzip
+from typing import Dict, Iterable, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# 压缩参数在压缩率和首次转换的额外耗时之间取折中
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# 小于此大小的内容不压缩
+MIN_COMPRESS_SIZE = 1024
+
+# 按优先级排列的可用编码
+SUPPORTED_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """按指定编码压缩内容"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # 固定mtime，相同内容在不同worker中压缩出相同的字节
+        return gzip.compress(body, GZIP_LEVEL, mtime=0)
+    raise ValueError(f'Unsupported encoding: {encoding}')
+
+
+def precompress(body: bytes) -> Dict[str, bytes]:
+    """生成所有可用编码的压缩版本，内容过小时不压缩"""
+    if len(body) < MIN_COMPRESS_SIZE:
+        return {}
+    return {encoding: compress(body, encoding) for encoding in SUPPORTED_ENCODINGS}
+
+
+def negotiate(accept_encodings, available: Iterable[str]) -> Optional[str]:
+    """根据 Accept-Encoding 选择编码，客户端不接受任何可用编码时返回None"""
+    candidates = [encoding for encoding in SUPPORTED_ENCODINGS if encoding in available]
+    if not candidates:
+        return None
+    return accept_encodings.best_match(candidates)
@@ -0,0 +1,72 @@
+"""
+测试共用的夹具：本地上游桩服务和每个测试前的状态清理
+
+使用 upstream 夹具的测试模块定义 upstream_response(path)，返回：
+- 字符串：以 text/plain; charset=utf-8 返回
+- (内容, Content-Type) 元组
+- None：返回404
+"""
+
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    # 当前测试模块的 upstream_response，由 upstream 夹具设置
+    respond = None
+    # 各路径的请求次数，每个测试前清零
+    hits = Counter()
+
+    def do_GET(self):
+        UpstreamHandler.hits[self.path] += 1
+        result = UpstreamHandler.respond(self.path)
+        if result is None:
+            self.send_error(404)
+            return
+        content, content_type = result if isinstance(result, tuple) else (result, 'text/plain; charset=utf-8')
+        body = content.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='session')
+def upstream_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), UpstreamHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture(scope='module')
+def upstream(request, upstream_server):
+    """上游桩服务的基础URL，响应由测试模块的 upstream_response 决定"""
+    UpstreamHandler.respond = request.module.upstream_response
+    return upstream_server
+
+
+@pytest.fixture
+def upstream_hits():
+    """上游桩服务各路径的请求次数"""
+    return UpstreamHandler.hits
+
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    """关闭限流，清空规则缓存和上游请求计数"""
+    import app as core
+
+    monkeypatch.setattr(core, 'check_rate_limit', lambda ip: True)
+    monkeypatch.setattr(core, 'UPSTREAM_PER_HOST_LIMIT', 100)
+    core.rule_cache._entries.clear()
+    core.merge_cache._entries.clear()
+    UpstreamHandler.hits.clear()
@@ -0,0 +1,250 @@
+"""
+转换进程池
+
+规则转换和二进制规则集编码都是CPU密集操作，大文件转换会长时间占用GIL，
+使同一worker中的健康检查和统计接口无法响应。这些操作放到预先启动的子进程中执行：
+- 同步模式下超过大小阈值的转换在进程池中执行，请求线程只等待结果
+- 异步服务模式下超过大小阈值的转换同样在进程池中执行，较小的转换在线程中执行，都不阻塞事件循环
+- 排队的任务数有上限，已满时立即拒绝，由调用方返回503，而不是让请求无限堆积
+- 子进程意外退出（如被OOM终止）后进程池失效，丢弃失效的进程池，下次提交时重新启动
+"""
+
+import asyncio
+import json
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from incremental import IncrementalState
+from rule_converter import RuleConverter, validate_singbox_rules
+from srs import write_rule_set
+
+
+def serialize_rules(singbox_rules) -> bytes:
+    """序列化转换结果为JSON字节"""
+    return json.dumps(singbox_rules, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def convert_to_json(data: bytes, encoding: str = 'utf-8', optimize_domains: bool = False,
+                    aggregate_cidrs: bool = False, behavior: Optional[str] = None) -> Optional[bytes]:
+    """转换规则内容并序列化，结果未通过校验时返回None"""
+    converter = RuleConverter(optimize_domains=optimize_domains, aggregate_cidrs=aggregate_cidrs)
+    singbox_rules = converter.convert(data.decode(encoding, errors='replace'), behavior)
+    if not validate_singbox_rules(singbox_rules):
+        return None
+    return serialize_rules(singbox_rules)
+
+
+def convert_with_state(data: bytes, encoding: str = 'utf-8', optimize_domains: bool = False,
+                       aggregate_cidrs: bool = False, behavior: Optional[str] = None) -> Tuple[Optional[bytes], Any]:
+    """转换规则内容并建立增量转换状态，返回 (序列化结果, 状态)；不支持增量转换的内容按完整转换，状态为None"""
+    converter = RuleConverter(optimize_domains=optimize_domains, aggregate_cidrs=aggregate_cidrs)
+    content = data.decode(encoding, errors='replace')
+    state = IncrementalState.build(content, behavior, converter)
+    singbox_rules = state.result(converter) if state is not None else converter.convert(content, behavior)
+    if not validate_singbox_rules(singbox_rules):
+        return None, None
+    return serialize_rules(singbox_rules), state
+
+
+def update_with_state(state: IncrementalState, data: bytes, encoding: str = 'utf-8', optimize_domains: bool = False,
+                      aggregate_cidrs: bool = False, behavior: Optional[str] = None) -> Tuple[Optional[bytes], Any, bool]:
+    """按上次的解析状态只转换变化的行，返回 (序列化结果, 状态, 是否增量转换)；
+    无法增量转换时在同一子进程中完整转换并建立新状态"""
+    converter = RuleConverter(optimize_domains=optimize_domains, aggregate_cidrs=aggregate_cidrs)
+    singbox_rules = state.update(data.decode(encoding, errors='replace'), converter)
+    if singbox_rules is None:
+        return (*convert_with_state(data, encoding, optimize_domains, aggregate_cidrs, behavior), False)
+    if not validate_singbox_rules(singbox_rules):
+        return None, None, True
+    return serialize_rules(singbox_rules), state, True
+
+
+def merge_json(bodies: List[bytes], optimize_domains: bool = False, aggregate_cidrs: bool = False) -> bytes:
+    """按 merge_rules 的去重语义把多个序列化的转换结果合并为一个规则集"""
+    converter = RuleConverter(optimize_domains=optimize_domains, aggregate_cidrs=aggregate_cidrs)
+    rules = [rule for body in bodies for rule in json.loads(body)['rules']]
+    return serialize_rules({'rules': converter.merge_rules(rules), 'version': 2})
+
+
+def encode_srs(body: bytes) -> bytes:
+    """把序列化的JSON结果编码为二进制规则集"""
+    return write_rule_set(json.loads(body))
+
+
+class PoolBusyError(Exception):
+    """排队的任务已达上限"""
+
+    def __init__(self, retry_after: int):
+        super().__init__('Conversion queue is full')
+        self.retry_after = retry_after
+
+
+def _timed_call(fn: Callable[..., Any], submitted_at: float, *args):
+    """在子进程中执行fn，同时返回排队等待时间和执行时间"""
+    started_at = time.time()
+    result = fn(*args)
+    return started_at - submitted_at, time.time() - started_at, result
+
+
+def _warm_up():
+    """预热子进程：导入转换模块并占用进程片刻，使每个子进程都分到一个预热任务"""
+    time.sleep(0.1)
+
+
+class ConversionPool:
+    """有上限的转换进程池，排队的任务超过上限时立即拒绝"""
+
+    def __init__(self, processes: int = 2, max_queue: int = 8):
+        self.processes = processes
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'restarts': 0,
+            'max_queue_depth': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+            'total_run_ms': 0.0
+        }
+
+    def start(self) -> ProcessPoolExecutor:
+        """启动进程池，子进程使用 spawn 方式创建，不继承父进程的连接和线程"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def prewarm(self):
+        """启动全部子进程并完成模块导入，首个转换请求无需等待进程启动"""
+        executor = self.start()
+        for future in [executor.submit(_warm_up) for _ in range(self.processes)]:
+            future.result()
+
+    def _queue_depth(self) -> int:
+        """提交后尚未开始执行的任务数(估算)，调用方需持有锁"""
+        return max(self._in_flight - self.processes, 0)
+
+    def retry_after(self) -> int:
+        """按平均执行时间估算排队任务全部完成所需的秒数"""
+        with self._lock:
+            completed = self.stats['completed']
+            average_run = self.stats['total_run_ms'] / completed / 1000 if completed else 1
+            return max(1, math.ceil(average_run * (self._queue_depth() + self.processes) / self.processes))
+
+    def _discard_broken(self, executor: ProcessPoolExecutor):
+        """丢弃子进程意外退出后失效的进程池，下次提交时由 start 重新启动"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self.stats['restarts'] += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _check_broken(self, executor: ProcessPoolExecutor, future: Future):
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._discard_broken(executor)
+
+    def _submit(self, fn: Callable[..., Any], args) -> Future:
+        """占用排队名额并提交任务，排队已满时抛出 PoolBusyError"""
+        with self._lock:
+            # 所有进程都在执行且排队已满；max_queue 为0时不排队，进程都忙即拒绝
+            if self._in_flight >= self.processes + self.max_queue:
+                self.stats['rejected'] += 1
+                busy = True
+            else:
+                busy = False
+                self._in_flight += 1
+                self.stats['submitted'] += 1
+                self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self._queue_depth())
+        if busy:
+            raise PoolBusyError(self.retry_after())
+        try:
+            try:
+                executor = self.start()
+                future = executor.submit(_timed_call, fn, time.time(), *args)
+            except BrokenProcessPool:
+                # 进程池在上次检查之后失效，任务尚未执行，换用新的进程池提交
+                self._discard_broken(executor)
+                executor = self.start()
+                future = executor.submit(_timed_call, fn, time.time(), *args)
+        except Exception:
+            self._finish(None)
+            raise
+        future.add_done_callback(lambda done: self._check_broken(executor, done))
+        return future
+
+    def _finish(self, timing):
+        with self._lock:
+            self._in_flight -= 1
+            if timing is None:
+                self.stats['failed'] += 1
+                return
+            wait, run = timing
+            self.stats['completed'] += 1
+            self.stats['total_wait_ms'] += wait * 1000
+            self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait * 1000)
+            self.stats['total_run_ms'] += run * 1000
+
+    def _result(self, future: Future) -> Any:
+        try:
+            wait, run, result = future.result()
+        except BaseException:
+            self._finish(None)
+            raise
+        self._finish((wait, run))
+        return result
+
+    def submit(self, fn: Callable[..., Any], *args) -> Any:
+        """在子进程中执行fn并等待结果，供同步请求线程使用；fn及其参数需可被pickle"""
+        return self._result(self._submit(fn, args))
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """submit 的 asyncio 版本，等待期间不阻塞事件循环"""
+        future = self._submit(fn, args)
+        try:
+            await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # 请求被取消时任务可能仍在子进程中执行，完成后再释放排队名额
+            future.add_done_callback(self._discard)
+            raise
+        except Exception:
+            pass
+        return self._result(future)
+
+    def _discard(self, future: Future):
+        try:
+            self._result(future)
+        except BaseException:
+            pass
+
+    def shutdown(self):
+        """关闭进程池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取进程池统计信息"""
+        with self._lock:
+            stats = self.stats.copy()
+            stats['in_flight'] = self._in_flight
+            stats['queue_depth'] = self._queue_depth()
+        completed = stats['completed']
+        stats['processes'] = self.processes
+        stats['max_queue'] = self.max_queue
+        stats['avg_wait_ms'] = round(stats.pop('total_wait_ms') / completed, 1) if completed else 0
+        stats['avg_run_ms'] = round(stats.pop('total_run_ms') / completed, 1) if completed else 0
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 1)
+        return stats
@@ -0,0 +1,22 @@
+"""
+gunicorn 配置
+
+gunicorn 启动时自动读取当前目录下的 gunicorn.conf.py，绑定地址和 worker 数仍由命令行参数指定。
+"""
+
+
+def post_worker_init(worker):
+    """worker启动后预热转换进程池，首个大文件转换无需等待子进程启动；
+    在后台预热清单中的上游规则并开启后台刷新，预热完成前 /ready 返回503"""
+    from app import conversion_pool, refresh_scheduler, warmup
+    conversion_pool.prewarm()
+    warmup.start()
+    refresh_scheduler.start()
+
+
+def worker_exit(server, worker):
+    """worker退出时关闭转换进程池和后台刷新，写入缓冲的统计"""
+    from app import conversion_pool, refresh_scheduler, shared_store
+    refresh_scheduler.stop()
+    conversion_pool.shutdown()
+    shared_store.flush()
@@ -0,0 +1,330 @@
+"""
+增量重新转换
+
+保存每个上游来源上次转换时的解析状态，上游内容变化时按行比较新旧内容，只转换新增和删除的行：
+- 每个输出字段的取值记录引用计数，即有多少条不同的规则行产生了该取值，删除规则行时计数归零的取值才从结果中去掉
+- 只支持文本格式和扁平的 payload 列表，逐行解析的结果与完整转换一致
+- 格式或自动检测的behavior变化、变化的行过多、出现无法逐行解析的内容时返回None，由调用方回退到完整转换
+- 按行比较使用集合运算，输出仍需整体排序和序列化，这两步与文件大小成正比；逐行解析和校验只对变化的行执行
+"""
+
+import bisect
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from rule_converter import (DETECT_SAMPLE_LINES, FORMAT_BEHAVIORS, RuleConverter, is_flat_payload_text,
+                            iter_head_lines, parse_payload_item)
+
+# 变化的行超过原有行数的这一比例时回退到完整转换
+MAX_CHANGE_RATIO = 0.5
+
+# 每行和每个取值的估算内存开销(字节)
+LINE_OVERHEAD = 64
+
+# 一个字段变化的取值超过此数量时重新排序，否则在上次排序的结果中逐个插入和删除
+RESORT_CHANGES = 64
+
+# 不产生规则的行：空行、注释和 payload 键
+SKIP = 'skip'
+
+
+def _text_rule(line: str) -> Optional[str]:
+    """文本格式的一行，返回规则，空行和注释返回None，与 iter_rule_lines 一致"""
+    line = line.strip()
+    if line and not line.startswith('#'):
+        return line
+    return None
+
+
+def _yaml_item(line: str):
+    """扁平 payload 列表的一行，返回 SKIP 或 (缩进, 规则)，无法逐行解析时返回None"""
+    if line.endswith('\r'):
+        line = line[:-1]
+    if '\t' in line:
+        return None
+    stripped = line.lstrip(' ')
+    if not stripped or stripped.startswith('#'):
+        return SKIP
+    return parse_payload_item(line, stripped)
+
+
+def _is_payload_key(line: str) -> bool:
+    """不缩进的 payload 键，与 parse_flat_payload_lines 一致"""
+    if line.endswith('\r'):
+        line = line[:-1]
+    key, _, rest = line.partition(':')
+    rest = rest.strip()
+    return key == 'payload' and (not rest or rest.startswith('#'))
+
+
+def _content_lines(content: str) -> Iterator[str]:
+    """按顺序读取不是空行和注释的行"""
+    for line in iter_head_lines(content):
+        if _yaml_item(line) is not SKIP:
+            yield line
+
+
+def detect_behavior(content: str, behavior: Optional[str], converter: RuleConverter) -> Optional[Tuple[str, str]]:
+    """只根据开头的若干行检测格式和实际使用的behavior，与完整转换一致；不支持增量转换时返回None"""
+    head = []
+    sample_count = 0
+    for line in iter_head_lines(content):
+        head.append(line)
+        if _text_rule(line) is not None:
+            sample_count += 1
+            if sample_count >= DETECT_SAMPLE_LINES:
+                break
+    if not sample_count:
+        return None
+
+    format_type = converter.detect_rule_provider_format('\n'.join(head))
+    if format_type in FORMAT_BEHAVIORS:
+        # 以 "- " 开头的内容是否为省略payload键的YAML列表要解析完整内容才能确定
+        if next(line for line in head if _text_rule(line) is not None).lstrip().startswith('- '):
+            return None
+        return format_type, behavior or FORMAT_BEHAVIORS[format_type]
+    if format_type != 'yaml':
+        return None
+    if behavior:
+        return format_type, behavior
+
+    # 与完整转换相同，根据 payload 开头的若干条规则检测
+    sample = []
+    for line in iter_head_lines(content):
+        item = _yaml_item(line)
+        if isinstance(item, tuple):
+            sample.append(item[1])
+            if len(sample) >= 10:
+                break
+    if not sample:
+        return None
+    return format_type, converter.detect_payload_behavior(sample)
+
+
+class IncrementalState:
+    """一个上游来源上次转换时的解析状态"""
+
+    def __init__(self, format_type: str, behavior: str, requested_behavior: Optional[str], aggregate_cidrs: bool):
+        self.format_type = format_type
+        # 实际使用的behavior，指定的或自动检测的
+        self.behavior = behavior
+        # 请求中指定的behavior，为None时每次按新内容重新检测
+        self.requested_behavior = requested_behavior
+        # 分发表写入的网段取值与是否合并网段有关
+        self.aggregate_cidrs = aggregate_cidrs
+        # payload 键所在的行，文本格式和省略payload键的YAML列表为None
+        self.payload_key: Optional[str] = None
+        # payload 条目的缩进
+        self.item_indent: Optional[int] = None
+        # 原始行 -> 出现次数
+        self.lines: Counter = Counter()
+        # 输出字段 -> {取值: 产生该取值的不同行数}
+        self.fields: Dict[str, Counter] = defaultdict(Counter)
+        # 上次输出时各字段排序后的取值，以及之后出现或消失的取值
+        self._sorted: Dict[str, List[Any]] = {}
+        self._changed: Dict[str, set] = defaultdict(set)
+        # 最近一次更新变化的行数
+        self.changed_lines = 0
+        self.size = 0
+
+    def parse_line(self, line: str):
+        """解析一行，返回规则或 SKIP，无法逐行解析时返回None"""
+        if self.format_type != 'yaml':
+            rule = _text_rule(line)
+            return SKIP if rule is None else rule
+        item = _yaml_item(line)
+        if item is None or item is SKIP:
+            return item
+        indent, rule = item
+        return rule if indent == self.item_indent else None
+
+    def _apply(self, lines: Iterable[str], converter: RuleConverter, delta: int) -> bool:
+        """把每行规则产生的取值按 delta 增减引用计数，计数归零的取值从结果中去掉；遇到无法逐行解析的行时返回False"""
+        convert_line = converter.line_converter(self.behavior)
+        # 逐行复用同一组集合，每行转换后清空
+        contributed = defaultdict(set)
+        for line in lines:
+            if line == self.payload_key:
+                continue
+            rule = self.parse_line(line)
+            if rule is SKIP:
+                continue
+            if rule is None:
+                return False
+            convert_line(rule, contributed)
+            for field, values in contributed.items():
+                if not values:
+                    continue
+                counts = self.fields[field]
+                changed = self._changed[field]
+                for value in values:
+                    count = counts[value] + delta
+                    if count > 0:
+                        counts[value] = count
+                    else:
+                        del counts[value]
+                    if count <= 1:
+                        changed.add(value)
+                values.clear()
+        return True
+
+    def _update_size(self, content: str):
+        values = sum(len(counts) for counts in self.fields.values())
+        self.size = len(content) + LINE_OVERHEAD * (len(self.lines) + values)
+
+    @classmethod
+    def build(cls, content: str, behavior: Optional[str], converter: RuleConverter) -> Optional['IncrementalState']:
+        """从完整内容建立状态，不支持增量转换的内容返回None"""
+        detected = detect_behavior(content, behavior, converter)
+        if detected is None:
+            return None
+        state = cls(detected[0], detected[1], behavior, converter.aggregate_cidrs)
+        state.lines = Counter(content.split('\n'))
+
+        if state.format_type == 'yaml':
+            if not is_flat_payload_text(content):
+                return None
+            # payload 键只能出现在第一行有效内容，之后的有效内容都是缩进相同的条目
+            content_lines = _content_lines(content)
+            first = next(content_lines, None)
+            if first is not None and _is_payload_key(first):
+                if state.lines[first] != 1:
+                    return None
+                state.payload_key = first
+                first = next(content_lines, None)
+            item = _yaml_item(first) if first is not None else None
+            if not isinstance(item, tuple):
+                return None
+            state.item_indent = item[0]
+
+        if not state._apply(state.lines, converter, 1):
+            return None
+        state._update_size(content)
+        return state
+
+    def update(self, content: str, converter: RuleConverter) -> Optional[Dict[str, Any]]:
+        """按新内容更新状态并返回转换结果，需要完整转换时返回None且不修改状态"""
+        if converter.aggregate_cidrs != self.aggregate_cidrs:
+            return None
+        if detect_behavior(content, self.requested_behavior, converter) != (self.format_type, self.behavior):
+            return None
+
+        lines = Counter(content.split('\n'))
+        added = lines.keys() - self.lines.keys()
+        removed = self.lines.keys() - lines.keys()
+        if len(added) + len(removed) > MAX_CHANGE_RATIO * len(self.lines):
+            return None
+
+        if self.format_type == 'yaml':
+            # 未变化的行上次已校验过，只检查新增的行和 payload 键的位置
+            if content.startswith('\ufeff') or content.endswith('\r'):
+                return None
+            if any(not is_flat_payload_text(line[:-1] if line.endswith('\r') else line) for line in added):
+                return None
+            if self.payload_key in removed or (self.payload_key is not None and lines[self.payload_key] != 1):
+                return None
+            first = next(_content_lines(content), None)
+            if first is not None and (first == self.payload_key) != (self.payload_key is not None):
+                return None
+            if any(line == self.payload_key or self.parse_line(line) is None for line in added):
+                return None
+
+        self._apply(removed, converter, -1)
+        self._apply(added, converter, 1)
+        self.lines = lines
+        self.changed_lines = len(added) + len(removed)
+        self._update_size(content)
+        return self.result(converter)
+
+    def _sorted_values(self, field: str) -> List[Any]:
+        """字段当前取值排序后的列表，变化较少时在上次的结果上增删"""
+        counts = self.fields[field]
+        ordered = self._sorted.get(field)
+        changed = self._changed.pop(field, ())
+        if ordered is None or len(changed) > RESORT_CHANGES:
+            ordered = sorted(counts)
+        else:
+            for value in changed:
+                index = bisect.bisect_left(ordered, value)
+                present = index < len(ordered) and ordered[index] == value
+                if value in counts and not present:
+                    ordered.insert(index, value)
+                elif value not in counts and present:
+                    del ordered[index]
+        self._sorted[field] = ordered
+        return ordered
+
+    def result(self, converter: RuleConverter) -> Dict[str, Any]:
+        """当前状态对应的转换结果，与完整转换的输出一致；build_rules 对已排序的列表再排序只需线性时间"""
+        fields = defaultdict(set, {field: self._sorted_values(field) for field in list(self.fields)})
+        return {
+            "rules": converter.build_rules(fields),
+            "version": 2
+        }
+
+
+class IncrementalStore:
+    """按字节上限LRU淘汰的解析状态，每个worker进程各自保存
+
+    同一来源的状态同时只能被一个转换使用：转换时取出，完成后放回，并发的转换取不到状态时按完整转换处理。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._states: 'OrderedDict[str, IncrementalState]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'incremental': 0,
+            'full': 0,
+            'fallbacks': 0,
+            'changed_lines': 0,
+            'evictions': 0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._states
+
+    def take(self, key: str) -> Optional[IncrementalState]:
+        """取出来源的状态"""
+        with self._lock:
+            state = self._states.pop(key, None)
+            if state is not None:
+                self._bytes -= state.size
+            return state
+
+    def put(self, key: str, state: IncrementalState):
+        """放回状态并按字节上限淘汰最久未使用的状态，单个状态超过上限时不保存"""
+        if state.size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._states.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._states[key] = state
+            self._bytes += state.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._states.popitem(last=False)
+                self._bytes -= evicted.size
+                self.stats['evictions'] += 1
+
+    def count(self, name: str, value: int = 1):
+        """累加统计计数"""
+        with self._lock:
+            self.stats[name] += value
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取增量转换统计信息"""
+        with self._lock:
+            stats = self.stats.copy()
+            stats['entries'] = len(self._states)
+            stats['bytes'] = self._bytes
+        stats['max_bytes'] = self.max_bytes
+        return stats
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+慢速上游负载测试
+
+在本地启动一个每次响应都延迟若干秒的上游桩服务，向转换服务并发请求互不相同的规则URL(全部缓存未命中)，
+统计吞吐量、实际并发数和延迟分布，同时定期探测 /api/stats，观察慢速上游是否拖垮整个服务。
+
+python loadtest.py --server asgi            # 启动 uvicorn asgi:app 后测试
+python loadtest.py --server wsgi            # 启动 gunicorn app:app (4 worker x 4 线程) 后测试
+python loadtest.py --target http://host:8080  # 测试已运行的服务
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+
+def start_slow_upstream(delay: float, lines: int) -> ThreadingHTTPServer:
+    """启动延迟响应的上游桩服务，每个路径返回不同的域名列表"""
+
+    class SlowHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            name = self.path.strip('/').replace('/', '-')
+            body = '\n'.join(f"host{i}.{name}.example.com" for i in range(lines)).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_server(mode: str, port: int, workers: int) -> subprocess.Popen:
+    """启动被测服务，关闭限流并使用独立的共享存储文件"""
+    env = dict(os.environ)
+    env['RATE_LIMIT_PER_MINUTE'] = '1000000'
+    # 桩服务代表大量不同的慢速上游主机，不受单主机并发上限约束
+    env['UPSTREAM_PER_HOST_LIMIT'] = '1000'
+    env['STORE_BACKEND'] = 'sqlite'
+    env['STORE_PATH'] = os.path.join(tempfile.mkdtemp(), 'loadtest.db')
+
+    if mode == 'asgi':
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port),
+                   '--workers', str(workers), '--log-level', 'warning', '--no-access-log']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+                   '--threads', '4', '--timeout', '30', '--log-level', 'warning', 'app:app']
+    return subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_ready(target: str, process=None, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'服务启动失败，退出码 {process.returncode}')
+        try:
+            if requests.get(f"{target}/", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'服务未在 {timeout} 秒内启动')
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_load(target: str, upstream: str, total: int, concurrency: int, probe_interval: float):
+    """并发请求不同的规则URL，同时定期探测 /api/stats 的响应时间"""
+    latencies = []
+    failures = []
+    probes = []
+    stop = threading.Event()
+
+    def one(index: int):
+        session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session.get(f"{target}/rules/{upstream}/list{index}.txt", timeout=120)
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                failures.append(response.status_code)
+        except requests.RequestException as e:
+            failures.append(type(e).__name__)
+
+    def probe():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                requests.get(f"{target}/api/stats", timeout=60)
+                probes.append(time.perf_counter() - start)
+            except requests.RequestException:
+                probes.append(float('inf'))
+            stop.wait(probe_interval)
+
+    prober = threading.Thread(target=probe, daemon=True)
+    prober.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    prober.join()
+    return elapsed, latencies, failures, probes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='慢速上游负载测试')
+    parser.add_argument('--server', choices=['asgi', 'wsgi'], help='启动指定模式的服务后测试')
+    parser.add_argument('--target', default=None, help='已运行服务的地址 (默认: 启动的服务)')
+    parser.add_argument('--port', type=int, default=18080, help='启动服务使用的端口 (默认: 18080)')
+    parser.add_argument('--workers', type=int, default=4, help='启动服务的worker数 (默认: 4)')
+    parser.add_argument('--requests', type=int, default=256, help='请求总数 (默认: 256)')
+    parser.add_argument('--concurrency', type=int, default=128, help='并发请求数 (默认: 128)')
+    parser.add_argument('--delay', type=float, default=2.0, help='上游响应延迟秒数 (默认: 2.0)')
+    parser.add_argument('--lines', type=int, default=200, help='每个上游规则列表的行数 (默认: 200)')
+    parser.add_argument('--probe-interval', type=float, default=0.5, help='探测 /api/stats 的间隔秒数 (默认: 0.5)')
+    args = parser.parse_args()
+
+    if not args.server and not args.target:
+        parser.error('需要指定 --server 或 --target')
+
+    upstream_server = start_slow_upstream(args.delay, args.lines)
+    upstream = f"http://127.0.0.1:{upstream_server.server_address[1]}"
+
+    process = None
+    target = args.target or f"http://127.0.0.1:{args.port}"
+    if args.server:
+        process = start_server(args.server, args.port, args.workers)
+    try:
+        wait_ready(target, process)
+        print(f"慢速上游负载测试: {args.server or target}")
+        print(f"请求数 {args.requests}，并发 {args.concurrency}，上游延迟 {args.delay}s，每个列表 {args.lines} 行")
+        print("=" * 60)
+
+        elapsed, latencies, failures, probes = run_load(
+            target, upstream, args.requests, args.concurrency, args.probe_interval
+        )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        upstream_server.shutdown()
+
+    print(f"成功: {len(latencies)}  失败: {len(failures)} {sorted(set(map(str, failures)))[:5] if failures else ''}")
+    print(f"总耗时: {elapsed:.2f}s  吞吐量: {len(latencies) / elapsed:.1f} 请求/秒")
+    if latencies:
+        # 所有请求耗时之和除以总耗时，即平均同时在处理中的请求数
+        print(f"平均并发: {sum(latencies) / elapsed:.1f}")
+        print(f"延迟: 平均 {statistics.mean(latencies):.2f}s  P50 {percentile(latencies, 0.5):.2f}s  "
+              f"P95 {percentile(latencies, 0.95):.2f}s  最大 {max(latencies):.2f}s")
+    if probes:
+        print(f"/api/stats 探测: {len(probes)} 次  P50 {percentile(probes, 0.5) * 1000:.0f}ms  "
+              f"最大 {max(probes) * 1000:.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+启动预热
+
+worker启动时读取预热清单，把清单中的上游规则下载并转换到缓存中，完成之前就绪检查返回未就绪：
+- 清单为YAML或JSON格式，逐项指定上游URL和可选的behavior，格式与 /merge 的来源相同
+- 多个上游并发下载，单个上游失败不影响其他上游，失败的上游记录在预热状态中
+- 预热在后台线程中执行，不阻塞worker启动
+- 多个worker按来源在共享存储中加租约，同一来源只由一个worker下载，其他worker等待共享缓存中的结果；
+  失败的来源记录在共享状态中，其他worker在 FAILURE_TTL 内不再重试
+- 就绪检查以共享状态为准：清单中的来源都已在共享缓存中（或最近失败）时即就绪，与由哪个worker完成无关
+
+清单文件示例::
+
+    sources:
+      - https://example.com/ads.yaml
+      - domain,https://example.com/direct.txt
+      - url: https://example.com/cncidr.yaml
+        behavior: ipcidr
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import yaml
+
+from sources import SourceError, parse_source
+
+# 预热租约有效期，持有租约的worker退出后由其他worker接手
+LEASE_TTL = 120
+# 等待其他worker预热同一来源时的轮询间隔
+LEASE_POLL_INTERVAL = 0.2
+# 预热失败的来源在此时间内不再由其他worker重试
+FAILURE_TTL = 60
+# 共享状态中记录预热失败来源的键
+FAILURES_KEY = 'warmup_failures'
+
+
+class PreloadError(ValueError):
+    """预热清单无法解析"""
+
+
+def load_preload_manifest(path: str) -> List[Tuple[str, Optional[str]]]:
+    """读取预热清单，清单为来源列表，或包含 sources 列表的对象"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError) as e:
+        raise PreloadError(f'Cannot read preload manifest: {e}') from None
+
+    if isinstance(data, dict):
+        data = data.get('sources')
+    if not isinstance(data, list):
+        raise PreloadError('Preload manifest must be a list of sources or contain a sources list')
+
+    sources = []
+    for item in data:
+        try:
+            source = parse_source(item)
+        except SourceError as e:
+            raise PreloadError(str(e)) from None
+        if source not in sources:
+            sources.append(source)
+    return sources
+
+
+class Warmup:
+    """启动预热进度"""
+
+    def __init__(self, path: Optional[str], warm: Callable[[str, Optional[str]], Any], concurrency: int = 4,
+                 store: Any = None, is_warm: Optional[Callable[[str, Optional[str]], bool]] = None):
+        # 预热清单路径，为空时启动后直接就绪
+        self.path = path
+        # warm(url, behavior) 下载并转换一个来源
+        self.warm = warm
+        self.concurrency = concurrency
+        # 多worker共享的存储和 is_warm(url, behavior)，检查来源是否已在共享缓存中新鲜；
+        # 为空时每个worker各自预热，就绪只看本worker的进度
+        self.store = store
+        self.is_warm = is_warm
+
+        self.state = 'pending'
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.errors: List[Dict[str, str]] = []
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._sources: Optional[List[Tuple[str, Optional[str]]]] = None
+        self._shared_ready = False
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """在后台线程中开始预热，重复调用时只执行一次"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+        self._thread.start()
+
+    def run(self):
+        """执行预热，完成后（包括清单无法读取或部分来源失败）标记为就绪"""
+        with self._lock:
+            self.state = 'running'
+            self.started_at = time.time()
+        try:
+            sources = self._load_sources()
+        except PreloadError as e:
+            print(f"预热清单无法读取: {e}")
+            sources = []
+            with self._lock:
+                self.errors.append({'url': self.path, 'error': str(e)})
+
+        with self._lock:
+            self.total = len(sources)
+        if sources:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(sources)), thread_name_prefix='warmup') as executor:
+                for source in sources:
+                    executor.submit(self._warm_one, *source)
+
+        with self._lock:
+            self.state = 'ready'
+            self.finished_at = time.time()
+        print(f"预热完成: {self.done - self.failed}/{self.total} 个上游，耗时 {self.finished_at - self.started_at:.1f}s")
+
+    def _load_sources(self) -> List[Tuple[str, Optional[str]]]:
+        if self._sources is None:
+            self._sources = load_preload_manifest(self.path) if self.path else []
+        return self._sources
+
+    def _warm_one(self, url: str, behavior: Optional[str]):
+        try:
+            error = self._warm_source(url, behavior)
+        except Exception as e:
+            error = str(e)
+        with self._lock:
+            if error is not None:
+                self.failed += 1
+                self.errors.append({'url': url, 'error': error})
+            self.done += 1
+
+    def _warm_source(self, url: str, behavior: Optional[str]) -> Optional[str]:
+        """预热一个来源，返回其他worker记录的失败原因；只有持有租约的worker下载"""
+        if self.store is None:
+            self.warm(url, behavior)
+            return None
+
+        name = f"{behavior or ''}|{url}"
+        lease = f'preload:{name}'
+        while not self.store.acquire_lease(lease, LEASE_TTL):
+            # 其他worker正在预热，等待其结果写入共享缓存
+            if self.is_warm(url, behavior):
+                return None
+            time.sleep(LEASE_POLL_INTERVAL)
+        try:
+            if self.is_warm(url, behavior):
+                return None
+            failure = self._recent_failure(name)
+            if failure is not None:
+                return failure
+            try:
+                self.warm(url, behavior)
+            except Exception as e:
+                self._record_failure(name, str(e))
+                raise
+            return None
+        finally:
+            self.store.release_lease(lease)
+
+    def _recent_failure(self, name: str) -> Optional[str]:
+        failure = (self.store.get_state(FAILURES_KEY) or {}).get(name)
+        if failure is not None and time.time() - failure['at'] < FAILURE_TTL:
+            return failure['error']
+        return None
+
+    def _record_failure(self, name: str, error: str):
+        now = time.time()
+
+        def apply(failures):
+            failures = {key: value for key, value in (failures or {}).items() if now - value['at'] < FAILURE_TTL}
+            failures[name] = {'error': error, 'at': now}
+            return failures
+
+        self.store.update_state(FAILURES_KEY, apply)
+
+    def _check_shared_ready(self) -> bool:
+        """清单中的来源都已由某个worker预热到共享缓存或最近失败，结果一旦为真即保持"""
+        if self._shared_ready:
+            return True
+        if self.store is None or self.is_warm is None:
+            return False
+        try:
+            sources = self._load_sources()
+        except PreloadError:
+            return False
+        for url, behavior in sources:
+            if not self.is_warm(url, behavior) and self._recent_failure(f"{behavior or ''}|{url}") is None:
+                return False
+        self._shared_ready = True
+        return True
+
+    @property
+    def ready(self) -> bool:
+        return self.state == 'ready' or self._check_shared_ready()
+
+    def status(self) -> Dict[str, Any]:
+        """预热进度，供就绪检查接口返回；ready 以共享状态为准，state 等为本worker的进度"""
+        # 共享存储的读取不持有进度锁
+        ready = self.ready
+        with self._lock:
+            end = self.finished_at or time.time()
+            return {
+                'ready': ready,
+                'state': self.state,
+                'total': self.total,
+                'done': self.done,
+                'failed': self.failed,
+                'elapsed_ms': round((end - self.started_at) * 1000, 1) if self.started_at else 0,
+                'errors': list(self.errors)
+            }
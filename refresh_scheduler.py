@@ -0,0 +1,196 @@
+"""
+热门上游规则的后台刷新调度
+
+记录每个上游来源的请求频率，后台线程定期检查请求最多的前N个来源，在缓存过期前提前刷新：
+- 请求计数按固定周期减半，近期请求多的来源排在前面
+- 刷新周期为规则集声明的 interval 或配置的刷新间隔，不超过缓存新鲜期
+- 声明的 interval 来自请求，不低于 min_interval，同一来源保留声明过的最长值，且不缩短配置的刷新间隔
+- 每个条目的刷新时间加入随机抖动，同时写入的条目不会同时刷新
+- 同时进行的刷新数有上限；与请求触发的后台刷新共用刷新标记，同一条目不会重复刷新
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 最多记录的来源数，超出时丢弃请求最少的来源
+MAX_TRACKED_SOURCES = 4096
+# 声明的 interval 至少为检查周期的这一倍数
+MIN_INTERVAL_CHECKS = 6
+
+
+class RefreshScheduler:
+    """按请求频率提前刷新热门缓存条目"""
+
+    def __init__(self, cache, refresh: Callable[[str, str, Any, Optional[str]], Any], top_n: int = 20,
+                 concurrency: int = 2, interval: Optional[float] = None, jitter: float = 0.1,
+                 check_interval: float = 10, decay_interval: float = 300, min_hits: float = 2,
+                 min_interval: float = 300):
+        # 被刷新的缓存(rule_cache.RuleCache)
+        self.cache = cache
+        # refresh(cache_key, url, entry, behavior)，结束时需调用 cache.end_refresh
+        self.refresh = refresh
+        self.top_n = top_n
+        self.concurrency = concurrency
+        # 未声明 interval 的来源的刷新周期(秒)，为None时使用缓存新鲜期
+        self.interval = interval
+        # 刷新时间最多提前刷新周期的这一比例
+        self.jitter = jitter
+        self.check_interval = check_interval
+        # 声明的 interval 的下限(秒)
+        self.min_interval = max(min_interval, MIN_INTERVAL_CHECKS * check_interval)
+        self.decay_interval = decay_interval
+        # 衰减后的请求计数达到此值才视为热门来源
+        self.min_hits = min_hits
+
+        self._sources: Dict[str, Dict[str, Any]] = {}
+        self._intervals: Dict[str, float] = {}
+        self._in_flight = set()
+        self._last_decay = time.time()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        self.stats = {
+            'checks': 0,
+            'scheduled': 0,
+            'deferred': 0
+        }
+
+    def record(self, cache_key: str, url: str, behavior: Optional[str] = None):
+        """记录一次对来源的请求"""
+        with self._lock:
+            source = self._sources.get(cache_key)
+            if source is None:
+                if len(self._sources) >= MAX_TRACKED_SOURCES:
+                    coldest = min(self._sources, key=lambda key: self._sources[key]['hits'])
+                    del self._sources[coldest]
+                source = self._sources[cache_key] = {'url': url, 'behavior': behavior, 'hits': 0.0}
+            source['hits'] += 1
+
+    def set_interval(self, cache_key: str, interval: float):
+        """记录来源声明的更新间隔(秒)，如Clash规则集的 interval；不低于 min_interval，保留最长的声明"""
+        interval = max(interval, self.min_interval)
+        with self._lock:
+            if cache_key in self._intervals:
+                self._intervals[cache_key] = max(self._intervals[cache_key], interval)
+            elif len(self._intervals) < MAX_TRACKED_SOURCES:
+                self._intervals[cache_key] = interval
+
+    def _decay(self, now: float):
+        """请求计数减半，丢弃长期没有请求的来源"""
+        with self._lock:
+            if now - self._last_decay < self.decay_interval:
+                return
+            self._last_decay = now
+            for key in list(self._sources):
+                self._sources[key]['hits'] /= 2
+                if self._sources[key]['hits'] < 0.25:
+                    del self._sources[key]
+            for key in list(self._intervals):
+                if key not in self._sources:
+                    del self._intervals[key]
+
+    def hot_sources(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """请求最多的前N个来源"""
+        with self._lock:
+            hot = [(key, dict(source)) for key, source in self._sources.items() if source['hits'] >= self.min_hits]
+        hot.sort(key=lambda item: item[1]['hits'], reverse=True)
+        return hot[:self.top_n]
+
+    def period(self, cache_key: str) -> float:
+        """来源的刷新周期，不超过缓存新鲜期，客户端始终拿到新鲜的结果"""
+        declared = self._intervals.get(cache_key)
+        interval = self.interval or self.cache.ttl
+        if declared:
+            # 声明的 interval 不缩短配置的刷新间隔
+            interval = max(declared, self.interval) if self.interval else declared
+        return min(interval, self.cache.ttl)
+
+    def due_at(self, cache_key: str, entry) -> float:
+        """条目的计划刷新时间，抖动由条目写入时间决定，多次检查结果相同"""
+        period = self.period(cache_key)
+        offset = random.Random(f'{cache_key}|{entry.stored_at}').uniform(0, self.jitter * period)
+        # 提前一个检查周期，保证在过期前完成刷新
+        return min(entry.stored_at + period, entry.fresh_until) - offset - self.check_interval
+
+    def tick(self, now: Optional[float] = None) -> int:
+        """检查一次热门来源，返回本次开始的刷新数；now 只用于判断是否到期"""
+        self._decay(time.time())
+        now = time.time() if now is None else now
+        with self._lock:
+            self.stats['checks'] += 1
+
+        started = 0
+        for cache_key, source in self.hot_sources():
+            with self._lock:
+                if cache_key in self._in_flight:
+                    continue
+            # 条目已被淘汰时立即重新下载，下一个请求不必等待转换
+            entry = self.cache.peek(cache_key)
+            if entry is not None and now < self.due_at(cache_key, entry):
+                continue
+
+            with self._lock:
+                if len(self._in_flight) >= self.concurrency:
+                    self.stats['deferred'] += 1
+                    continue
+            if not self.cache.begin_refresh(cache_key):
+                continue
+
+            with self._lock:
+                self._in_flight.add(cache_key)
+                self.stats['scheduled'] += 1
+            self._get_executor().submit(self._run, cache_key, source['url'], entry, source['behavior'])
+            started += 1
+        return started
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='refresh')
+            return self._executor
+
+    def _run(self, cache_key: str, url: str, entry, behavior: Optional[str]):
+        try:
+            self.refresh(cache_key, url, entry, behavior)
+        finally:
+            with self._lock:
+                self._in_flight.discard(cache_key)
+
+    def _loop(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"后台刷新调度失败: {e}")
+
+    def start(self):
+        """启动后台检查线程，top_n 为0时不启动"""
+        if self.top_n <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='refresh-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台检查线程，进行中的刷新继续完成"""
+        self._stop.set()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度统计信息"""
+        with self._lock:
+            stats = self.stats.copy()
+            stats['tracked'] = len(self._sources)
+            stats['hot'] = sum(1 for source in self._sources.values() if source['hits'] >= self.min_hits)
+            stats['in_flight'] = len(self._in_flight)
+        stats['running'] = self._thread is not None and self._thread.is_alive()
+        stats['top_n'] = self.top_n
+        return stats
@@ -0,0 +1,292 @@
+"""
+规则转换结果缓存
+
+以规范化后的上游URL为键，缓存预序列化的Sing-box规则JSON字节：
+- TTL内直接命中，不访问网络也不重新转换
+- 过期后的宽限期内返回旧结果，同时由调用方在后台刷新 (stale-while-revalidate)
+- 按总字节数上限进行LRU淘汰
+- 保存上游 ETag / Last-Modified 校验值用于条件请求，并为输出生成稳定的 ETag
+- 可选地在写入时保存预压缩的版本，命中时无需再压缩
+- 可选地以共享存储为二级缓存，多个worker共用同一份转换结果和统计
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+
+# 每个缓存条目的估算固定开销(字节)
+ENTRY_OVERHEAD = 256
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url: str) -> str:
+    """规范化上游URL，用作缓存键"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+
+    netloc = host
+    if parts.username is not None:
+        userinfo = parts.username
+        if parts.password is not None:
+            userinfo += ':' + parts.password
+        netloc = f"{userinfo}@{netloc}"
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc += f":{parts.port}"
+
+    # 片段不会发送到服务器，忽略
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+class CacheEntry:
+    """缓存条目"""
+
+    __slots__ = ('body', 'encoded', 'etag', 'upstream_etag', 'upstream_last_modified',
+                 'stored_at', 'fresh_until', 'stale_until', 'size')
+
+    def __init__(self, body: bytes, ttl: float, stale_ttl: float,
+                 upstream_etag: Optional[str] = None, upstream_last_modified: Optional[str] = None,
+                 encoded: Optional[Dict[str, bytes]] = None):
+        self.body = body
+        # 按内容编码(gzip/br)保存的压缩版本
+        self.encoded = encoded or {}
+        # 输出内容的摘要，内容不变时ETag不变
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.upstream_etag = upstream_etag
+        self.upstream_last_modified = upstream_last_modified
+        self.size = len(body) + sum(len(data) for data in self.encoded.values()) + ENTRY_OVERHEAD
+        self.touch(ttl, stale_ttl)
+
+    def touch(self, ttl: float, stale_ttl: float):
+        """重置条目的新鲜期"""
+        now = time.time()
+        self.stored_at = now
+        self.fresh_until = now + ttl
+        self.stale_until = now + ttl + stale_ttl
+
+    def meta(self) -> Dict[str, Any]:
+        """写入共享存储的元数据"""
+        return {
+            'etag': self.etag,
+            'upstream_etag': self.upstream_etag,
+            'upstream_last_modified': self.upstream_last_modified,
+            'stored_at': self.stored_at,
+            'fresh_until': self.fresh_until,
+            'stale_until': self.stale_until
+        }
+
+    def apply_meta(self, meta: Dict[str, Any]):
+        """使用共享存储中的元数据，其他worker可能已经更新了有效期或上游校验值"""
+        self.upstream_etag = meta['upstream_etag']
+        self.upstream_last_modified = meta['upstream_last_modified']
+        self.stored_at = meta['stored_at']
+        self.fresh_until = meta['fresh_until']
+        self.stale_until = meta['stale_until']
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """生成向上游发送的条件请求头"""
+        headers = {}
+        if self.upstream_etag:
+            headers['If-None-Match'] = self.upstream_etag
+        if self.upstream_last_modified:
+            headers['If-Modified-Since'] = self.upstream_last_modified
+        return headers
+
+    def state(self, now: Optional[float] = None) -> str:
+        """返回条目状态: fresh / stale / expired"""
+        now = time.time() if now is None else now
+        if now < self.fresh_until:
+            return 'fresh'
+        if now < self.stale_until:
+            return 'stale'
+        return 'expired'
+
+
+class RuleCache:
+    """线程安全的LRU转换结果缓存
+
+    指定共享存储时，进程内的条目作为一级缓存，共享存储作为二级缓存：
+    命中时先读取共享存储中的元数据，ETag与本地条目一致则直接使用本地内容，否则从共享存储加载。
+    """
+
+    def __init__(self, ttl: float = 600, stale_ttl: float = 3600, max_bytes: int = 128 * 1024 * 1024,
+                 compressor: Optional[Callable[[bytes], Dict[str, bytes]]] = None,
+                 shared_store=None, namespace: str = 'rules'):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        # 写入时生成压缩版本的函数，返回 {编码: 压缩后的字节}
+        self.compressor = compressor
+        # 多worker共享的存储(shared_store.SQLiteStore)，为None时只使用进程内缓存
+        self.shared_store = shared_store
+        self.namespace = namespace
+
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._refreshing = set()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'refreshes': 0,
+            'not_modified': 0
+        }
+
+    def _count(self, name: str):
+        """累加统计计数，使用共享存储时计入共享计数器"""
+        if self.shared_store is not None:
+            self.shared_store.incr(f'cache.{self.namespace}.{name}')
+        else:
+            with self._lock:
+                self.stats[name] += 1
+
+    def lookup(self, key: str) -> Tuple[Optional[CacheEntry], str]:
+        """查找缓存，返回 (条目, 状态)，状态为 fresh / stale / expired / miss"""
+        if self.shared_store is not None:
+            entry = self._lookup_shared(key)
+        else:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+
+        if entry is None:
+            self._count('misses')
+            return None, 'miss'
+
+        state = entry.state()
+        if state == 'fresh':
+            self._count('hits')
+        elif state == 'stale':
+            self._count('stale_hits')
+        else:
+            self._count('misses')
+        return entry, state
+
+    def peek(self, key: str) -> Optional[CacheEntry]:
+        """查找条目但不计入命中统计，供后台刷新调度检查有效期"""
+        if self.shared_store is not None:
+            return self._lookup_shared(key)
+        with self._lock:
+            return self._entries.get(key)
+
+    def _lookup_shared(self, key: str) -> Optional[CacheEntry]:
+        """从共享存储查找，内容未变化时复用进程内的条目"""
+        meta = self.shared_store.get_artifact_meta(self.namespace, key)
+        if meta is None:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None or entry.etag != meta['etag']:
+            loaded = self.shared_store.load_artifact(self.namespace, key)
+            if loaded is None:
+                return None
+            meta, blobs = loaded
+            body = blobs.pop('')
+            entry = CacheEntry(body, self.ttl, self.stale_ttl, encoded=blobs)
+            with self._lock:
+                self._insert(key, entry)
+
+        entry.apply_meta(meta)
+        return entry
+
+    def _store_shared(self, key: str, entry: CacheEntry):
+        """写入共享存储，单个条目超过上限时不写入"""
+        if entry.size > self.max_bytes:
+            return
+        blobs = dict(entry.encoded)
+        blobs[''] = entry.body
+        evicted = self.shared_store.put_artifact(self.namespace, key, entry.meta(), blobs, entry.size, self.max_bytes)
+        if evicted:
+            self.shared_store.incr(f'cache.{self.namespace}.evictions', evicted)
+
+    def store(self, key: str, body: bytes, upstream_etag: Optional[str] = None,
+              upstream_last_modified: Optional[str] = None) -> CacheEntry:
+        """写入缓存并按字节上限淘汰最久未使用的条目"""
+        encoded = self.compressor(body) if self.compressor is not None else None
+        entry = CacheEntry(body, self.ttl, self.stale_ttl, upstream_etag, upstream_last_modified, encoded)
+        if self.shared_store is not None:
+            self._store_shared(key, entry)
+        with self._lock:
+            self._insert(key, entry)
+        return entry
+
+    def renew(self, key: str, entry: CacheEntry) -> CacheEntry:
+        """上游内容未变化(304)时复用已有转换结果并重置新鲜期"""
+        with self._lock:
+            entry.touch(self.ttl, self.stale_ttl)
+            if self._entries.get(key) is not entry:
+                self._insert(key, entry)
+        if self.shared_store is not None:
+            self.shared_store.update_artifact_meta(self.namespace, key, entry.meta())
+        self._count('not_modified')
+        return entry
+
+    def _insert(self, key: str, entry: CacheEntry):
+        """插入条目并淘汰超出上限的部分，调用方需持有锁"""
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+
+        # 单个条目超过上限时不缓存
+        if entry.size > self.max_bytes:
+            return
+
+        self._entries[key] = entry
+        self._bytes += entry.size
+
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            # 共享存储的淘汰由存储自身统计
+            if self.shared_store is None:
+                self.stats['evictions'] += 1
+
+    def begin_refresh(self, key: str, lease_ttl: float = 60) -> bool:
+        """标记后台刷新开始，已有刷新进行中时返回False；使用共享存储时同一时间只有一个worker刷新"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+        lease = f'refresh:{self.namespace}:{key}'
+        if self.shared_store is not None and not self.shared_store.acquire_lease(lease, lease_ttl):
+            with self._lock:
+                self._refreshing.discard(key)
+            return False
+        self._count('refreshes')
+        return True
+
+    def end_refresh(self, key: str):
+        """标记后台刷新结束"""
+        if self.shared_store is not None:
+            self.shared_store.release_lease(f'refresh:{self.namespace}:{key}')
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        if self.shared_store is not None:
+            stats = dict.fromkeys(self.stats, 0)
+            stats.update(self.shared_store.counters(f'cache.{self.namespace}.'))
+            stats['entries'], stats['bytes'] = self.shared_store.artifact_usage(self.namespace)
+            stats['max_bytes'] = self.max_bytes
+        else:
+            with self._lock:
+                stats = self.stats.copy()
+                stats['entries'] = len(self._entries)
+                stats['bytes'] = self._bytes
+                stats['max_bytes'] = self.max_bytes
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['hits'] + stats['stale_hits']) / lookups * 100, 1) if lookups else 0
+        return stats
@@ -14,15 +14,375 @@ import yaml
 import argparse
 import time
 import os
-from typing import Dict, List, Any, Optional, Union
+import codecs
+import itertools
+import mmap
+from collections import defaultdict
+from typing import Dict, List, Any, Optional, Union, Iterable, Iterator, Tuple, Callable
 from urllib.parse import urlparse
 import ipaddress
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from sources import BEHAVIORS
+from srs import write_rule_set
+
+
+# 流式转换时用于格式检测的有效行数
+DETECT_SAMPLE_LINES = 10
+
+# 按块切分行时每块的字符数，只有当前块的行同时存在于内存中
+LINE_CHUNK_CHARS = 1024 * 1024
+
+# 域名格式：由字母、数字和连字符组成的标签，以.分隔
+_DOMAIN_LABEL = r'[a-zA-Z0-9](?:[a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?'
+DOMAIN_PATTERN = re.compile(rf'^{_DOMAIN_LABEL}(?:\.{_DOMAIN_LABEL})*$')
+
+# 批量校验域名：整批拼接后一次匹配，全部合法时无需逐行处理，否则逐行找出合法的域名
+_DOMAIN_BATCH_PATTERN = re.compile(rf'(?:{_DOMAIN_LABEL}(?:\.{_DOMAIN_LABEL})*\n)*{_DOMAIN_LABEL}(?:\.{_DOMAIN_LABEL})*')
+_DOMAIN_LINES_PATTERN = re.compile(rf'^{_DOMAIN_LABEL}(?:\.{_DOMAIN_LABEL})*$', re.MULTILINE)
+
+# 批量校验域名的每批行数
+DOMAIN_BATCH_SIZE = 4096
+
+# 文本格式对应的behavior类型
+FORMAT_BEHAVIORS = {
+    'text-classical': 'classical',
+    'text-domain': 'domain',
+    'text-ipcidr': 'ipcidr'
+}
+
+# 并行转换时用于格式检测的文件开头字节数
+PARALLEL_HEAD_BYTES = 64 * 1024
+
+# 并行转换的最小分块大小，小于两块的文件不启动子进程
+PARALLEL_MIN_CHUNK_BYTES = 1024 * 1024
+
+# 每个子进程分到的分块数，分块更小使各进程的负载更均衡
+PARALLEL_CHUNKS_PER_JOB = 4
+
+# YAML文档开头的 payload 键
+_PAYLOAD_KEY_PATTERN = re.compile(r'^payload:[ \t]*(?:#.*)?$')
+
+# 优先使用libyaml加速的解析器
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# PyYAML隐式类型解析规则，用于判断未加引号的标量是否会被解析为字符串
+_YAML_IMPLICIT_RESOLVERS = yaml.resolver.Resolver.yaml_implicit_resolvers
+
+# 不能作为未加引号标量开头的字符
+_YAML_PLAIN_INDICATORS = set(',[]{}#&*!|>\'"%@`')
+
+# YAML不允许出现的字符，以及YAML视为换行的特殊字符
+_YAML_NON_PRINTABLE = re.compile('[^\x09\x0A\x0D\x20-\x7E\x85\xA0-\uD7FF\uE000-\uFFFD\U00010000-\U0010FFFF]|[\x85\u2028\u2029]')
+
+
+def _parse_yaml_scalar(text: str) -> Optional[str]:
+    """解析单行的YAML字符串标量，无法确定结果时返回None"""
+    quote = text[0]
+    
+    if quote == "'":
+        # 单引号内只有 '' 一种转义
+        value = []
+        pos = 1
+        while True:
+            end = text.find("'", pos)
+            if end == -1:
+                return None
+            value.append(text[pos:end])
+            if text.startswith("''", end):
+                value.append("'")
+                pos = end + 2
+                continue
+            rest = text[end + 1:].lstrip(' ')
+            if rest and not rest.startswith('#'):
+                return None
+            return ''.join(value)
+    
+    if quote == '"':
+        end = text.find('"', 1)
+        value = text[1:end]
+        if end == -1 or '\\' in value:
+            return None
+        rest = text[end + 1:].lstrip(' ')
+        if rest and not rest.startswith('#'):
+            return None
+        return value
+    
+    # 未加引号的标量
+    if quote in _YAML_PLAIN_INDICATORS or text[:2] in ('- ', '? ', ': ') or text in ('-', '?', ':'):
+        return None
+    
+    comment = text.find(' #')
+    value = (text[:comment] if comment != -1 else text).rstrip(' ')
+    if not value or ': ' in value or value.endswith(':'):
+        return None
+    
+    # 会被解析为数字、布尔值、空值等非字符串类型
+    for _, regexp in _YAML_IMPLICIT_RESOLVERS.get(value[0], []) + _YAML_IMPLICIT_RESOLVERS.get(None, []):
+        if regexp.match(value):
+            return None
+    return value
+
+
+class NotFlatPayloadError(ValueError):
+    """内容不是扁平的 payload 字符串列表"""
+
+
+def iter_flat_payload_lines(lines: Iterable[str]) -> Iterator[str]:
+    """逐行解析只包含 payload 字符串列表的YAML文档，边读取边产出规则
+    
+    Rule Provider几乎都是这种扁平结构，无需构建完整的YAML对象树；
+    遇到嵌套结构、其他键、转义或会被解析为非字符串的标量时抛出 NotFlatPayloadError，由调用方回退到通用解析器
+    """
+    has_key = False
+    item_indent = None
+    
+    for line in lines:
+        if line.endswith('\r'):
+            line = line[:-1]
+        if '\t' in line:
+            raise NotFlatPayloadError('tab in payload')
+        stripped = line.lstrip(' ')
+        if not stripped or stripped.startswith('#'):
+            continue
+        
+        if not has_key:
+            key, _, rest = stripped.partition(':')
+            rest = rest.strip()
+            if len(stripped) != len(line) or key != 'payload' or (rest and not rest.startswith('#')):
+                raise NotFlatPayloadError('content before payload key')
+            has_key = True
+            continue
+        
+        item = parse_payload_item(line, stripped)
+        if item is None:
+            raise NotFlatPayloadError('not a plain string item')
+        indent, value = item
+        if item_indent is None:
+            item_indent = indent
+        if indent != item_indent:
+            raise NotFlatPayloadError('nested payload')
+        yield value
+
+
+def parse_flat_payload_lines(lines: Iterable[str]) -> Optional[List[str]]:
+    """解析扁平的 payload 列表，不是扁平结构时返回None"""
+    try:
+        payload = list(iter_flat_payload_lines(lines))
+    except NotFlatPayloadError:
+        return None
+    # 空payload交给通用解析器处理
+    return payload or None
+
+
+def parse_payload_item(line: str, stripped: str) -> Optional[Tuple[int, str]]:
+    """解析 payload 列表中的一行 "- 规则"，stripped 为去掉行首空格后的内容，返回 (缩进, 规则)；不是单行字符串条目时返回None"""
+    if not stripped.startswith('- '):
+        return None
+    value = stripped[2:].lstrip(' ')
+    if not value:
+        return None
+    value = _parse_yaml_scalar(value)
+    if value is None:
+        return None
+    return len(line) - len(stripped), value
+
+
+def parse_flat_payload(content: str) -> Optional[List[str]]:
+    """解析扁平的 payload 列表，不是扁平结构时返回None"""
+    if not is_flat_payload_text(content):
+        return None
+    return parse_flat_payload_lines(iter_lines(content))
+
+
+def is_flat_payload_text(content: str) -> bool:
+    """内容中没有逐行解析无法处理的BOM、特殊字符和单独的\r"""
+    if content.startswith('\ufeff') or _YAML_NON_PRINTABLE.search(content):
+        return False
+    return content.count('\r') == content.count('\r\n')
+
+
+def iter_lines(content: str, chunk_chars: int = LINE_CHUNK_CHARS) -> Iterator[str]:
+    """按块切分文本为行，结果与 content.split('\\n') 相同，但不会一次生成全部行的列表"""
+    start = 0
+    length = len(content)
+    while length - start > chunk_chars:
+        end = content.rfind('\n', start, start + chunk_chars)
+        if end == -1:
+            end = content.find('\n', start + chunk_chars)
+            if end == -1:
+                break
+        yield from content[start:end].split('\n')
+        start = end + 1
+    yield from content[start:].split('\n')
+
+
+def iter_head_lines(content: str) -> Iterator[str]:
+    """按需逐行读取文本开头，不复制整个内容"""
+    start = 0
+    length = len(content)
+    while start < length:
+        end = content.find('\n', start)
+        if end == -1:
+            end = length
+        yield content[start:end]
+        start = end + 1
+
+
+# 后缀字典树节点上的标记，与域名标签(字符串)互不冲突
+_COVERS_SELF = 0  # 后缀本身也匹配，即不带前导.的 domain_suffix
+_COVERS_SUBDOMAINS = 1  # 匹配所有子域名
+
+
+def subsume_domain_rules(domains: Iterable[str], suffixes: Iterable[str]) -> Tuple[set, set]:
+    """用按标签倒序的后缀字典树去掉被更短后缀覆盖的 domain_suffix 和 domain，返回保留的 (domains, suffixes)
+    
+    domain_suffix 为 example.com 时匹配 example.com 及其所有子域名，为 .example.com 时只匹配子域名
+    """
+    suffixes = set(suffixes)
+    
+    # 建树，每个后缀的标签按从顶级域名开始的顺序逐层插入
+    root = {}
+    for suffix in suffixes:
+        dotted = suffix.startswith('.')
+        node = root
+        for label in reversed((suffix[1:] if dotted else suffix).split('.')):
+            child = node.get(label)
+            if child is None:
+                child = node[label] = {}
+            node = child
+        node[_COVERS_SUBDOMAINS] = True
+        if not dotted:
+            node[_COVERS_SELF] = True
+    
+    def covered(name: str, self_marker) -> bool:
+        """沿树查找，name的上级后缀匹配所有子域名，或同名节点带有指定标记时视为已覆盖"""
+        first, *parents = name.split('.')
+        node = root
+        for label in reversed(parents):
+            node = node.get(label)
+            if node is None:
+                return False
+            if _COVERS_SUBDOMAINS in node:
+                return True
+        node = node.get(first)
+        return node is not None and self_marker in node
+    
+    # .example.com 与 example.com 并存时保留后者
+    kept_suffixes = {
+        suffix for suffix in suffixes
+        if not (covered(suffix[1:], _COVERS_SELF) if suffix.startswith('.') else covered(suffix, None))
+    }
+    kept_domains = {domain for domain in domains if not covered(domain, _COVERS_SELF)}
+    return kept_domains, kept_suffixes
+
+
+# 输出IP网段的字段
+CIDR_FIELDS = ('ip_cidr', 'source_ip_cidr')
+
+
+def cidr_range(network: Union[ipaddress.IPv4Network, ipaddress.IPv6Network]) -> Tuple[int, int, int]:
+    """把已解析的网段转换为 (版本, 起始地址, 结束地址) 整数区间"""
+    first = int(network.network_address)
+    return network.version, first, first | ((1 << (network.max_prefixlen - network.prefixlen)) - 1)
+
+
+def _format_ipv4(address: int) -> str:
+    return f"{address >> 24}.{address >> 16 & 255}.{address >> 8 & 255}.{address & 255}"
+
+
+def collapse_cidr_ranges(ranges: Iterable[Tuple[int, int, int]]) -> List[str]:
+    """合并相邻和重叠的整数区间，输出覆盖范围相同的最少CIDR网段"""
+    collapsed = []
+    for version, format_address in ((4, _format_ipv4), (6, lambda address: str(ipaddress.IPv6Address(address)))):
+        bits = 32 if version == 4 else 128
+        intervals = sorted((first, last) for range_version, first, last in ranges if range_version == version)
+        
+        merged = []
+        for first, last in intervals:
+            if merged and first <= merged[-1][1] + 1:
+                if last > merged[-1][1]:
+                    merged[-1][1] = last
+            else:
+                merged.append([first, last])
+        
+        # 每个区间按地址对齐拆分为尽可能大的网段
+        for first, last in merged:
+            while first <= last:
+                # 网段大小受起始地址的对齐和剩余长度两者限制
+                size = 1 << ((last - first + 1).bit_length() - 1)
+                if first & (size - 1):
+                    size = first & -first
+                collapsed.append(f"{format_address(first)}/{bits - size.bit_length() + 1}")
+                first += size
+    return collapsed
+
+
+class ContentTooLargeError(ValueError):
+    """输入内容超过大小限制"""
+
+
+class StreamLineReader:
+    """把字节块流增量解码为行，并统计已读取的字节数"""
+    
+    def __init__(self, chunks: Iterable[bytes], encoding: str = 'utf-8', max_bytes: Optional[int] = None):
+        self.chunks = chunks
+        self.encoding = encoding
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+    
+    def __iter__(self) -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        pending = ''
+        
+        for chunk in self.chunks:
+            if not chunk:
+                continue
+            self.bytes_read += len(chunk)
+            if self.max_bytes is not None and self.bytes_read > self.max_bytes:
+                raise ContentTooLargeError(f'Content exceeds {self.max_bytes} bytes')
+            
+            lines = (pending + decoder.decode(chunk)).split('\n')
+            pending = lines.pop()
+            yield from lines
+        
+        pending += decoder.decode(b'', final=True)
+        if pending:
+            yield pending
+
+
+class ParsedRule:
+    """parse_rule_line 解析出的单条规则，原始行只在调试时保留"""
+    
+    __slots__ = ('type', 'argument', 'policy', 'no_resolve', 'original')
+    
+    def __init__(self, rule_type: str, argument: str, policy: str = '', no_resolve: bool = False,
+                 original: Optional[str] = None):
+        self.type = rule_type
+        self.argument = argument
+        self.policy = policy
+        self.no_resolve = no_resolve
+        self.original = original
+    
+    def __getitem__(self, key: str):
+        """兼容按键读取字段的调用方"""
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
 
 
 class RuleConverter:
     """Clash规则到Sing-box规则的转换器"""
     
-    def __init__(self):
+    def __init__(self, optimize_domains: bool = False, aggregate_cidrs: bool = False, keep_original: bool = False):
+        # 是否去掉被 domain_suffix 覆盖的 domain 和 domain_suffix
+        self.optimize_domains = optimize_domains
+        # 是否把 ip_cidr 和 source_ip_cidr 合并为最少的网段
+        self.aggregate_cidrs = aggregate_cidrs
+        # parse_rule_line 的结果是否保留原始行，仅调试时使用
+        self.keep_original = keep_original
+        
         self.supported_clash_rules = {
             'DOMAIN', 'DOMAIN-SUFFIX', 'DOMAIN-KEYWORD', 'GEOIP', 
             'IP-CIDR', 'IP-CIDR6', 'SRC-IP-CIDR', 'SRC-PORT', 
@@ -30,11 +390,29 @@ class RuleConverter:
             'GEOSITE', 'URL-REGEX'
         }
         
+        # 规则类型到处理函数的分发表，处理函数把结果直接写入按输出字段聚合的集合
+        self.rule_handlers = {
+            'DOMAIN': self._field_handler('domain'),
+            'DOMAIN-SUFFIX': self._field_handler('domain_suffix'),
+            'DOMAIN-KEYWORD': self._field_handler('domain_keyword'),
+            'GEOIP': self._field_handler('geoip', str.upper),
+            'GEOSITE': self._field_handler('geosite', str.lower),
+            'IP-CIDR': self._ip_cidr_handler('ip_cidr', ipaddress.IPv4Network),
+            'IP-CIDR6': self._ip_cidr_handler('ip_cidr', ipaddress.IPv6Network),
+            'SRC-IP-CIDR': self._ip_cidr_handler('source_ip_cidr', ipaddress.IPv4Network),
+            'SRC-PORT': self._port_handler(True),
+            'DST-PORT': self._port_handler(False),
+            'PROCESS-PATH': self._field_handler('process_path'),
+            'URL-REGEX': self._field_handler('domain_regex'),
+            'MATCH': lambda argument, fields: False
+        }
+        
         self.rule_stats = {
             'total_rules': 0,
             'converted_rules': 0,
             'skipped_rules': 0,
             'unsupported_rules': 0,
+            'eliminated_rules': 0,
             'processing_time': 0.0,
             'file_size': 0,
             'rule_provider_format': None
@@ -42,90 +420,109 @@ class RuleConverter:
     
     def detect_rule_provider_format(self, content: str) -> Optional[str]:
         """检测Rule Provider格式类型"""
-        content = content.strip()
+        return self._detect_format(content)[0]
+    
+    def _detect_format(self, content: str) -> Tuple[Optional[str], Optional[List[str]]]:
+        """只根据开头的若干有效行检测格式
         
-        try:
-            data = yaml.safe_load(content)
-            if isinstance(data, dict) and 'payload' in data:
-                return 'yaml'
-        except:
-            pass
+        省略payload键的YAML列表需要试解析才能确认，此时一并返回解析结果供后续转换复用
+        """
+        sample = []
+        for line in iter_head_lines(content):
+            stripped = line.strip()
+            if stripped and not stripped.startswith('#'):
+                sample.append(line)
+                if len(sample) >= DETECT_SAMPLE_LINES:
+                    break
+        
+        if not sample:
+            return None, None
         
-        # 检查是否是YAML格式的简单判断
-        if content.startswith('payload:'):
-            return 'yaml'
+        first_line = sample[0].strip()
         
-        # 检查是否包含YAML语法特征
-        if ':\n' in content or '  - ' in content or content.startswith('- '):
+        # 带payload键的YAML文档
+        if first_line.startswith('payload:') or any(line.startswith('payload:') for line in sample):
+            return 'yaml', None
+        
+        # 省略payload键的YAML列表，试解析失败时按文本格式检测
+        if first_line.startswith('- '):
             try:
-                fixed_content = content
-                if not content.startswith('payload:') and ('  - ' in content or content.startswith('- ')):
-                    fixed_content = 'payload:\n' + content
-                
-                data = yaml.safe_load(fixed_content)
-                if isinstance(data, dict) and 'payload' in data:
-                    return 'yaml'
-            except:
-                pass
+                rules = self.load_yaml_payload('payload:\n' + content)
+            except yaml.YAMLError:
+                rules = None
+            if rules is not None:
+                return 'yaml', rules
         
-        # 检查是否是纯文本格式
-        lines = content.split('\n')
-        non_comment_lines = [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+        # 纯文本格式
+        non_comment_lines = [line.strip() for line in sample]
         
-        if non_comment_lines:
-            # 检查是否包含Clash规则格式
-            clash_format_count = sum(1 for line in non_comment_lines[:10] 
-                                   if ',' in line and any(line.upper().startswith(rule_type + ',') 
-                                   for rule_type in self.supported_clash_rules))
-            
-            # 检查是否包含域名格式
-            domain_format_count = sum(1 for line in non_comment_lines[:10] 
-                                    if line.startswith('.') or self.is_valid_domain(line))
-            
-            if clash_format_count > 0:
-                return 'text-classical'
-            elif domain_format_count > 0:
-                return 'text-domain'
-            else:
-                return 'text-ipcidr'
+        # 检查是否包含Clash规则格式
+        clash_format_count = sum(1 for line in non_comment_lines 
+                               if ',' in line and any(line.upper().startswith(rule_type + ',') 
+                               for rule_type in self.supported_clash_rules))
+        
+        # 检查是否包含域名格式
+        valid_domains = self.filter_valid_domains(non_comment_lines)
+        domain_format_count = sum(1 for line in non_comment_lines 
+                                if line.startswith('.') or line in valid_domains)
         
+        if clash_format_count > 0:
+            return 'text-classical', None
+        elif domain_format_count > 0:
+            return 'text-domain', None
+        else:
+            return 'text-ipcidr', None
+    
+    def load_yaml_payload(self, content: str) -> Optional[List[str]]:
+        """解析YAML文档中的payload列表，不是有效的Rule Provider时返回None"""
+        rules = parse_flat_payload(content)
+        if rules is not None:
+            return rules
+        
+        data = yaml.load(content, Loader=YAML_LOADER)
+        if isinstance(data, dict) and 'payload' in data:
+            return data['payload']
         return None
     
     def parse_rule_provider_yaml(self, content: str) -> List[str]:
         """解析YAML格式的Rule Provider"""
         try:
-            data = yaml.safe_load(content)
-            if isinstance(data, dict) and 'payload' in data:
-                return data['payload']
+            rules = self.load_yaml_payload(content)
+            if rules is not None:
+                return rules
         except Exception as e:
             print(f"YAML解析错误: {e}")
         return []
     
     def parse_rule_provider_text(self, content: str) -> List[str]:
         """解析文本格式的Rule Provider"""
-        lines = content.strip().split('\n')
-        rules = []
-        
-        for line in lines:
-            line = line.strip()
-            if line and not line.startswith('#'):
-                rules.append(line)
-        
-        return rules
+        return list(self.iter_rule_lines(iter_lines(content)))
     
     def convert_rule_provider(self, content: str, behavior: str = None) -> Dict[str, Any]:
         """转换Rule Provider格式"""
-        format_type = self.detect_rule_provider_format(content)
+        format_type, rules = self._detect_format(content)
+        return self._convert_detected(content, behavior, format_type, rules)
+    
+    def _convert_detected(self, content: str, behavior: Optional[str], format_type: Optional[str],
+                          rules: Optional[List[str]]) -> Dict[str, Any]:
+        """按已检测的格式转换，rules为检测阶段已解析出的规则"""
         self.rule_stats['rule_provider_format'] = format_type
         
         if not format_type:
             return self.convert(content)
         
-        # 解析规则
-        if format_type == 'yaml':
-            rules = self.parse_rule_provider_yaml(content)
-        else:
-            rules = self.parse_rule_provider_text(content)
+        # 解析规则，检测阶段已解析过的不再重复解析；文本格式和扁平的payload列表边解析边转换，不生成全部规则的列表
+        if rules is None:
+            if format_type == 'yaml':
+                result = self._convert_flat_payload(content, behavior)
+                if result is not None:
+                    return result
+                rules = self.parse_rule_provider_yaml(content)
+            elif behavior or format_type in FORMAT_BEHAVIORS:
+                return self.convert_by_behavior(self.iter_rule_lines(iter_lines(content)),
+                                                behavior or FORMAT_BEHAVIORS[format_type])
+            else:
+                rules = self.parse_rule_provider_text(content)
         
         # 根据behavior类型处理规则
         if behavior:
@@ -134,92 +531,200 @@ class RuleConverter:
             # 自动检测behavior类型
             return self.convert_with_auto_behavior(rules, format_type)
     
-    def convert_by_behavior(self, rules: List[str], behavior: str) -> Dict[str, Any]:
+    def _convert_flat_payload(self, content: str, behavior: Optional[str]) -> Optional[Dict[str, Any]]:
+        """边解析扁平的 payload 列表边转换，不是扁平结构或payload为空时返回None"""
+        if not is_flat_payload_text(content):
+            return None
+        items = iter_flat_payload_lines(iter_lines(content))
+        try:
+            head = list(itertools.islice(items, 10))
+            if not head:
+                return None
+            # 统计在全部规则转换完成后才累加，中途回退时不会重复计数
+            return self.convert_by_behavior(itertools.chain(head, items),
+                                            behavior or self.detect_payload_behavior(head))
+        except NotFlatPayloadError:
+            return None
+    
+    def convert_by_behavior(self, rules: Iterable[str], behavior: str) -> Dict[str, Any]:
         """根据指定的behavior类型转换规则"""
-        converted_rules = []
+        fields = defaultdict(set)
+        self.collect_by_behavior(rules, behavior, fields)
         
-        for rule in rules:
-            self.rule_stats['total_rules'] += 1
+        return {
+            "rules": self.build_rules(fields),
+            "version": 2
+        }
+    
+    def collect_by_behavior(self, rules: Iterable[str], behavior: str, fields: Dict[str, set]) -> Tuple[int, int]:
+        """按behavior类型把规则写入按输出字段聚合的集合，返回总行数和转换成功的行数"""
+        if behavior == 'domain':
+            total, converted = self._convert_domain_lines(rules, fields)
+        else:
+            convert_line = self.line_converter(behavior)
+            total = converted = 0
+            for rule in rules:
+                total += 1
+                if convert_line(rule, fields):
+                    converted += 1
+        
+        self.rule_stats['total_rules'] += total
+        self.rule_stats['converted_rules'] += converted
+        self.rule_stats['skipped_rules'] += total - converted
+        return total, converted
+    
+    def line_converter(self, behavior: str) -> Callable[[str, Dict[str, set]], bool]:
+        """behavior类型对应的逐行转换函数，把一条规则写入按字段聚合的集合，返回是否转换成功"""
+        if behavior == 'domain':
+            return self._convert_domain_line
+        if behavior == 'ipcidr':
+            return self._convert_ipcidr_line
+        if behavior == 'classical':
+            return self._convert_classical_line
+        # 未知behavior不产生任何规则
+        return lambda rule, fields: True
+    
+    def _convert_domain_line(self, rule: str, fields: Dict[str, set]) -> bool:
+        """domain行为的单条规则，与 _convert_domain_lines 结果一致"""
+        if rule.startswith('.'):
+            fields['domain_suffix'].add(rule[1:])
+        elif self.is_valid_domain(rule):
+            fields['domain'].add(rule)
+        else:
+            return False
+        return True
+    
+    def _convert_domain_lines(self, rules: Iterable[str], fields: Dict[str, set]) -> Tuple[int, int]:
+        """domain行为：以.开头的为域名后缀，否则为完整域名，按批校验域名格式"""
+        total = skipped = 0
+        rule_iter = iter(rules)
+        while True:
+            batch = list(itertools.islice(rule_iter, DOMAIN_BATCH_SIZE))
+            if not batch:
+                break
             
-            if behavior == 'domain':
+            valid = self.filter_valid_domains([rule for rule in batch if not rule.startswith('.')])
+            for rule in batch:
                 if rule.startswith('.'):
-                    converted_rules.append(self.convert_domain_suffix_rule(rule[1:]))
-                elif self.is_valid_domain(rule):
-                    converted_rules.append(self.convert_domain_rule(rule))
+                    fields['domain_suffix'].add(rule[1:])
+                elif rule in valid:
+                    fields['domain'].add(rule)
                 else:
-                    self.rule_stats['skipped_rules'] += 1
-                    continue
-            elif behavior == 'ipcidr':
-                try:
-                    ipaddress.ip_network(rule, strict=False)
-                    converted_rules.append(self.convert_ip_cidr_rule(rule))
-                except ValueError:
-                    self.rule_stats['skipped_rules'] += 1
-                    continue
-            elif behavior == 'classical':
-                parsed_rule = self.parse_rule_line(rule)
-                if parsed_rule:
-                    converted_rule = self.convert_single_rule(parsed_rule)
-                    if converted_rule:
-                        converted_rules.append(converted_rule)
-                    else:
-                        self.rule_stats['skipped_rules'] += 1
-                        continue
-                else:
-                    self.rule_stats['skipped_rules'] += 1
-                    continue
-            
-            self.rule_stats['converted_rules'] += 1
+                    skipped += 1
+            total += len(batch)
+        return total, total - skipped
+    
+    def _convert_ipcidr_line(self, rule: str, fields: Dict[str, set]) -> bool:
+        """ipcidr行为：任意有效的IP网段"""
+        try:
+            network = ipaddress.ip_network(rule, strict=False)
+        except ValueError:
+            return False
+        fields['ip_cidr'].add(cidr_range(network) if self.aggregate_cidrs else rule)
+        return True
+    
+    def _convert_classical_line(self, rule: str, fields: Dict[str, set]) -> bool:
+        """classical行为：按第一个逗号前的规则类型查分发表，与 parse_rule_line + convert_single_rule 结果一致"""
+        line = rule.strip()
+        rule_type, sep, rest = line.partition(',')
+        if sep:
+            handler = self.rule_handlers.get(rule_type.upper())
+            if handler is not None:
+                return handler(rest.partition(',')[0].strip(), fields)
         
-        rules = self.merge_rules(converted_rules)
+        # 纯域名格式
+        if line.startswith('.'):
+            fields['domain_suffix'].add(line[1:])
+        elif self.is_valid_domain(line):
+            fields['domain'].add(line)
+        else:
+            return False
+        return True
+    
+    @staticmethod
+    def _field_handler(field: str, transform=None):
+        """生成把参数直接写入输出字段的处理函数"""
+        if transform is None:
+            def handler(argument: str, fields: Dict[str, set]) -> bool:
+                fields[field].add(argument)
+                return True
+        else:
+            def handler(argument: str, fields: Dict[str, set]) -> bool:
+                fields[field].add(transform(argument))
+                return True
+        return handler
+    
+    def _ip_cidr_handler(self, field: str, network_class):
+        """生成校验IP网段后写入输出字段的处理函数，合并网段时直接保存校验时解析出的整数区间"""
+        aggregate = self.aggregate_cidrs
         
-        return {
-            "rules": rules,
-            "version": 2
-        }
+        def handler(argument: str, fields: Dict[str, set]) -> bool:
+            try:
+                network = network_class(argument, strict=False)
+            except ValueError:
+                return False
+            fields[field].add(cidr_range(network) if aggregate else argument)
+            return True
+        return handler
+    
+    def _port_handler(self, is_source: bool):
+        """生成端口规则的处理函数"""
+        def handler(argument: str, fields: Dict[str, set]) -> bool:
+            converted = self.convert_port_rule(argument, is_source)
+            for key, values in converted.items():
+                fields[key].update(values)
+            return bool(converted)
+        return handler
+    
+    def build_rules(self, fields: Dict[str, set]) -> List[Dict[str, Any]]:
+        """把按字段聚合的结果转换为Sing-box规则列表，字段和取值均排序，相同输入总是得到相同输出"""
+        if self.optimize_domains:
+            self.optimize_domain_fields(fields)
+        if self.aggregate_cidrs:
+            self.aggregate_cidr_fields(fields)
+        return [{key: sorted(fields[key])} for key in sorted(fields) if fields[key]]
     
     def convert_with_auto_behavior(self, rules: List[str], format_type: str) -> Dict[str, Any]:
         """自动检测behavior类型并转换规则"""
-        if format_type == 'text-classical':
-            return self.convert_by_behavior(rules, 'classical')
-        elif format_type == 'text-domain':
-            return self.convert_by_behavior(rules, 'domain')
-        elif format_type == 'text-ipcidr':
-            return self.convert_by_behavior(rules, 'ipcidr')
+        if format_type in FORMAT_BEHAVIORS:
+            return self.convert_by_behavior(rules, FORMAT_BEHAVIORS[format_type])
         elif format_type == 'yaml':
             # YAML格式，需要检测payload中的规则类型
             if not rules:
                 return {"rules": [], "version": 2}
             
-            # 检测规则类型
-            sample_rules = rules[:10]
-            clash_format_count = sum(1 for rule in sample_rules 
-                                   if ',' in rule and any(rule.upper().startswith(rule_type + ',') 
-                                   for rule_type in self.supported_clash_rules))
-            
-            domain_format_count = sum(1 for rule in sample_rules 
-                                    if rule.startswith('.') or self.is_valid_domain(rule))
-            
-            ip_format_count = 0
-            for rule in sample_rules:
-                try:
-                    ipaddress.ip_network(rule, strict=False)
-                    ip_format_count += 1
-                except ValueError:
-                    pass
-            
-            # 根据检测结果选择behavior
-            if clash_format_count > 0:
-                return self.convert_by_behavior(rules, 'classical')
-            elif ip_format_count > domain_format_count:
-                return self.convert_by_behavior(rules, 'ipcidr')
-            else:
-                return self.convert_by_behavior(rules, 'domain')
+            return self.convert_by_behavior(rules, self.detect_payload_behavior(rules[:10]))
         else:
             # 混合格式，逐行检测
             return self.convert('\n'.join(rules))
+    
+    def detect_payload_behavior(self, sample_rules: List[str]) -> str:
+        """根据payload开头的若干规则检测behavior类型"""
+        clash_format_count = sum(1 for rule in sample_rules 
+                               if ',' in rule and any(rule.upper().startswith(rule_type + ',') 
+                               for rule_type in self.supported_clash_rules))
+        
+        valid_domains = self.filter_valid_domains(sample_rules)
+        domain_format_count = sum(1 for rule in sample_rules 
+                                if rule.startswith('.') or rule in valid_domains)
+        
+        ip_format_count = 0
+        for rule in sample_rules:
+            try:
+                ipaddress.ip_network(rule, strict=False)
+                ip_format_count += 1
+            except ValueError:
+                pass
+        
+        # 根据检测结果选择behavior
+        if clash_format_count > 0:
+            return 'classical'
+        elif ip_format_count > domain_format_count:
+            return 'ipcidr'
+        else:
+            return 'domain'
 
-    def parse_rule_line(self, line: str) -> Optional[Dict[str, Any]]:
+    def parse_rule_line(self, line: str) -> Optional['ParsedRule']:
         """解析单行规则，支持Clash格式和纯域名格式"""
         line = line.strip()
         
@@ -239,33 +744,16 @@ class RuleConverter:
             policy = parts[2] if len(parts) > 2 else ""
             no_resolve = len(parts) > 3 and parts[3].lower() == 'no-resolve'
             
-            return {
-                'type': rule_type,
-                'argument': argument,
-                'policy': policy,
-                'no_resolve': no_resolve,
-                'original': line
-            }
+            return ParsedRule(rule_type, argument, policy, no_resolve, line if self.keep_original else None)
         else:
+            original = line if self.keep_original else None
             # 纯域名格式
             if line.startswith('.'):
                 # 域名后缀
-                return {
-                    'type': 'DOMAIN-SUFFIX',
-                    'argument': line[1:],
-                    'policy': '',
-                    'no_resolve': False,
-                    'original': line
-                }
+                return ParsedRule('DOMAIN-SUFFIX', line[1:], original=original)
             elif self.is_valid_domain(line):
                 # 完整域名
-                return {
-                    'type': 'DOMAIN',
-                    'argument': line,
-                    'policy': '',
-                    'no_resolve': False,
-                    'original': line
-                }
+                return ParsedRule('DOMAIN', line, original=original)
         
         return None
     
@@ -337,10 +825,10 @@ class RuleConverter:
         """转换URL-REGEX规则"""
         return {"domain_regex": [argument]}
     
-    def convert_single_rule(self, parsed_rule: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def convert_single_rule(self, parsed_rule: 'ParsedRule') -> Optional[Dict[str, Any]]:
         """转换单个规则"""
-        rule_type = parsed_rule['type']
-        argument = parsed_rule['argument']
+        rule_type = parsed_rule.type
+        argument = parsed_rule.argument
         
         if rule_type == 'DOMAIN':
             return self.convert_domain_rule(argument)
@@ -390,21 +878,60 @@ class RuleConverter:
                 else:
                     merged[key].add(value)
         
-        result = []
-        for key, value_set in merged.items():
-            if value_set:
-                unique_values = list(value_set)
-                result.append({key: unique_values})
+        return self.build_rules(merged)
+    
+    def optimize_domain_fields(self, fields: Dict[str, set]):
+        """去掉被更短的 domain_suffix 覆盖的条目，并记录去掉的数量"""
+        suffixes = fields.get('domain_suffix')
+        if not suffixes:
+            return
         
-        return result
+        domains = fields.get('domain') or set()
+        kept_domains, kept_suffixes = subsume_domain_rules(domains, suffixes)
+        self.rule_stats['eliminated_rules'] += len(domains) - len(kept_domains) + len(suffixes) - len(kept_suffixes)
+        
+        fields['domain_suffix'] = kept_suffixes
+        if 'domain' in fields:
+            fields['domain'] = kept_domains
+    
+    def aggregate_cidr_fields(self, fields: Dict[str, set]):
+        """把IP网段字段合并为覆盖范围相同的最少网段，并记录减少的数量"""
+        for key in CIDR_FIELDS:
+            values = fields.get(key)
+            if not values:
+                continue
+            
+            # 分发表写入的是已解析的整数区间，逐条转换的旧路径写入的是字符串
+            ranges = [cidr_range(ipaddress.ip_network(value, strict=False)) if isinstance(value, str) else value
+                      for value in values]
+            collapsed = collapse_cidr_ranges(ranges)
+            self.rule_stats['eliminated_rules'] += len(values) - len(collapsed)
+            fields[key] = set(collapsed)
     
     def is_valid_domain(self, domain: str) -> bool:
         """验证域名格式"""
         if not domain or len(domain) > 253:
             return False
         
-        pattern = r'^[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?)*$'
-        return bool(re.match(pattern, domain))
+        return DOMAIN_PATTERN.match(domain) is not None
+    
+    def filter_valid_domains(self, domains: List[str]) -> set:
+        """批量验证域名格式，返回其中合法的域名集合，结果与逐个调用 is_valid_domain 一致"""
+        # 含换行的候选无法拼接，单独校验
+        multiline = [domain for domain in domains if '\n' in domain]
+        if multiline:
+            domains = [domain for domain in domains if '\n' not in domain]
+        
+        valid = set()
+        if domains:
+            buffer = '\n'.join(domains)
+            if max(map(len, domains)) <= 253 and _DOMAIN_BATCH_PATTERN.fullmatch(buffer):
+                valid.update(domains)
+            else:
+                # 匹配不会跨行，每个匹配都是完整的一行
+                valid.update(domain for domain in _DOMAIN_LINES_PATTERN.findall(buffer) if len(domain) <= 253)
+        valid.update(domain for domain in multiline if self.is_valid_domain(domain))
+        return valid
     
     def convert(self, content: str, behavior: str = None) -> Dict[str, Any]:
         """主转换方法"""
@@ -415,6 +942,7 @@ class RuleConverter:
             'converted_rules': 0,
             'skipped_rules': 0,
             'unsupported_rules': 0,
+            'eliminated_rules': 0,
             'processing_time': 0.0,
             'file_size': len(content.encode('utf-8')),
             'rule_provider_format': None
@@ -427,21 +955,14 @@ class RuleConverter:
             }
         
         # 检查是否是Rule Provider格式
-        if behavior or self.detect_rule_provider_format(content):
-            result = self.convert_rule_provider(content, behavior)
+        format_type, rules = self._detect_format(content)
+        if behavior or format_type:
+            result = self._convert_detected(content, behavior, format_type, rules)
         else:
-            lines = content.strip().split('\n')
-            converted_rules = []
-            
-            valid_lines = []
-            for line in lines:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    valid_lines.append(line)
-            
-            self.rule_stats['total_rules'] = len(valid_lines)
-            
-            for line in valid_lines:
+            # 逐行转换后直接写入按字段聚合的集合，与 merge_rules 的去重语义相同
+            fields = defaultdict(set)
+            for line in self.iter_rule_lines(iter_lines(content)):
+                self.rule_stats['total_rules'] += 1
                 parsed_rule = self.parse_rule_line(line)
                 if not parsed_rule:
                     self.rule_stats['skipped_rules'] += 1
@@ -449,23 +970,177 @@ class RuleConverter:
                 
                 converted_rule = self.convert_single_rule(parsed_rule)
                 if converted_rule:
-                    converted_rules.append(converted_rule)
+                    for key, values in converted_rule.items():
+                        fields[key].update(values)
                     self.rule_stats['converted_rules'] += 1
                 else:
-                    if parsed_rule['type'] in self.supported_clash_rules:
+                    if parsed_rule.type in self.supported_clash_rules:
                         self.rule_stats['skipped_rules'] += 1
                     else:
                         self.rule_stats['unsupported_rules'] += 1
             
-            rules = self.merge_rules(converted_rules)
             result = {
-                "rules": rules,
+                "rules": self.build_rules(fields),
                 "version": 2
             }
         
         self.rule_stats['processing_time'] = time.time() - start_time
         return result
     
+    def convert_lines(self, lines: Iterable[str], behavior: str = None) -> Dict[str, Any]:
+        """流式转换方法，逐行读取输入，文本格式的规则边读取边转换"""
+        start_time = time.time()
+        
+        self.rule_stats = {
+            'total_rules': 0,
+            'converted_rules': 0,
+            'skipped_rules': 0,
+            'unsupported_rules': 0,
+            'eliminated_rules': 0,
+            'processing_time': 0.0,
+            'file_size': 0,
+            'rule_provider_format': None
+        }
+        
+        # 读取开头的若干有效行用于格式检测
+        line_iter = iter(lines)
+        head = []
+        sample_count = 0
+        for line in line_iter:
+            head.append(line)
+            stripped = line.strip()
+            if stripped and not stripped.startswith('#'):
+                sample_count += 1
+                if sample_count >= DETECT_SAMPLE_LINES:
+                    break
+        
+        format_type = self.detect_rule_provider_format('\n'.join(head)) if sample_count else None
+        
+        if format_type == 'yaml':
+            # YAML需要完整文档才能解析
+            content = '\n'.join(itertools.chain(head, line_iter))
+            result = self.convert(content, behavior)
+        else:
+            self.rule_stats['rule_provider_format'] = format_type
+            rules = self.iter_rule_lines(itertools.chain(head, line_iter))
+            
+            if not format_type:
+                result = {"rules": [], "version": 2}
+            elif behavior:
+                result = self.convert_by_behavior(rules, behavior)
+            else:
+                result = self.convert_with_auto_behavior(rules, format_type)
+        
+        # 输入为 StreamLineReader 时记录实际读取的字节数
+        bytes_read = getattr(lines, 'bytes_read', None)
+        if bytes_read is not None:
+            self.rule_stats['file_size'] = bytes_read
+        self.rule_stats['processing_time'] = time.time() - start_time
+        return result
+    
+    def convert_file(self, path: str, behavior: str = None, jobs: int = 1,
+                     chunk_size: Optional[int] = None) -> Dict[str, Any]:
+        """转换文件，jobs大于1时把文件按行切分为多块，在子进程中并行转换后合并
+        
+        各分块按字段得到的集合合并后再统一去重、排序和优化，结果与单进程转换一致；
+        只有文本格式和扁平的 payload 列表可以分块，其他输入回退到单进程转换
+        """
+        start_time = time.time()
+        
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if jobs > 1 and size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    plan = self._plan_chunks(data, behavior, jobs, chunk_size)
+            else:
+                plan = None
+        
+        if plan is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            return self.convert(content, behavior)
+        
+        format_type, chunk_behavior, yaml_payload, chunks = plan
+        with ProcessPoolExecutor(min(jobs, len(chunks))) as executor:
+            partials = list(executor.map(_convert_chunk, itertools.repeat(path), *zip(*chunks),
+                                         itertools.repeat(chunk_behavior), itertools.repeat(yaml_payload),
+                                         itertools.repeat(self.aggregate_cidrs)))
+        
+        # 后面的分块中出现嵌套结构等无法逐行解析的内容
+        if any(partial is None for partial in partials):
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            return self.convert(content, behavior)
+        
+        # 与 merge_rules 相同的去重语义：同一字段的取值合并为一个集合，直接复用第一块的集合
+        fields = defaultdict(set, partials[0][0])
+        for partial_fields, _, _ in partials[1:]:
+            for key, values in partial_fields.items():
+                fields[key].update(values)
+        total = sum(partial[1] for partial in partials)
+        converted = sum(partial[2] for partial in partials)
+        
+        self.rule_stats = {
+            'total_rules': total,
+            'converted_rules': converted,
+            'skipped_rules': total - converted,
+            'unsupported_rules': 0,
+            'eliminated_rules': 0,
+            'processing_time': 0.0,
+            'file_size': size,
+            'rule_provider_format': format_type
+        }
+        result = {
+            "rules": self.build_rules(fields),
+            "version": 2
+        }
+        self.rule_stats['processing_time'] = time.time() - start_time
+        return result
+    
+    def _plan_chunks(self, data: mmap.mmap, behavior: Optional[str], jobs: int, chunk_size: Optional[int]):
+        """根据文件开头检测格式和behavior并切分文件，无法分块转换时返回None"""
+        head_end = data.rfind(b'\n', 0, PARALLEL_HEAD_BYTES) + 1
+        if head_end == 0:
+            return None
+        try:
+            head = data[:head_end].decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+        
+        format_type, head_rules = self._detect_format(head)
+        if not format_type:
+            return None
+        
+        start = 0
+        yaml_payload = format_type == 'yaml'
+        if yaml_payload:
+            if head_rules is None:
+                # 带 payload 键的文档，从 payload 键的下一行开始分块
+                payload_start = find_payload_start(head)
+                if payload_start is None:
+                    return None
+                start = len(head[:payload_start].encode('utf-8'))
+                head_rules = parse_flat_payload('payload:\n' + head[payload_start:])
+            if not head_rules:
+                return None
+            behavior = behavior or self.detect_payload_behavior(head_rules[:10])
+        else:
+            behavior = behavior or FORMAT_BEHAVIORS[format_type]
+        
+        if chunk_size is None:
+            chunk_size = max((len(data) - start) // (jobs * PARALLEL_CHUNKS_PER_JOB) + 1, PARALLEL_MIN_CHUNK_BYTES)
+        chunks = split_line_chunks(data, start, chunk_size)
+        if len(chunks) < 2:
+            return None
+        return format_type, behavior, yaml_payload, chunks
+    
+    def iter_rule_lines(self, lines: Iterable[str]) -> Iterator[str]:
+        """逐行过滤空行和注释，与 parse_rule_provider_text 规则一致"""
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    
     def get_conversion_stats(self) -> Dict[str, Any]:
         """获取转换统计信息"""
         return self.rule_stats.copy()
@@ -487,10 +1162,60 @@ class RuleConverter:
         print(f"  成功转换: {stats['converted_rules']:,}")
         print(f"  跳过规则: {stats['skipped_rules']:,}")
         print(f"  不支持规则: {stats['unsupported_rules']:,}")
+        if self.optimize_domains or self.aggregate_cidrs:
+            print(f"  去重消除: {stats['eliminated_rules']:,}")
         print(f"  转换成功率: {stats['converted_rules']/max(stats['total_rules'], 1)*100:.2f}%")
         print("="*50)
 
 
+def split_line_chunks(data: Union[bytes, mmap.mmap], start: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """从start开始按约chunk_size字节把数据切分为若干块，切分点总在换行符之后"""
+    chunks = []
+    end = len(data)
+    while start < end:
+        stop = data.find(b'\n', min(start + chunk_size, end) - 1)
+        stop = end if stop == -1 else stop + 1
+        chunks.append((start, stop))
+        start = stop
+    return chunks
+
+
+def find_payload_start(head: str) -> Optional[int]:
+    """返回 payload 键所在行之后的字符偏移，payload 之前出现其他内容时返回None"""
+    offset = 0
+    for line in iter_head_lines(head):
+        next_offset = offset + len(line) + 1
+        stripped = line.strip()
+        if _PAYLOAD_KEY_PATTERN.match(line.rstrip('\r')):
+            return next_offset
+        if stripped and not stripped.startswith('#'):
+            return None
+        offset = next_offset
+    return None
+
+
+def _convert_chunk(path: str, start: int, stop: int, behavior: str, yaml_payload: bool,
+                   aggregate_cidrs: bool) -> Optional[Tuple[Dict[str, set], int, int]]:
+    """在子进程中转换文件的一个分块，返回按字段聚合的集合和行数统计；YAML分块不是扁平列表时返回None"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        content = data[start:stop].decode('utf-8')
+    
+    converter = RuleConverter(aggregate_cidrs=aggregate_cidrs)
+    if yaml_payload:
+        if not content.strip():
+            rules = []
+        else:
+            rules = parse_flat_payload('payload:\n' + content)
+            if rules is None:
+                return None
+    else:
+        rules = converter.iter_rule_lines(iter_head_lines(content))
+    
+    fields = defaultdict(set)
+    total, converted = converter.collect_by_behavior(rules, behavior, fields)
+    return dict(fields), total, converted
+
+
 def convert_clash_to_singbox(content: str, behavior: str = None) -> Dict[str, Any]:
     """便捷函数：转换Clash规则到Sing-box格式"""
     converter = RuleConverter()
@@ -511,6 +1236,13 @@ def validate_singbox_rules(rules: Dict[str, Any]) -> bool:
     return True
 
 
+def render_rules(result: Dict[str, Any], output_format: str = 'json', pretty: bool = False) -> bytes:
+    """把转换结果编码为输出文件内容，srs 格式无法编码时抛出 ValueError"""
+    if output_format == 'srs':
+        return write_rule_set(result)
+    return json.dumps(result, ensure_ascii=False, indent=2 if pretty else None).encode('utf-8')
+
+
 def main():
     """CLI主函数"""
     parser = argparse.ArgumentParser(
@@ -521,55 +1253,93 @@ def main():
   python rule_converter.py input.txt -o output.json
   python rule_converter.py rules.yaml -b domain -o domain_rules.json
   python rule_converter.py clash_rules.txt --behavior classical --benchmark
+  python rule_converter.py rules.yaml --format srs -o rules.srs
+  python rule_converter.py huge_rules.txt --jobs 0 -o output.json
+  python rule_converter.py manifest.yaml --batch --jobs 0
+  python rule_converter.py rules/ --batch -o out/ --format srs
+  python rule_converter.py config.yaml --clash-config -o route.json
+  python rule_converter.py config.yaml --clash-config --remote-base http://localhost:5000
         """
     )
     
-    parser.add_argument('input', help='输入文件路径')
-    parser.add_argument('-o', '--output', help='输出文件路径 (默认: 输出到控制台)')
+    parser.add_argument('input', help='输入文件路径，批量模式下为清单文件或目录，配置模式下为Clash配置文件')
+    parser.add_argument('-o', '--output', help='输出文件路径 (默认: 输出到控制台)，批量模式下为输出目录')
     parser.add_argument('-b', '--behavior', 
-                       choices=['domain', 'ipcidr', 'classical'],
+                       choices=BEHAVIORS,
                        help='Rule Provider行为类型 (domain/ipcidr/classical)')
     parser.add_argument('--benchmark', action='store_true',
                        help='显示性能基准数据')
     parser.add_argument('--pretty', action='store_true',
                        help='格式化JSON输出')
+    parser.add_argument('-f', '--format', choices=['json', 'srs'], default='json',
+                       help='输出格式: json 源格式规则集 / srs 二进制规则集 (默认: json)')
+    parser.add_argument('--optimize-domains', action='store_true',
+                       help='去掉被 domain_suffix 覆盖的 domain 和 domain_suffix')
+    parser.add_argument('--aggregate-cidrs', action='store_true',
+                       help='把相邻和重叠的IP网段合并为最少的网段')
+    parser.add_argument('-j', '--jobs', type=int,
+                       help='并行转换的进程数，0 表示使用全部CPU核心 (默认: 1)；配置模式下为同时下载的规则集数 (默认: 8)')
+    parser.add_argument('--batch', action='store_true',
+                       help='批量模式：按清单文件或目录在一个进程池中转换多个规则集')
+    parser.add_argument('--state', help='批量模式的状态文件，记录输入内容的哈希用于跳过未变化的输入')
+    parser.add_argument('--force', action='store_true',
+                       help='批量模式下忽略状态文件，重新转换全部输入')
+    parser.add_argument('--clash-config', action='store_true',
+                       help='配置模式：把完整的Clash配置转换为Sing-box路由配置，并发下载全部规则集')
+    parser.add_argument('--remote-base',
+                       help='配置模式下规则集输出为指向该转换服务地址的远程规则集，不下载规则集')
     
     args = parser.parse_args()
+    if args.jobs is None:
+        args.jobs = 8 if args.clash_config else 1
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    
+    if args.clash_config:
+        from clash_config import run_cli
+        return run_cli(args.input, args.output, jobs=jobs, remote_base=args.remote_base, pretty=args.pretty,
+                       optimize_domains=args.optimize_domains, aggregate_cidrs=args.aggregate_cidrs)
+    
+    if args.batch:
+        from batch import run_batch
+        return run_batch(args.input, args.output, jobs=jobs, state_path=args.state, force=args.force,
+                         behavior=args.behavior, output_format=args.format, pretty=args.pretty,
+                         optimize_domains=args.optimize_domains, aggregate_cidrs=args.aggregate_cidrs)
     
     # 检查输入文件
     if not os.path.exists(args.input):
         print(f"错误: 输入文件 '{args.input}' 不存在")
         return 1
     
-    # 读取输入文件
+    # 读取并转换规则，大文件可按行分块并行转换
+    converter = RuleConverter(optimize_domains=args.optimize_domains, aggregate_cidrs=args.aggregate_cidrs)
     try:
-        with open(args.input, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except Exception as e:
+        result = converter.convert_file(args.input, args.behavior, jobs)
+    except (OSError, UnicodeDecodeError) as e:
         print(f"错误: 无法读取输入文件: {e}")
         return 1
-    
-    # 转换规则
-    converter = RuleConverter()
-    try:
-        result = converter.convert(content, args.behavior)
     except Exception as e:
         print(f"错误: 转换失败: {e}")
         return 1
     
     # 输出结果
-    json_output = json.dumps(result, ensure_ascii=False, indent=2 if args.pretty else None)
+    try:
+        output = render_rules(result, args.format, args.pretty)
+    except ValueError as e:
+        print(f"错误: 无法生成二进制规则集: {e}")
+        return 1
     
     if args.output:
         try:
-            with open(args.output, 'w', encoding='utf-8') as f:
-                f.write(json_output)
+            with open(args.output, 'wb') as f:
+                f.write(output)
             print(f"转换完成，结果已保存到: {args.output}")
         except Exception as e:
             print(f"错误: 无法写入输出文件: {e}")
             return 1
+    elif args.format == 'srs':
+        sys.stdout.buffer.write(output)
     else:
-        print(json_output)
+        print(output.decode('utf-8'))
     
     # 显示基准数据
     if args.benchmark:
@@ -0,0 +1,351 @@
+"""
+多worker共享存储
+
+gunicorn 的每个worker是独立进程，进程内的全局变量互不可见。共享存储让同一主机上的所有worker
+共用一份统计数据、限流记录、转换结果缓存和后台任务租约：
+- memory: 进程内存储，单进程运行时使用，不需要任何文件
+- sqlite: 基于本地SQLite文件(WAL模式)，同一主机的所有worker读写同一个文件，无需外部服务
+
+sqlite 后端的计数器和统计状态更新先在进程内累积，每 FLUSH_INTERVAL 秒在一个事务中写入，
+请求路径上不再为每次计数单独执行写事务；其他worker看到的计数最多延迟 FLUSH_INTERVAL 秒。
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+# 清理所有来源过期限流记录的间隔(秒)，不再访问的IP的记录也会被删除
+RATE_PRUNE_INTERVAL = 60
+
+
+class MemoryStore:
+    """进程内存储，只在当前进程内共享"""
+
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {}
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._rate_events: Dict[str, list] = defaultdict(list)
+        self._next_prune = 0.0
+        self._leases: Dict[str, float] = {}
+
+    def get_state(self, key: str) -> Optional[Any]:
+        """读取状态对象"""
+        with self._lock:
+            return self._state.get(key)
+
+    def update_state(self, key: str, update: Callable[[Optional[Any]], Any]) -> Any:
+        """原子地读取、修改并写回状态对象，update 接收旧状态(不存在时为None)并返回新状态"""
+        with self._lock:
+            state = update(self._state.get(key))
+            self._state[key] = state
+            return state
+
+    def update_state_later(self, key: str, update: Callable[[Optional[Any]], Any]):
+        """不需要立即生效的状态更新，进程内存储直接写入"""
+        self.update_state(key, update)
+
+    def flush(self):
+        """写入缓冲的更新，进程内存储没有缓冲"""
+
+    def incr(self, name: str, amount: int = 1):
+        """累加计数器"""
+        with self._lock:
+            self._counters[name] += amount
+
+    def counters(self, prefix: str) -> Dict[str, int]:
+        """读取指定前缀的计数器，返回去掉前缀后的名称"""
+        with self._lock:
+            return {name[len(prefix):]: value for name, value in self._counters.items() if name.startswith(prefix)}
+
+    def rate_limit_hit(self, key: str, limit: int, window: float) -> bool:
+        """滑动窗口限流，窗口内未超过上限时记录本次请求并返回True"""
+        now = time.time()
+        with self._lock:
+            events = [timestamp for timestamp in self._rate_events[key] if now - timestamp < window]
+            allowed = len(events) < limit
+            if allowed:
+                events.append(now)
+            self._rate_events[key] = events
+            if now >= self._next_prune:
+                self._rate_events = defaultdict(list, {
+                    name: timestamps for name, timestamps in self._rate_events.items()
+                    if timestamps and now - timestamps[-1] < window
+                })
+                self._next_prune = now + RATE_PRUNE_INTERVAL
+            return allowed
+
+    def acquire_lease(self, name: str, ttl: float) -> bool:
+        """获取租约，其他持有者的租约未过期时返回False"""
+        now = time.time()
+        with self._lock:
+            if self._leases.get(name, 0) > now:
+                return False
+            self._leases[name] = now + ttl
+            return True
+
+    def release_lease(self, name: str):
+        """释放租约"""
+        with self._lock:
+            self._leases.pop(name, None)
+
+
+class SQLiteStore:
+    """基于本地SQLite文件的共享存储，同一主机的多个进程共用"""
+
+    shared = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS rate_events (key TEXT NOT NULL, ts REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS rate_events_key ON rate_events (key, ts);
+        CREATE INDEX IF NOT EXISTS rate_events_ts ON rate_events (ts);
+        CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, expires_at REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS artifacts (
+            namespace TEXT NOT NULL, key TEXT NOT NULL, meta TEXT NOT NULL,
+            size INTEGER NOT NULL, accessed_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        );
+        CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (namespace, accessed_at);
+        CREATE TABLE IF NOT EXISTS artifact_blobs (
+            namespace TEXT NOT NULL, key TEXT NOT NULL, encoding TEXT NOT NULL, data BLOB NOT NULL,
+            PRIMARY KEY (namespace, key, encoding)
+        );
+    """
+
+    # 读取时更新访问时间的最小间隔(秒)，避免每次命中都写数据库
+    ACCESS_UPDATE_INTERVAL = 60
+
+    # 缓冲的计数器和状态更新写入数据库的最长间隔(秒)
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, path: str, timeout: float = 10):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        # executescript 会自行提交，不放在事务中
+        self._connection().executescript(self.SCHEMA)
+
+        # 当前进程尚未写入的计数器增量和状态更新
+        self._pending_lock = threading.Lock()
+        self._pending_counters: Dict[str, int] = defaultdict(int)
+        self._pending_updates: Dict[str, list] = defaultdict(list)
+        self._pending_pid = os.getpid()
+        self._flush_timer: Optional[threading.Timer] = None
+        self._next_prune = 0.0
+        atexit.register(self.flush)
+
+    def _connection(self) -> sqlite3.Connection:
+        """每个线程使用独立连接，fork后的子进程重新建立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    def _own_pending(self) -> bool:
+        """持有 _pending_lock 时调用；fork后的子进程丢弃父进程的缓冲(由父进程写入)，返回缓冲是否属于当前进程"""
+        if self._pending_pid == os.getpid():
+            return True
+        self._pending_pid = os.getpid()
+        self._pending_counters = defaultdict(int)
+        self._pending_updates = defaultdict(list)
+        self._flush_timer = None
+        return False
+
+    def _schedule_flush(self):
+        """持有 _pending_lock 时调用，没有等待中的写入时启动定时器"""
+        self._own_pending()
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.FLUSH_INTERVAL, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """把缓冲的计数器增量和状态更新在一个写事务中写入"""
+        with self._pending_lock:
+            if not self._own_pending():
+                return
+            counters, self._pending_counters = self._pending_counters, defaultdict(int)
+            updates, self._pending_updates = self._pending_updates, defaultdict(list)
+            timer, self._flush_timer = self._flush_timer, None
+        if timer is not None:
+            timer.cancel()
+        if not counters and not updates:
+            return
+        with self._transaction() as conn:
+            conn.executemany('INSERT INTO counters (name, value) VALUES (?, ?) '
+                             'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value', counters.items())
+            for key, pending in updates.items():
+                row = conn.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+                state = json.loads(row[0]) if row else None
+                for update in pending:
+                    state = update(state)
+                conn.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, json.dumps(state)))
+
+    def get_state(self, key: str) -> Optional[Any]:
+        self.flush()
+        row = self._connection().execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update_state(self, key: str, update: Callable[[Optional[Any]], Any]) -> Any:
+        self.flush()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+            state = update(json.loads(row[0]) if row else None)
+            conn.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, json.dumps(state)))
+            return state
+
+    def update_state_later(self, key: str, update: Callable[[Optional[Any]], Any]):
+        """放入缓冲，与其他缓冲的更新一起写入；update 按调用顺序依次应用"""
+        with self._pending_lock:
+            self._schedule_flush()
+            self._pending_updates[key].append(update)
+
+    def incr(self, name: str, amount: int = 1):
+        with self._pending_lock:
+            self._schedule_flush()
+            self._pending_counters[name] += amount
+
+    def counters(self, prefix: str) -> Dict[str, int]:
+        self.flush()
+        rows = self._connection().execute(
+            'SELECT name, value FROM counters WHERE substr(name, 1, ?) = ?', (len(prefix), prefix)
+        ).fetchall()
+        return {name[len(prefix):]: value for name, value in rows}
+
+    def rate_limit_hit(self, key: str, limit: int, window: float) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            if now >= self._next_prune:
+                # 定期删除所有IP的过期记录，不再访问的IP不会一直留在表中
+                conn.execute('DELETE FROM rate_events WHERE ts <= ?', (now - window,))
+                self._next_prune = now + RATE_PRUNE_INTERVAL
+            else:
+                conn.execute('DELETE FROM rate_events WHERE key = ? AND ts <= ?', (key, now - window))
+            count = conn.execute('SELECT COUNT(*) FROM rate_events WHERE key = ?', (key,)).fetchone()[0]
+            if count >= limit:
+                return False
+            conn.execute('INSERT INTO rate_events (key, ts) VALUES (?, ?)', (key, now))
+            return True
+
+    def acquire_lease(self, name: str, ttl: float) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT expires_at FROM leases WHERE name = ?', (name,)).fetchone()
+            if row and row[0] > now:
+                return False
+            conn.execute('INSERT OR REPLACE INTO leases (name, expires_at) VALUES (?, ?)', (name, now + ttl))
+            return True
+
+    def release_lease(self, name: str):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM leases WHERE name = ?', (name,))
+
+    def get_artifact_meta(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        """读取转换结果的元数据(ETag、有效期等)，不读取内容"""
+        row = self._connection().execute(
+            'SELECT meta, accessed_at FROM artifacts WHERE namespace = ? AND key = ?', (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > self.ACCESS_UPDATE_INTERVAL:
+            with self._transaction() as conn:
+                conn.execute('UPDATE artifacts SET accessed_at = ? WHERE namespace = ? AND key = ?',
+                             (now, namespace, key))
+        return json.loads(row[0])
+
+    def load_artifact(self, namespace: str, key: str) -> Optional[Tuple[Dict[str, Any], Dict[str, bytes]]]:
+        """读取转换结果的元数据和全部内容，内容以编码为键，原始内容的编码为空字符串"""
+        conn = self._connection()
+        conn.execute('BEGIN')
+        try:
+            row = conn.execute('SELECT meta FROM artifacts WHERE namespace = ? AND key = ?',
+                               (namespace, key)).fetchone()
+            if row is None:
+                return None
+            blobs = dict(conn.execute('SELECT encoding, data FROM artifact_blobs WHERE namespace = ? AND key = ?',
+                                      (namespace, key)).fetchall())
+        finally:
+            conn.execute('COMMIT')
+        if '' not in blobs:
+            return None
+        return json.loads(row[0]), blobs
+
+    def put_artifact(self, namespace: str, key: str, meta: Dict[str, Any], blobs: Dict[str, bytes],
+                     size: int, max_bytes: int) -> int:
+        """写入转换结果，超过字节上限时按访问时间淘汰最久未使用的条目，返回淘汰数量"""
+        now = time.time()
+        evicted = 0
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM artifact_blobs WHERE namespace = ? AND key = ?', (namespace, key))
+            conn.execute('INSERT OR REPLACE INTO artifacts (namespace, key, meta, size, accessed_at) '
+                         'VALUES (?, ?, ?, ?, ?)', (namespace, key, json.dumps(meta), size, now))
+            conn.executemany('INSERT INTO artifact_blobs (namespace, key, encoding, data) VALUES (?, ?, ?, ?)',
+                             [(namespace, key, encoding, data) for encoding, data in blobs.items()])
+
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM artifacts WHERE namespace = ?',
+                                 (namespace,)).fetchone()[0]
+            while total > max_bytes:
+                row = conn.execute('SELECT key, size FROM artifacts WHERE namespace = ? '
+                                   'ORDER BY accessed_at LIMIT 1', (namespace,)).fetchone()
+                if row is None:
+                    break
+                conn.execute('DELETE FROM artifacts WHERE namespace = ? AND key = ?', (namespace, row[0]))
+                conn.execute('DELETE FROM artifact_blobs WHERE namespace = ? AND key = ?', (namespace, row[0]))
+                total -= row[1]
+                evicted += 1
+        return evicted
+
+    def update_artifact_meta(self, namespace: str, key: str, meta: Dict[str, Any]):
+        """只更新元数据，例如上游返回304后重置有效期"""
+        with self._transaction() as conn:
+            conn.execute('UPDATE artifacts SET meta = ?, accessed_at = ? WHERE namespace = ? AND key = ?',
+                         (json.dumps(meta), time.time(), namespace, key))
+
+    def artifact_usage(self, namespace: str) -> Tuple[int, int]:
+        """返回 (条目数, 总字节数)"""
+        return self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts WHERE namespace = ?', (namespace,)
+        ).fetchone()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE 写事务，进入时即取得写锁，避免读后写升级时的死锁"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+def create_store(backend: str, path: Optional[str] = None) -> Union[MemoryStore, SQLiteStore]:
+    """按名称创建存储后端"""
+    if backend == 'memory':
+        return MemoryStore()
+    if backend == 'sqlite':
+        if not path:
+            raise ValueError('SQLite store requires a path')
+        return SQLiteStore(path)
+    raise ValueError(f'Unknown store backend: {backend}')
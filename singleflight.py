@@ -0,0 +1,116 @@
+"""
+并发请求合并 (single-flight)
+
+同一个键同时只执行一次耗时操作，其余并发请求等待并共享第一个请求的结果或异常
+"""
+
+import asyncio
+import threading
+from typing import Any, Callable, Dict
+
+
+class _Call:
+    """进行中的一次调用"""
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按键合并并发调用"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'executions': 0,  # 实际执行次数
+            'coalesced': 0,  # 等待并复用其他请求结果的次数
+            'max_waiters': 0  # 单次调用上同时等待的最大请求数
+        }
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """执行fn，若同键调用正在进行则等待其结果"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.stats['coalesced'] += 1
+                if call.waiters > self.stats['max_waiters']:
+                    self.stats['max_waiters'] = call.waiters
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.stats['executions'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取合并统计信息"""
+        with self._lock:
+            stats = self.stats.copy()
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+
+class AsyncSingleFlight:
+    """asyncio 版本，在同一个事件循环内按键合并并发调用"""
+
+    def __init__(self):
+        # 键 -> [执行中的任务, 等待数]
+        self._calls: Dict[str, list] = {}
+
+        self.stats = {
+            'executions': 0,
+            'coalesced': 0,
+            'max_waiters': 0
+        }
+
+    async def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """执行协程函数fn，若同键调用正在进行则等待其结果"""
+        call = self._calls.get(key)
+        if call is not None:
+            call[1] += 1
+            self.stats['coalesced'] += 1
+            self.stats['max_waiters'] = max(self.stats['max_waiters'], call[1])
+        else:
+            # 在独立任务中执行，发起请求的客户端断开时不影响其他等待者
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            call = self._calls[key] = [task, 0]
+            self.stats['executions'] += 1
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(call[0])
+
+    def _finish(self, key: str, task: asyncio.Future):
+        self._calls.pop(key, None)
+        # 所有等待者都已取消时取走异常，避免未处理异常的警告
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取合并统计信息"""
+        stats = self.stats.copy()
+        stats['in_flight'] = len(self._calls)
+        return stats
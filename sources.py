@@ -0,0 +1,37 @@
+"""
+上游规则来源
+
+/merge 请求和预热清单使用相同的格式指定上游规则来源：
+- URL 字符串，可以用 behavior, 前缀指定行为，如 domain,https://example.com/list.txt
+- 对象 {"url": "https://...", "behavior": "domain"}
+"""
+
+from typing import Any, Optional, Tuple
+from urllib.parse import urlparse
+
+# Rule Provider 的行为类型
+BEHAVIORS = ('domain', 'ipcidr', 'classical')
+
+
+class SourceError(ValueError):
+    """来源格式无效"""
+
+
+def parse_source(item: Any) -> Tuple[str, Optional[str]]:
+    """解析一个来源，返回 (url, behavior)"""
+    if isinstance(item, dict):
+        url, behavior = item.get('url'), item.get('behavior')
+    else:
+        url, behavior = item, None
+        prefix, sep, rest = str(item).partition(',')
+        if sep and prefix in BEHAVIORS:
+            url, behavior = rest, prefix
+
+    if not isinstance(url, str):
+        raise SourceError('Invalid URL format')
+    parsed = urlparse(url)
+    if not parsed.scheme or not parsed.netloc:
+        raise SourceError(f'Invalid URL format: {url}')
+    if behavior is not None and behavior not in BEHAVIORS:
+        raise SourceError(f"Unsupported behavior. Supported behaviors: {', '.join(BEHAVIORS)}")
+    return url, behavior
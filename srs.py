@@ -0,0 +1,388 @@
+"""
+sing-box 二进制规则集 (.srs) 的编码与解码
+
+格式与 sing-box 的 common/srs/binary.go 一致：
+- 文件头为 "SRS" 与1字节版本号，其后为 zlib 压缩的规则数据
+- 规则数量为 uvarint，每条规则为默认规则(类型0)，由若干条目组成，以 0xFF 和反转标志结束
+- domain 与 domain_suffix 合并编码为字符倒序排列的简洁字典树(succinct set)
+- ip_cidr 与 source_ip_cidr 编码为合并后的有序地址区间
+- 字符串列表与端口列表均以 uvarint 长度开头
+
+生成版本1的规则集，sing-box 1.8 及以上版本均可读取。
+"""
+
+import ipaddress
+import struct
+import zlib
+from typing import Any, Dict, Iterable, List, Tuple
+
+MAGIC = b'SRS'
+SRS_VERSION = 1
+
+# 规则条目类型
+ITEM_DOMAIN = 2
+ITEM_DOMAIN_KEYWORD = 3
+ITEM_DOMAIN_REGEX = 4
+ITEM_SOURCE_IP_CIDR = 5
+ITEM_IP_CIDR = 6
+ITEM_SOURCE_PORT = 7
+ITEM_SOURCE_PORT_RANGE = 8
+ITEM_PORT = 9
+ITEM_PORT_RANGE = 10
+ITEM_PROCESS_NAME = 11
+ITEM_PROCESS_PATH = 12
+ITEM_FINAL = 0xFF
+
+# 字符串列表类型的字段，按 sing-box 写入顺序排列
+STRING_ITEMS = {
+    ITEM_DOMAIN_KEYWORD: 'domain_keyword',
+    ITEM_DOMAIN_REGEX: 'domain_regex',
+    ITEM_SOURCE_PORT_RANGE: 'source_port_range',
+    ITEM_PORT_RANGE: 'port_range',
+    ITEM_PROCESS_NAME: 'process_name',
+    ITEM_PROCESS_PATH: 'process_path'
+}
+PORT_ITEMS = {
+    ITEM_SOURCE_PORT: 'source_port',
+    ITEM_PORT: 'port'
+}
+CIDR_ITEMS = {
+    ITEM_SOURCE_IP_CIDR: 'source_ip_cidr',
+    ITEM_IP_CIDR: 'ip_cidr'
+}
+
+# 域名字典树中表示"匹配所有子域名"和"匹配自身及所有子域名(版本2)"的标签
+PREFIX_LABEL = '\r'
+ROOT_LABEL = '\n'
+
+
+class SRSError(ValueError):
+    """二进制规则集格式错误"""
+    pass
+
+
+def _uvarint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _write_strings(out: bytearray, values: Iterable[str]):
+    values = list(values)
+    out += _uvarint(len(values))
+    for value in values:
+        data = value.encode('utf-8')
+        out += _uvarint(len(data))
+        out += data
+
+
+def _write_words(out: bytearray, words: List[int]):
+    out += _uvarint(len(words))
+    out += struct.pack(f'>{len(words)}Q', *words)
+
+
+def _bits_to_words(ones: Iterable[int], size: int) -> List[int]:
+    """把置位的下标转换为 []uint64 位图，size 为位图需要覆盖的位数"""
+    words = [0] * ((size + 63) >> 6)
+    for index in ones:
+        words[index >> 6] |= 1 << (index & 63)
+    return words
+
+
+def _reverse_domain(domain: str) -> bytes:
+    return domain[::-1].encode('utf-8')
+
+
+def domain_matcher_keys(domains: Iterable[str], suffixes: Iterable[str]) -> List[bytes]:
+    """按 sing-box 版本1的规则生成字典树的键：完整域名倒序，后缀额外生成以 PREFIX_LABEL 结尾的子域名键"""
+    keys = []
+    seen = set()
+    for suffix in suffixes:
+        # 空后缀在 sing-box 中无法编译
+        if not suffix or suffix in seen:
+            continue
+        seen.add(suffix)
+        if suffix.startswith('.'):
+            keys.append(_reverse_domain(PREFIX_LABEL + suffix))
+        else:
+            keys.append(_reverse_domain(suffix))
+            dotted = '.' + suffix
+            if dotted not in seen:
+                seen.add(dotted)
+                keys.append(_reverse_domain(PREFIX_LABEL + dotted))
+    for domain in domains:
+        if not domain or domain in seen:
+            continue
+        seen.add(domain)
+        keys.append(_reverse_domain(domain))
+    keys.sort()
+    return keys
+
+
+def build_succinct_set(keys: List[bytes]) -> Tuple[List[int], List[int], bytes]:
+    """把有序且不重复的键编码为按层序排列的简洁字典树，返回 (leaves, labelBitmap, labels)"""
+    leaf_bits = []
+    label_ones = []
+    labels = bytearray()
+    label_index = 0
+
+    # 队列元素为 (起始键, 结束键, 列)，下标即节点编号；遍历的同时向队尾追加子节点
+    queue = [(0, len(keys), 0)]
+    add_node = queue.append
+    add_label = labels.append
+    for node, (start, end, column) in enumerate(queue):
+        if column == len(keys[start]):
+            # 有键在此结束，较短的键排在前面
+            start += 1
+            leaf_bits.append(node)
+
+        if end - start == 1:
+            # 只剩一个键时只有一个子节点，大部分节点属于这种情况
+            add_node((start, end, column + 1))
+            add_label(keys[start][column])
+            label_index += 1
+        else:
+            j = start
+            while j < end:
+                first = j
+                label = keys[first][column]
+                while j < end and keys[j][column] == label:
+                    j += 1
+                add_node((first, j, column + 1))
+                add_label(label)
+                label_index += 1
+        label_ones.append(label_index)
+        label_index += 1
+
+    leaves = _bits_to_words(leaf_bits, leaf_bits[-1] + 1 if leaf_bits else 0)
+    label_bitmap = _bits_to_words(label_ones, label_index)
+    return leaves, label_bitmap, bytes(labels)
+
+
+def _ip_ranges(values: Iterable[str]) -> List[Tuple[int, int, int]]:
+    """把网段转换为合并后的有序地址区间 (版本, 起始地址, 结束地址)，IPv4在前"""
+    intervals = []
+    for value in values:
+        try:
+            network = ipaddress.ip_network(value, strict=False)
+        except ValueError as e:
+            raise SRSError(f'Invalid IP CIDR: {value}') from e
+        first = int(network.network_address)
+        intervals.append((network.version, first, first | ((1 << (network.max_prefixlen - network.prefixlen)) - 1)))
+    intervals.sort()
+
+    merged = []
+    for version, first, last in intervals:
+        if merged and merged[-1][0] == version and first <= merged[-1][2] + 1:
+            if last > merged[-1][2]:
+                merged[-1][2] = last
+        else:
+            merged.append([version, first, last])
+    return [tuple(interval) for interval in merged]
+
+
+def _write_rule(out: bytearray, rule: Dict[str, Any]) -> bool:
+    """写入一条默认规则，规则中没有可编码的条目时不写入并返回False"""
+    items = bytearray()
+
+    domains = rule.get('domain') or []
+    suffixes = rule.get('domain_suffix') or []
+    keys = domain_matcher_keys(domains, suffixes)
+    if keys:
+        leaves, label_bitmap, labels = build_succinct_set(keys)
+        items.append(ITEM_DOMAIN)
+        items.append(1)
+        _write_words(items, leaves)
+        _write_words(items, label_bitmap)
+        items += _uvarint(len(labels))
+        items += labels
+
+    for item_type in (ITEM_DOMAIN_KEYWORD, ITEM_DOMAIN_REGEX):
+        values = rule.get(STRING_ITEMS[item_type])
+        if values:
+            items.append(item_type)
+            _write_strings(items, values)
+
+    for item_type in (ITEM_SOURCE_IP_CIDR, ITEM_IP_CIDR):
+        values = rule.get(CIDR_ITEMS[item_type])
+        if values:
+            ranges = _ip_ranges(values)
+            items.append(item_type)
+            items.append(1)
+            items += struct.pack('>Q', len(ranges))
+            for version, first, last in ranges:
+                size = 4 if version == 4 else 16
+                for address in (first, last):
+                    items += _uvarint(size)
+                    items += address.to_bytes(size, 'big')
+
+    for item_type in (ITEM_SOURCE_PORT, ITEM_SOURCE_PORT_RANGE, ITEM_PORT, ITEM_PORT_RANGE,
+                      ITEM_PROCESS_NAME, ITEM_PROCESS_PATH):
+        if item_type in PORT_ITEMS:
+            values = rule.get(PORT_ITEMS[item_type])
+            if values:
+                items.append(item_type)
+                items += _uvarint(len(values))
+                items += struct.pack(f'>{len(values)}H', *(int(value) for value in values))
+        else:
+            values = rule.get(STRING_ITEMS[item_type])
+            if values:
+                items.append(item_type)
+                _write_strings(items, values)
+
+    # geoip、geosite 等字段不属于 headless 规则，无法编码
+    if not items:
+        return False
+
+    out.append(0)
+    out += items
+    out.append(ITEM_FINAL)
+    out.append(1 if rule.get('invert') else 0)
+    return True
+
+
+def write_rule_set(rule_set: Dict[str, Any]) -> bytes:
+    """把源格式规则集 {"rules": [...], "version": 2} 编码为 .srs 二进制内容"""
+    rules = bytearray()
+    count = 0
+    for rule in rule_set.get('rules', []):
+        if _write_rule(rules, rule):
+            count += 1
+
+    payload = _uvarint(count) + bytes(rules)
+    return MAGIC + bytes([SRS_VERSION]) + zlib.compress(payload, 9)
+
+
+class _Reader:
+    """按 sing-box 二进制格式顺序读取"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def read(self, size: int) -> bytes:
+        if self.pos + size > len(self.data):
+            raise SRSError('Unexpected end of rule-set')
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return chunk
+
+    def byte(self) -> int:
+        return self.read(1)[0]
+
+    def uvarint(self) -> int:
+        value = shift = 0
+        while True:
+            byte = self.byte()
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def strings(self) -> List[str]:
+        return [self.read(self.uvarint()).decode('utf-8') for _ in range(self.uvarint())]
+
+    def words(self) -> List[int]:
+        count = self.uvarint()
+        return list(struct.unpack(f'>{count}Q', self.read(count * 8)))
+
+
+def succinct_set_keys(leaves: List[int], label_bitmap: List[int], labels: bytes) -> List[bytes]:
+    """按层序还原简洁字典树中的全部键"""
+    def bit(words: List[int], index: int) -> bool:
+        return (index >> 6) < len(words) and bool(words[index >> 6] >> (index & 63) & 1)
+
+    prefixes = [b'']
+    node = label_index = 0
+    for index in range(len(label_bitmap) * 64):
+        if node >= len(prefixes):
+            break
+        if bit(label_bitmap, index):
+            node += 1
+        else:
+            prefixes.append(prefixes[node] + labels[label_index:label_index + 1])
+            label_index += 1
+    return [prefix for node, prefix in enumerate(prefixes) if bit(leaves, node)]
+
+
+def dump_domain_matcher(keys: List[bytes]) -> Tuple[List[str], List[str]]:
+    """与 sing-box Matcher.Dump 一致，把字典树的键还原为 (domain, domain_suffix)"""
+    domains = {}
+    prefixes = {}
+    suffixes = []
+    for key in keys:
+        name = key.decode('utf-8')[::-1]
+        if name.startswith(PREFIX_LABEL):
+            prefixes[name[1:]] = True
+        elif name.startswith(ROOT_LABEL):
+            suffixes.append(name[1:])
+        else:
+            domains[name] = True
+
+    for prefix in prefixes:
+        if prefix.startswith('.') and prefix[1:] in domains:
+            del domains[prefix[1:]]
+            suffixes.append(prefix[1:])
+        else:
+            suffixes.append(prefix)
+    return list(domains), suffixes
+
+
+def read_rule_set(data: bytes) -> Dict[str, Any]:
+    """解码 .srs 二进制内容为源格式规则集，IP网段以合并后的区间还原"""
+    if data[:3] != MAGIC:
+        raise SRSError('Invalid rule-set magic')
+    version = data[3] if len(data) > 3 else None
+    if version not in (1, 2):
+        raise SRSError(f'Unsupported rule-set version: {version}')
+
+    try:
+        reader = _Reader(zlib.decompress(data[4:]))
+    except zlib.error as e:
+        raise SRSError('Invalid rule-set compression') from e
+
+    rules = []
+    for _ in range(reader.uvarint()):
+        if reader.byte() != 0:
+            raise SRSError('Logical rules are not supported')
+
+        rule = {}
+        while True:
+            item_type = reader.byte()
+            if item_type == ITEM_FINAL:
+                if reader.byte():
+                    rule['invert'] = True
+                break
+            elif item_type == ITEM_DOMAIN:
+                if reader.byte() != 1:
+                    raise SRSError('Unsupported domain matcher version')
+                leaves = reader.words()
+                label_bitmap = reader.words()
+                labels = reader.read(reader.uvarint())
+                domains, suffixes = dump_domain_matcher(succinct_set_keys(leaves, label_bitmap, labels))
+                if domains:
+                    rule['domain'] = domains
+                if suffixes:
+                    rule['domain_suffix'] = suffixes
+            elif item_type in CIDR_ITEMS:
+                if reader.byte() != 1:
+                    raise SRSError('Unsupported IP set version')
+                networks = []
+                for _ in range(struct.unpack('>Q', reader.read(8))[0]):
+                    first = ipaddress.ip_address(reader.read(reader.uvarint()))
+                    last = ipaddress.ip_address(reader.read(reader.uvarint()))
+                    networks.extend(str(network) for network in ipaddress.summarize_address_range(first, last))
+                rule[CIDR_ITEMS[item_type]] = networks
+            elif item_type in PORT_ITEMS:
+                count = reader.uvarint()
+                rule[PORT_ITEMS[item_type]] = list(struct.unpack(f'>{count}H', reader.read(count * 2)))
+            elif item_type in STRING_ITEMS:
+                rule[STRING_ITEMS[item_type]] = reader.strings()
+            else:
+                raise SRSError(f'Unsupported rule item type: {item_type}')
+        rules.append(rule)
+
+    return {"rules": rules, "version": version}
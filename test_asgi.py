@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+异步服务模式测试，使用本地上游桩服务，无需启动转换服务
+
+python -m pytest -q test_asgi.py
+"""
+
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+import app as core
+import asgi
+from shared_store import SQLiteStore
+
+RULES = '\n'.join(['DOMAIN-SUFFIX,example.com', 'DOMAIN,www.example.org', 'IP-CIDR,10.0.0.0/8,no-resolve'] +
+                  [f'DOMAIN,host{i}.example.net' for i in range(200)])
+UPSTREAM_DELAY = 0.5
+# 未声明 charset 的 text/plain，含非ASCII字符
+UNDECLARED = 'DOMAIN,café.example.com\nexample.org'
+
+
+def upstream_response(path):
+    if path.startswith('/slow/'):
+        time.sleep(UPSTREAM_DELAY)
+    if path.startswith('/undeclared/'):
+        return UNDECLARED, 'text/plain'
+    return RULES
+
+
+def run(requests_fn):
+    """在新的事件循环中通过ASGI接口发起请求"""
+    async def main():
+        transport = httpx.ASGITransport(app=asgi.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                return await requests_fn(client)
+        finally:
+            await asgi.shutdown()
+    return asyncio.run(main())
+
+
+def test_rules_match_sync_mode(upstream):
+    """异步模式的输出和ETag与同步模式一致，重新验证时返回304"""
+    url = f"/rules/{upstream}/same.txt"
+    expected = core.app.test_client().get(url, headers={'Accept-Encoding': 'identity'})
+    core.rule_cache._entries.clear()
+
+    async def requests_fn(client):
+        first = await client.get(url, headers={'Accept-Encoding': 'identity'})
+        second = await client.get(url, headers={'Accept-Encoding': 'identity', 'If-None-Match': first.headers['ETag']})
+        srs = await client.get(url + '?format=srs')
+        return first, second, srs
+
+    first, second, srs = run(requests_fn)
+    assert first.status_code == 200
+    assert first.content == expected.data
+    assert first.headers['ETag'] == expected.headers['ETag']
+    assert second.status_code == 304
+    assert srs.status_code == 200 and srs.content[:3] == b'SRS'
+
+
+def test_undeclared_charset_matches_sync_mode(upstream):
+    """上游未声明 charset 时两种模式按相同的编码解码"""
+    url = f"/rules/{upstream}/undeclared/list.txt"
+    expected = core.app.test_client().get(url, headers={'Accept-Encoding': 'identity'})
+    core.rule_cache._entries.clear()
+
+    response = run(lambda client: client.get(url, headers={'Accept-Encoding': 'identity'}))
+    assert response.content == expected.data
+    assert response.headers['ETag'] == expected.headers['ETag']
+
+
+def test_shared_store_calls_run_off_the_event_loop(upstream, tmp_path, monkeypatch):
+    """sqlite 后端的限流、缓存查找和统计在线程中执行，等待写锁时不阻塞事件循环"""
+    monkeypatch.setattr(core, 'shared_store', SQLiteStore(str(tmp_path / 'store.db')))
+    threads = []
+
+    def recorded(fn):
+        def call(*args):
+            threads.append(threading.current_thread())
+            return fn(*args)
+        return call
+
+    monkeypatch.setattr(core, 'check_rate_limit', recorded(lambda ip: True))
+    monkeypatch.setattr(core, 'update_stats', recorded(core.update_stats))
+    monkeypatch.setattr(core.rule_cache, 'lookup', recorded(core.rule_cache.lookup))
+
+    response = run(lambda client: client.get(f"/rules/{upstream}/threads.txt"))
+    assert response.status_code == 200
+    assert len(threads) == 3 and threading.main_thread() not in threads
+
+
+def test_request_bodies_are_parsed_off_the_event_loop(monkeypatch):
+    """/convert 和 /config 的请求体解析在线程中执行"""
+    threads = []
+
+    def recorded(fn):
+        def call(*args):
+            threads.append(threading.current_thread())
+            return fn(*args)
+        return call
+
+    monkeypatch.setattr(core, 'convert_request', recorded(core.convert_request))
+    monkeypatch.setattr(core, 'config_request', recorded(core.config_request))
+
+    async def requests_fn(client):
+        return (await client.post('/convert', json={'content': 'DOMAIN,parsed.example.com'}),
+                await client.post('/config', json={'content': 'rules:\n  - MATCH,DIRECT'}))
+
+    converted, config = run(requests_fn)
+    assert converted.status_code == 200 and config.status_code == 200
+    assert len(threads) == 2 and threading.main_thread() not in threads
+
+
+def test_slow_upstreams_are_fetched_concurrently(upstream):
+    """慢速上游的下载互不阻塞，总耗时接近单次延迟而不是延迟之和"""
+    count = 16
+
+    async def requests_fn(client):
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[client.get(f"/rules/{upstream}/slow/{i}.txt") for i in range(count)])
+        return responses, time.perf_counter() - start
+
+    responses, elapsed = run(requests_fn)
+    assert all(response.status_code == 200 for response in responses)
+    assert elapsed < count * UPSTREAM_DELAY / 4
+
+
+def test_convert_and_fallback_routes():
+    async def requests_fn(client):
+        return (
+            await client.post('/convert', json={'content': 'DOMAIN,a.com\nIP-CIDR,1.1.1.0/24'}),
+            await client.post('/convert', json={}),
+            await client.get('/api/stats'),
+            await client.get('/rules/not-a-url'),
+            await client.get('/missing')
+        )
+
+    converted, missing_content, stats, invalid_url, not_found = run(requests_fn)
+    assert converted.json() == {'rules': [{'domain': ['a.com']}, {'ip_cidr': ['1.1.1.0/24']}], 'version': 2}
+    assert missing_content.status_code == 400
+    assert 'process_pool' in stats.json()
+    assert invalid_url.status_code == 400
+    assert not_found.status_code == 404
+
+
+def test_only_large_conversions_use_the_pool(upstream, monkeypatch):
+    """与同步模式相同，达到阈值的输入在进程池中转换，较小的在线程中转换"""
+    monkeypatch.setattr(core, 'CONVERT_OFFLOAD_MIN_BYTES', 1024)
+    core.rule_cache._entries.clear()
+    completed = asgi.pool.get_stats()['completed']
+
+    async def requests_fn(client):
+        small = await client.post('/convert', json={'content': 'DOMAIN,pool-threshold.example.com'})
+        after_small = asgi.pool.get_stats()['completed']
+        large = await client.get(f"/rules/{upstream}/large.txt")
+        return small, after_small, large
+
+    small, after_small, large = run(requests_fn)
+    assert small.status_code == 200 and large.status_code == 200
+    assert after_small == completed
+    assert asgi.pool.get_stats()['completed'] == completed + 1
+
+
+def test_request_too_large(monkeypatch):
+    monkeypatch.setattr(core, 'MAX_CONTENT_SIZE', 1024)
+
+    async def requests_fn(client):
+        return await client.post('/convert', json={'content': 'x' * 2048})
+
+    response = run(requests_fn)
+    assert response.status_code == 413
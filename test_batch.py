@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+批量转换测试，无需启动服务
+
+python -m pytest -q test_batch.py
+"""
+
+import json
+
+import yaml
+
+from batch import run_batch
+from srs import read_rule_set
+
+
+def write_inputs(root):
+    lists = root / 'lists'
+    (lists / 'sub').mkdir(parents=True)
+    (lists / 'ads.txt').write_text('ads.example.com\n.tracker.net\n', encoding='utf-8')
+    (lists / 'sub' / 'cn.yaml').write_text("payload:\n  - DOMAIN,x.com\n  - IP-CIDR,1.1.1.0/24\n", encoding='utf-8')
+    (lists / 'notes.md').write_text('not a rule file\n', encoding='utf-8')
+    return lists
+
+
+def statuses(output):
+    return [line.split()[0] for line in output.strip().split('\n')[1:-1]]
+
+
+def test_manifest_batch_skips_unchanged_inputs(tmp_path, capsys):
+    lists = write_inputs(tmp_path)
+    manifest = tmp_path / 'manifest.yaml'
+    manifest.write_text(yaml.safe_dump({
+        'output_dir': 'dist',
+        'rules': [
+            {'input': 'lists/ads.txt', 'output': 'ads.srs', 'format': 'srs', 'behavior': 'domain'},
+            'lists/sub/cn.yaml'
+        ]
+    }), encoding='utf-8')
+
+    assert run_batch(str(manifest), jobs=2) == 0
+    assert statuses(capsys.readouterr().out) == ['转换', '转换']
+    assert read_rule_set((tmp_path / 'dist' / 'ads.srs').read_bytes())['rules'] == [
+        {'domain': ['ads.example.com']}, {'domain_suffix': ['tracker.net']}]
+    assert json.loads((tmp_path / 'dist' / 'cn.json').read_text(encoding='utf-8'))['rules'] == [
+        {'domain': ['x.com']}, {'ip_cidr': ['1.1.1.0/24']}]
+
+    # 输入未变化时全部跳过
+    assert run_batch(str(manifest), jobs=2) == 0
+    assert statuses(capsys.readouterr().out) == ['跳过', '跳过']
+
+    # 只重新转换内容变化的输入，转换选项变化时全部重新转换
+    (lists / 'sub' / 'cn.yaml').write_text("payload:\n  - DOMAIN,y.com\n", encoding='utf-8')
+    assert run_batch(str(manifest)) == 0
+    assert statuses(capsys.readouterr().out) == ['跳过', '转换']
+    assert json.loads((tmp_path / 'dist' / 'cn.json').read_text(encoding='utf-8'))['rules'] == [{'domain': ['y.com']}]
+
+    assert run_batch(str(manifest), optimize_domains=True) == 0
+    assert statuses(capsys.readouterr().out) == ['转换', '转换']
+
+    # 删除的输出文件会重新生成
+    (tmp_path / 'dist' / 'ads.srs').unlink()
+    assert run_batch(str(manifest), optimize_domains=True) == 0
+    assert statuses(capsys.readouterr().out) == ['转换', '跳过']
+
+
+def test_directory_batch(tmp_path, capsys):
+    lists = write_inputs(tmp_path)
+    (lists / 'broken.txt').write_bytes(b'\xff\xfe\n')
+    output = lists / 'out'
+
+    assert run_batch(str(lists), str(output), output_format='srs') == 1
+    assert statuses(capsys.readouterr().out) == ['转换', '失败', '转换']
+    assert sorted(path.relative_to(output).as_posix() for path in output.rglob('*.srs')) == ['ads.srs', 'sub/cn.srs']
+
+    # 输出目录位于输入目录内，生成的文件不会被当作输入
+    (lists / 'broken.txt').unlink()
+    assert run_batch(str(lists), str(output), output_format='srs') == 0
+    assert statuses(capsys.readouterr().out) == ['跳过', '跳过']
+
+
+def test_invalid_manifest(tmp_path, capsys):
+    manifest = tmp_path / 'manifest.yaml'
+    manifest.write_text(yaml.safe_dump([{'input': 'a.txt', 'behavior': 'bogus'}]), encoding='utf-8')
+    assert run_batch(str(manifest)) == 1
+    assert 'behavior' in capsys.readouterr().out
+
+    manifest.write_text(yaml.safe_dump(['a.txt', 'sub/a.txt']), encoding='utf-8')
+    assert run_batch(str(manifest)) == 1
+    assert '同一输出文件' in capsys.readouterr().out
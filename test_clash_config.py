@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Clash配置转换测试，使用本地上游桩服务，无需启动转换服务
+
+python -m pytest -q test_clash_config.py
+"""
+
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+import pytest
+
+import app as core
+import asgi
+from clash_config import load_config, provider_sources, run_cli, translate_config
+
+UPSTREAM_DELAY = 0.3
+
+SOURCES = {
+    '/reject.txt': 'ads.example.com\n.tracker.net',
+    '/cncidr.yaml': "payload:\n  - '1.0.1.0/24'\n  - '1.0.2.0/23'",
+    '/streaming.list': 'DOMAIN-SUFFIX,netflix.com\nDOMAIN-KEYWORD,nflx',
+}
+
+CONFIG = """
+mixed-port: 7890
+rule-providers:
+  reject:
+    type: http
+    behavior: domain
+    url: "{upstream}/reject.txt"
+    interval: 86400
+  cncidr:
+    type: http
+    behavior: ipcidr
+    url: "{upstream}/cncidr.yaml"
+  streaming:
+    type: http
+    behavior: classical
+    url: "{upstream}/streaming.list"
+  local:
+    type: file
+    behavior: classical
+    path: ./local.yaml
+  custom:
+    type: inline
+    behavior: classical
+    payload:
+      - DOMAIN,inline.example.com
+      - DST-PORT,8443
+rules:
+  - RULE-SET,reject,REJECT
+  - RULE-SET,streaming,PROXY
+  - RULE-SET,custom,PROXY
+  - DOMAIN-SUFFIX,google.com,PROXY
+  - DOMAIN,www.google.com,PROXY
+  - DST-PORT,443,PROXY
+  - RULE-SET,local,DIRECT
+  - GEOIP,CN,DIRECT
+  - RULE-SET,cncidr,DIRECT,no-resolve
+  - IP-CIDR,10.0.0.0/8,DIRECT,no-resolve
+  - MATCH,PROXY
+  - DOMAIN,after.match,DIRECT
+"""
+
+
+def upstream_response(path):
+    time.sleep(UPSTREAM_DELAY)
+    return SOURCES.get(path)
+
+
+def test_translate_config_structure():
+    config = load_config(CONFIG.format(upstream='http://example.invalid'))
+    assert list(provider_sources(config)) == ['reject', 'streaming', 'cncidr']
+
+    provider_rules = {'reject': [{'domain': ['ads.example.com']}], 'streaming': [{'domain_suffix': ['netflix.com']}],
+                      'cncidr': [{'ip_cidr': ['1.0.1.0/24']}]}
+    result, warnings = translate_config(config, provider_rules)
+    route = result['route']
+
+    assert [rule_set['tag'] for rule_set in route['rule_set']] == ['reject', 'streaming', 'custom', 'cncidr']
+    assert route['rule_set'][2]['rules'] == [{'domain': ['inline.example.com']}, {'port': [8443]}]
+    # 连续同一策略的规则集合并为一条路由规则，普通规则按策略聚合，MATCH之后的规则被忽略
+    assert route['rules'] == [
+        {'rule_set': ['reject'], 'action': 'reject'},
+        {'rule_set': ['streaming', 'custom'], 'outbound': 'PROXY'},
+        {'domain': ['www.google.com'], 'outbound': 'PROXY'},
+        {'domain_suffix': ['google.com'], 'outbound': 'PROXY'},
+        {'port': [443], 'outbound': 'PROXY'},
+        {'geoip': ['CN'], 'outbound': 'direct'},
+        {'rule_set': ['cncidr'], 'outbound': 'direct'},
+        {'ip_cidr': ['10.0.0.0/8'], 'outbound': 'direct'},
+    ]
+    assert route['final'] == 'PROXY'
+    assert warnings == ['Unsupported rule provider: local']
+
+
+def test_config_endpoint_resolves_providers_concurrently(upstream, upstream_hits):
+    client = core.app.test_client()
+    start = time.perf_counter()
+    response = client.post('/config', json={'content': CONFIG.format(upstream=upstream)})
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200
+    assert elapsed < 3 * UPSTREAM_DELAY
+
+    data = response.get_json()
+    rule_sets = {rule_set['tag']: rule_set for rule_set in data['route']['rule_set']}
+    assert rule_sets['reject']['rules'] == [{'domain': ['ads.example.com']}, {'domain_suffix': ['tracker.net']}]
+    assert rule_sets['cncidr']['rules'] == [{'ip_cidr': ['1.0.1.0/24', '1.0.2.0/23']}]
+    assert rule_sets['streaming']['rules'] == [{'domain_keyword': ['nflx']}, {'domain_suffix': ['netflix.com']}]
+    assert 'Unsupported rule provider: local' in data['warnings']
+
+    # 已转换的规则集直接使用缓存，单独请求 /merge 时也复用配置转换时缓存的结果
+    assert client.post('/config', data=CONFIG.format(upstream=upstream)).get_json() == data
+    assert client.get(f'/merge?url=domain,{upstream}/reject.txt').status_code == 200
+    assert upstream_hits == {'/reject.txt': 1, '/cncidr.yaml': 1, '/streaming.list': 1}
+
+
+def test_remote_mode_points_at_merge(upstream, upstream_hits):
+    client = core.app.test_client()
+    response = client.post('/config', json={'content': CONFIG.format(upstream=upstream), 'rule_set': 'remote'})
+    assert response.status_code == 200
+
+    rule_sets = {rule_set['tag']: rule_set for rule_set in response.get_json()['route']['rule_set']}
+    reject = rule_sets['reject']
+    assert reject['type'] == 'remote' and reject['format'] == 'binary'
+    assert reject['update_interval'] == '86400s'
+    assert rule_sets['custom']['type'] == 'inline'
+
+    # 远程规则集地址可以直接从本服务下载，且命中配置转换时预热的缓存
+    parsed = urlparse(reject['url'])
+    assert parse_qs(parsed.query) == {'url': [f'domain,{upstream}/reject.txt'], 'format': ['srs']}
+    assert client.get(f'{parsed.path}?{parsed.query}').status_code == 200
+    assert upstream_hits['/reject.txt'] == 1
+
+
+def test_invalid_requests(upstream, monkeypatch):
+    client = core.app.test_client()
+    assert client.post('/config', json={}).status_code == 400
+    assert client.post('/config', data='rules: [').status_code == 400
+    assert client.post('/config', data='mixed-port: 7890').status_code == 400
+    assert client.post('/config', json={'content': 'rules: []', 'rule_set': 'bogus'}).status_code == 400
+
+    monkeypatch.setattr(core, 'CONFIG_MAX_PROVIDERS', 2)
+    assert client.post('/config', data=CONFIG.format(upstream=upstream)).status_code == 400
+
+    monkeypatch.setattr(core, 'CONFIG_MAX_PROVIDERS', 64)
+    missing = CONFIG.format(upstream=upstream).replace('/cncidr.yaml', '/missing.yaml')
+    response = client.post('/config', data=missing)
+    assert response.status_code == 500
+    assert 'missing.yaml' in response.get_json()['error']
+
+
+def test_asgi_config_matches_sync_mode(upstream):
+    content = CONFIG.format(upstream=upstream)
+    expected = core.app.test_client().post('/config', json={'content': content})
+    core.rule_cache._entries.clear()
+
+    async def main():
+        transport = httpx.ASGITransport(app=asgi.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                return await client.post('/config', json={'content': content})
+        finally:
+            await asgi.shutdown()
+
+    response = asyncio.run(main())
+    assert response.status_code == 200
+    assert response.json() == expected.get_json()
+
+
+def test_cli(upstream, upstream_hits, tmp_path, capsys):
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(CONFIG.format(upstream=upstream), encoding='utf-8')
+    output_path = tmp_path / 'route.json'
+
+    assert run_cli(str(config_path), str(output_path)) == 0
+    route = json.loads(output_path.read_text(encoding='utf-8'))['route']
+    assert len(route['rule_set']) == 4 and route['final'] == 'PROXY'
+    assert '警告: Unsupported rule provider: local' in capsys.readouterr().out
+
+    # 远程模式不下载规则集
+    upstream_hits.clear()
+    assert run_cli(str(config_path), str(output_path), remote_base='http://localhost:5000') == 0
+    assert not upstream_hits
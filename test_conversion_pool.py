@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+转换进程池测试，无需启动服务
+
+python -m pytest -q test_conversion_pool.py
+"""
+
+import os
+import signal
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import app as core
+from conversion_pool import ConversionPool, PoolBusyError, convert_to_json
+from incremental import IncrementalStore
+
+RULES = '\n'.join(['payload:'] + [f"  - 'DOMAIN-SUFFIX,site{i}.com'" for i in range(500)] +
+                  ["  - IP-CIDR,10.0.0.0/8,no-resolve", "  - DST-PORT,443"])
+
+
+def upstream_response(path):
+    return RULES, 'text/yaml; charset=utf-8'
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = ConversionPool(processes=1, max_queue=1)
+    monkeypatch.setattr(core, 'conversion_pool', pool)
+    yield pool
+    pool.shutdown()
+
+
+def occupy(pool, count, seconds=1.0):
+    """提交count个耗时任务占满进程和队列"""
+    threads = [threading.Thread(target=pool.submit, args=(time.sleep, seconds)) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    while pool.get_stats()['in_flight'] < count:
+        time.sleep(0.01)
+    return threads
+
+
+def test_offloaded_result_matches_in_process(pool):
+    pool.prewarm()
+    expected = core.convert_content(RULES, RULES.encode('utf-8'))
+    assert pool.submit(convert_to_json, RULES.encode('utf-8')) == expected
+
+    stats = pool.get_stats()
+    assert stats['completed'] == 1 and stats['failed'] == 0
+    assert stats['avg_run_ms'] > 0
+
+
+def test_full_queue_rejects_immediately(pool):
+    threads = occupy(pool, 2)
+    start = time.perf_counter()
+    with pytest.raises(PoolBusyError) as error:
+        pool.submit(time.sleep, 0)
+    assert time.perf_counter() - start < 0.5
+    assert error.value.retry_after >= 1
+
+    for thread in threads:
+        thread.join()
+    stats = pool.get_stats()
+    assert stats['rejected'] == 1
+    assert stats['max_queue_depth'] == 1
+    assert stats['max_wait_ms'] > 0
+    assert stats['in_flight'] == 0 and stats['queue_depth'] == 0
+
+
+def test_killed_child_restarts_pool(pool):
+    pool.prewarm()
+    errors = []
+
+    def convert():
+        try:
+            pool.submit(time.sleep, 5)
+        except BrokenProcessPool as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=convert)
+    thread.start()
+    while pool.get_stats()['in_flight'] < 1:
+        time.sleep(0.01)
+    # 模拟子进程被OOM终止，执行中的任务失败
+    for pid in list(pool._executor._processes):
+        os.kill(pid, signal.SIGKILL)
+    thread.join(5)
+    assert len(errors) == 1
+
+    # 之后的任务在重新启动的进程池中执行
+    assert pool.submit(convert_to_json, RULES.encode('utf-8')) == core.convert_content(RULES, RULES.encode('utf-8'))
+    stats = pool.get_stats()
+    assert stats['restarts'] == 1 and stats['failed'] == 1 and stats['in_flight'] == 0
+
+
+def test_large_input_busy_returns_503(pool, monkeypatch):
+    monkeypatch.setattr(core, 'CONVERT_OFFLOAD_MIN_BYTES', 1024)
+    threads = occupy(pool, 2)
+
+    client = core.app.test_client()
+    response = client.post('/convert', json={'content': RULES})
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+
+    # 小于阈值的输入仍在请求线程中转换
+    response = client.post('/convert', json={'content': 'DOMAIN,a.com'})
+    assert response.status_code == 200
+
+    for thread in threads:
+        thread.join()
+    assert client.get('/api/stats').get_json()['process_pool']['rejected'] == 1
+
+
+def test_large_upstream_is_offloaded(pool, upstream, monkeypatch):
+    client = core.app.test_client()
+    url = f"/rules/{upstream}/offload.yaml"
+    expected = client.get(url, headers={'Accept-Encoding': 'identity'}).data
+    core.rule_cache._entries.clear()
+    # 没有上次的解析状态，完整转换
+    monkeypatch.setattr(core, 'incremental_states', IncrementalStore(core.INCREMENTAL_MAX_BYTES))
+
+    monkeypatch.setattr(core, 'CONVERT_OFFLOAD_MIN_BYTES', 1024)
+    response = client.get(url, headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.data == expected
+    assert pool.get_stats()['completed'] == 1
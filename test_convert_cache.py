@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+文本转换结果缓存测试，无需启动服务
+
+python -m pytest -q test_convert_cache.py
+"""
+
+import asyncio
+
+import brotli
+import httpx
+import pytest
+
+import app as core
+import asgi
+from rule_cache import RuleCache
+
+CONTENT = '\n'.join(f'DOMAIN-SUFFIX,site{i}.com' for i in range(200))
+
+
+@pytest.fixture(autouse=True)
+def convert_cache(monkeypatch):
+    cache = RuleCache(max_bytes=core.CONVERT_CACHE_MAX_BYTES, compressor=core.precompress, namespace='convert')
+    monkeypatch.setattr(core, 'convert_cache', cache)
+    return cache
+
+
+@pytest.fixture
+def conversions(monkeypatch):
+    """统计实际执行的转换次数"""
+    calls = []
+    convert_content = core.convert_content
+
+    def counting(content, content_bytes, behavior=None):
+        calls.append(behavior)
+        return convert_content(content, content_bytes, behavior)
+
+    monkeypatch.setattr(core, 'convert_content', counting)
+    return calls
+
+
+def test_repeated_content_is_served_from_cache(convert_cache, conversions):
+    client = core.app.test_client()
+    saved_before = core.convert_cache_stats()['saved_bytes']
+
+    first = client.post('/convert', json={'content': CONTENT}, headers={'Accept-Encoding': 'identity'})
+    second = client.post('/convert', json={'content': CONTENT}, headers={'Accept-Encoding': 'identity'})
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data
+    assert first.headers['ETag'] == second.headers['ETag']
+    assert len(conversions) == 1
+
+    # 命中时返回写入时生成的压缩版本
+    compressed = client.post('/convert', json={'content': CONTENT}, headers={'Accept-Encoding': 'br'})
+    assert compressed.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(compressed.data) == first.data
+
+    stats = client.get('/api/stats').get_json()['convert_cache']
+    assert stats['hits'] == 2 and stats['misses'] == 1
+    assert stats['hit_ratio'] == 66.7
+    assert stats['saved_bytes'] - saved_before == 2 * len(CONTENT.encode('utf-8'))
+
+
+def test_behavior_is_part_of_the_key(conversions):
+    client = core.app.test_client()
+    content = 'example.com\n.example.org'
+    assert client.post('/convert', json={'content': content}).status_code == 200
+    domain = client.post('/convert', json={'content': content, 'behavior': 'domain'}).get_json()
+    assert client.post('/convert', json={'content': content, 'behavior': 'domain'}).get_json() == domain
+    assert conversions == [None, 'domain']
+    assert domain['rules'] == [{'domain': ['example.com']}, {'domain_suffix': ['example.org']}]
+
+    assert client.post('/convert', json={'content': content, 'behavior': 'bogus'}).status_code == 400
+
+
+def test_cache_is_bounded_by_bytes(convert_cache):
+    convert_cache.max_bytes = 4096
+    client = core.app.test_client()
+    for i in range(20):
+        assert client.post('/convert', json={'content': f'DOMAIN,site{i}.example.com'}).status_code == 200
+
+    stats = convert_cache.get_stats()
+    assert stats['bytes'] <= 4096
+    assert stats['evictions'] > 0
+    assert stats['entries'] < 20
+
+
+def test_asgi_shares_the_cache(convert_cache, conversions):
+    expected = core.app.test_client().post('/convert', json={'content': CONTENT},
+                                           headers={'Accept-Encoding': 'identity'})
+
+    async def main():
+        transport = httpx.ASGITransport(app=asgi.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                return (await client.post('/convert', json={'content': CONTENT}, headers={'Accept-Encoding': 'identity'}),
+                        await client.post('/convert', json={'content': 'DOMAIN,new.example.com'}))
+        finally:
+            await asgi.shutdown()
+
+    cached, converted = asyncio.run(main())
+    assert cached.content == expected.data
+    assert converted.json() == {'version': 2, 'rules': [{'domain': ['new.example.com']}]}
+    assert len(conversions) == 1
+    assert convert_cache.get_stats()['entries'] == 2
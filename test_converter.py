@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+规则转换器离线测试，无需启动服务
+
+python -m pytest -q test_converter.py
+"""
+
+import json
+import os
+import random
+import subprocess
+import sys
+
+import yaml
+
+from rule_converter import RuleConverter, iter_lines, parse_flat_payload
+
+
+# 扁平payload文档，快速解析器应与 yaml.safe_load 结果一致
+FLAT_PAYLOAD_DOCS = [
+    "payload:\n  - 'DOMAIN-SUFFIX,foo.com'\n  - \"+.foo.com\"\n  - DOMAIN,bar.com\n",
+    "payload:\n- .example.com\n- example.org\n",
+    "# comment\n\npayload: # rules\n  # item comment\n\n  - '1.2.3.0/24'\n  - 2001:db8::/32\n",
+    "payload:\r\n  - 'a.com'\r\n  - b.com\r\n",
+    "payload:\n  - 'it''s.com'\n  - 'sp ace '\n  - plain value  # trailing comment\n",
+    "payload:\n  - 'x.com'#comment\n  - http://x/y\n  - a#b\n  - -x\n  - ?x\n",
+    "payload:\n  - DOMAIN-SUFFIX,例子.com,no-resolve\n  - 'IP-CIDR,10.0.0.0/8,no-resolve'\n",
+]
+
+# 非扁平或含特殊标量的文档，快速解析器应放弃并交给通用解析器
+NON_FLAT_DOCS = [
+    "payload: []\n",
+    "payload:\n",
+    "name: test\npayload:\n  - a.com\n",
+    "---\npayload:\n  - a.com\n",
+    "payload:\n  - a.com\nother: 1\n",
+    "payload:\n  - 10\n  - a.com\n",
+    "payload:\n  - true\n",
+    "payload:\n  - ~\n",
+    "payload:\n  - 1:20\n",
+    "payload:\n  - .inf\n",
+    "payload:\n  - a: b\n",
+    "payload:\n  - - nested\n",
+    "payload:\n  - &anchor a.com\n  - *anchor\n",
+    "payload:\n  - \"esc\\taped\"\n",
+    "payload:\n  - 'multi\n    line'\n",
+    "payload:\n  - plain\n    continuation\n",
+    "payload:\n  - a.com\n    - b.com\n",
+    "payload:\n\t- a.com\n",
+    "payload:\n  -\n",
+    "\ufeffpayload:\n  - a.com\n",
+]
+
+
+def safe_load_payload(doc):
+    data = yaml.safe_load(doc)
+    return data['payload'] if isinstance(data, dict) else None
+
+
+def test_flat_payload_parity():
+    """扁平文档的解析结果与 yaml.safe_load 一致"""
+    for doc in FLAT_PAYLOAD_DOCS:
+        assert parse_flat_payload(doc) == safe_load_payload(doc), doc
+
+
+def test_non_flat_payload_falls_back():
+    """非扁平文档不走快速解析，load_yaml_payload 结果仍与 yaml.safe_load 一致"""
+    converter = RuleConverter()
+    for doc in NON_FLAT_DOCS:
+        assert parse_flat_payload(doc) is None, doc
+        try:
+            expected = safe_load_payload(doc)
+        except yaml.YAMLError:
+            continue
+        assert converter.load_yaml_payload(doc) == expected, doc
+
+
+def test_malformed_headerless_list_is_not_an_error():
+    """省略payload键的列表试解析失败时按文本格式处理，不抛出YAML解析错误"""
+    for doc in ('- a\n- b: [', '- foo\n\tbar: x\n- baz'):
+        converter = RuleConverter()
+        assert converter.detect_rule_provider_format(doc) == 'text-ipcidr'
+        assert converter.convert(doc) == {'rules': [], 'version': 2}
+
+
+def test_flat_payload_random_parity():
+    """随机生成的文档：快速解析器接受的必须与 yaml.safe_load 完全一致"""
+    rng = random.Random(20240101)
+    atoms = [
+        'DOMAIN,a.com', '+.foo.com', '.bar.com', '1.2.3.0/24', '2001:db8::/32', '10', '1:20',
+        'true', 'null', '~', '', 'a#b', 'a #b', 'a: b', 'a:b', '-x', '- x', '?x', ':x', '&a', '*a',
+        '!t', '|', '%x', '@x', "a'b", 'a"b', 'a\\b', ' sp ', 'x\ty', '例子.com', '1.5', '.inf',
+        '0x1f', '2001-12-14', '=', '<<', '[a]', ',a', 'a,', 'a:', '#', "'", '"', '\x85', '\r',
+    ]
+
+    def item():
+        atom = rng.choice(atoms)
+        style = rng.random()
+        if style < 0.4:
+            value = atom
+        elif style < 0.7:
+            value = "'" + atom.replace("'", "''") + "'"
+        elif style < 0.8:
+            value = "'" + atom + "'"
+        else:
+            value = '"' + atom + '"'
+        if rng.random() < 0.15:
+            value += rng.choice([' # c', '#c', '   ', ' x', '\t#c'])
+        return value
+
+    accepted = 0
+    for _ in range(5000):
+        indent = rng.choice(['', '  ', '    '])
+        lines = [rng.choice(['payload:', 'payload: # c', 'payload: []', ' payload:'])]
+        for _ in range(rng.randint(0, 6)):
+            roll = rng.random()
+            if roll < 0.1:
+                lines.append(indent + '# comment')
+            elif roll < 0.15:
+                lines.append(rng.choice(['  ', '']) + '- ' + item())
+            else:
+                lines.append(indent + rng.choice(['- ', '-  ', '-']) + item())
+        doc = '\n'.join(lines) + '\n'
+
+        result = parse_flat_payload(doc)
+        try:
+            expected = safe_load_payload(doc)
+        except yaml.YAMLError:
+            assert result is None, doc
+            continue
+        if result is not None:
+            accepted += 1
+            assert result == expected, doc
+
+    assert accepted > 0
+
+
+def test_yaml_provider_conversion_matches_full_parser():
+    """快速解析器转换的结果与通用解析器的转换结果一致"""
+    doc = "payload:\n" + ''.join(f"  - 'DOMAIN-SUFFIX,site{i}.com'\n  - DOMAIN,www{i}.net\n" for i in range(50))
+
+    fast = RuleConverter().convert(doc)
+    slow = RuleConverter().convert_by_behavior(safe_load_payload(doc), 'classical')
+
+    def canonical(result):
+        return {key: sorted(values) for rule in result['rules'] for key, values in rule.items()}
+
+    assert canonical(fast) == canonical(slow)
+
+
+def test_iter_lines_matches_split():
+    """按块切分的结果与 split('\\n') 一致，包括块边界上的换行和超过块大小的长行"""
+    rng = random.Random(11)
+    for _ in range(500):
+        content = ''.join(rng.choice(['a', 'bc', '\n', '\r\n', 'x' * 20]) for _ in range(rng.randint(0, 40)))
+        for chunk_chars in (1, 3, 8, 64):
+            assert list(iter_lines(content, chunk_chars)) == content.split('\n'), (content, chunk_chars)
+
+
+def test_late_nested_payload_falls_back():
+    """边解析边转换的payload在末尾才出现转义字符串时回退到通用解析器，统计不重复累加"""
+    doc = "payload:\n" + ''.join(f"  - DOMAIN,www{i}.net\n" for i in range(30)) + '  - "DOMAIN,\\x41.com"\n'
+
+    converter = RuleConverter()
+    result = converter.convert(doc)
+    expected = RuleConverter().convert_by_behavior(safe_load_payload(doc), 'classical')
+    assert result == expected
+    assert converter.get_conversion_stats()['total_rules'] == 31
+
+
+def test_parsed_rule_keeps_original_only_when_requested():
+    """parse_rule_line 默认不保留原始行"""
+    rule = RuleConverter().parse_rule_line('  DOMAIN-SUFFIX,ads.com,REJECT,no-resolve ')
+    assert (rule.type, rule.argument, rule.policy, rule.no_resolve) == ('DOMAIN-SUFFIX', 'ads.com', 'REJECT', True)
+    assert rule['argument'] == 'ads.com' and rule.original is None
+    assert not hasattr(rule, '__dict__')
+
+    rule = RuleConverter(keep_original=True).parse_rule_line('.example.com')
+    assert (rule['type'], rule['argument'], rule['original']) == ('DOMAIN-SUFFIX', 'example.com', '.example.com')
+
+
+def test_bulk_domain_validation_parity():
+    """批量校验域名与逐个调用 is_valid_domain 的结果一致"""
+    converter = RuleConverter()
+    rng = random.Random(20240102)
+    label = 'a' * 61
+    cases = [
+        '', 'a', 'a.com', 'a.com\n', '\na.com', 'a' * 63, 'a' * 64, '-a.com', 'a-.com', 'a..com', '.a', 'a.',
+        '+.a.com', '*.a.com', 'a_b.com', 'ａ.com', '例子.com', 'a.com\r', ' a.com',
+        '.'.join([label] * 4) + '.a', '.'.join([label] * 4) + '.ab',
+    ]
+    for _ in range(20000):
+        cases.append(''.join(rng.choice('aZ09-._\n ') for _ in range(rng.randint(0, 10))))
+
+    # 全部合法的批次走整批匹配，混入非法域名的批次逐行匹配
+    batches = [[case] for case in cases]
+    batches.append([f'host{i}.example.com' for i in range(100)])
+    batches.append([f'host{i}.example.com' for i in range(100)] + ['.'.join([label] * 4) + '.ab'])
+    batches.extend(cases[i:i + 50] for i in range(0, len(cases), 50))
+
+    for batch in batches:
+        valid = converter.filter_valid_domains(batch)
+        for domain in batch:
+            assert (domain in valid) == converter.is_valid_domain(domain), repr(domain)
+
+
+def test_domain_subsumption():
+    """被更短后缀覆盖的 domain_suffix 和 domain 被去掉，匹配范围不变"""
+    content = '\n'.join([
+        'DOMAIN-SUFFIX,example.com',
+        'DOMAIN-SUFFIX,cdn.example.com',
+        'DOMAIN-SUFFIX,.a.b.example.com',
+        'DOMAIN-SUFFIX,.example.org',
+        'DOMAIN-SUFFIX,example.org',
+        'DOMAIN-SUFFIX,.example.net',
+        'DOMAIN-SUFFIX,sub.example.net',
+        'DOMAIN,example.com',
+        'DOMAIN,www.example.com',
+        'DOMAIN,example.net',
+        'DOMAIN,www.example.net',
+        'DOMAIN,notexample.com',
+        'DOMAIN-KEYWORD,example',
+    ])
+
+    converter = RuleConverter(optimize_domains=True)
+    result = converter.convert(content)
+    fields = {key: sorted(values) for rule in result['rules'] for key, values in rule.items()}
+
+    assert fields == {
+        'domain_suffix': ['.example.net', 'example.com', 'example.org'],
+        'domain': ['example.net', 'notexample.com'],
+        'domain_keyword': ['example'],
+    }
+    assert converter.get_conversion_stats()['eliminated_rules'] == 7
+
+    # 默认不做去重
+    plain = RuleConverter().convert(content)
+    assert sum(len(values) for rule in plain['rules'] for values in rule.values()) == 13
+
+
+def test_cidr_aggregation():
+    """相邻、重叠和被包含的网段合并为最少的网段，IPv4与IPv6分别合并"""
+    content = '\n'.join([
+        'IP-CIDR,1.0.0.0/24,no-resolve',
+        'IP-CIDR,1.0.1.0/24,no-resolve',
+        'IP-CIDR,10.0.0.0/16',
+        'IP-CIDR,10.0.5.0/24',
+        'IP-CIDR,10.1.0.0/16',
+        'IP-CIDR,192.168.1.7/24',
+        'IP-CIDR6,2001:db8::/33',
+        'IP-CIDR6,2001:db8:8000::/33',
+        'SRC-IP-CIDR,172.16.0.0/13',
+        'SRC-IP-CIDR,172.24.0.0/13',
+        'DOMAIN,example.com',
+    ])
+
+    converter = RuleConverter(aggregate_cidrs=True)
+    result = converter.convert(content)
+    fields = {key: sorted(values) for rule in result['rules'] for key, values in rule.items()}
+
+    assert fields == {
+        'ip_cidr': ['1.0.0.0/23', '10.0.0.0/15', '192.168.1.0/24', '2001:db8::/32'],
+        'source_ip_cidr': ['172.16.0.0/12'],
+        'domain': ['example.com'],
+    }
+    assert converter.get_conversion_stats()['eliminated_rules'] == 5
+
+
+def test_ipcidr_behavior_keeps_ipv6():
+    """ipcidr行为保留IPv6网段，合并时与逐个校验的结果覆盖范围一致"""
+    content = '1.2.3.0/24\n2001:db8::/32\nbad\n1.2.3.4\n'
+
+    plain = RuleConverter().convert(content, 'ipcidr')
+    assert sorted(plain['rules'][0]['ip_cidr']) == ['1.2.3.0/24', '1.2.3.4', '2001:db8::/32']
+
+    aggregated = RuleConverter(aggregate_cidrs=True).convert(content, 'ipcidr')
+    assert sorted(aggregated['rules'][0]['ip_cidr']) == ['1.2.3.0/24', '2001:db8::/32']
+
+
+def test_output_is_deterministic():
+    """不同的哈希种子下转换结果的字节完全一致，字段和取值均已排序"""
+    script = (
+        "import json, sys; from rule_converter import RuleConverter; "
+        "content = '\\n'.join(['DOMAIN,b.com', 'DST-PORT,443', 'DOMAIN-SUFFIX,z.com', 'DOMAIN,a.com', "
+        "'DST-PORT,80', 'DOMAIN-SUFFIX,c.com', 'IP-CIDR,10.0.0.0/8']); "
+        "sys.stdout.write(json.dumps(RuleConverter().convert(content)))"
+    )
+    outputs = set()
+    for seed in ('1', '2', '3'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        outputs.add(subprocess.run([sys.executable, '-c', script], env=env, capture_output=True,
+                                   text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout)
+
+    assert len(outputs) == 1
+    assert json.loads(outputs.pop())['rules'] == [
+        {'domain': ['a.com', 'b.com']},
+        {'domain_suffix': ['c.com', 'z.com']},
+        {'ip_cidr': ['10.0.0.0/8']},
+        {'port': [80, 443]},
+    ]
+
+
+def test_parallel_file_conversion_matches_serial(tmp_path):
+    """按行分块并行转换的结果和统计与单进程转换一致，无法逐行解析的YAML回退到单进程转换"""
+    rng = random.Random(7)
+    classical = ['# header'] + [rng.choice(['DOMAIN,a{}.com', 'DOMAIN-SUFFIX,s{}.net', 'IP-CIDR,10.{}.0.0/16',
+                                            'DST-PORT,{}', 'GEOIP,cn', 'bad line {}']).format(i % 250)
+                                for i in range(3000)]
+    inputs = {
+        'classical.txt': '\r\n'.join(classical),
+        'domain.txt': '\n'.join(f".d{i}.com" if i % 3 else f"w{i % 700}.d{i % 50}.com" for i in range(3000)),
+        'payload.yaml': '# provider\npayload:\n' + '\n'.join(f"  - '10.{i % 256}.{i // 256}.0/24'" for i in range(3000)),
+        'list.yaml': '\n'.join(f"- DOMAIN,x{i}.org" for i in range(3000)),
+        'escaped.yaml': 'payload:\n' + '\n'.join(f"  - DOMAIN,e{i}.com" for i in range(3000)) + '\n  - "DOMAIN,\\x41.com"\n',
+    }
+
+    for name, content in inputs.items():
+        path = tmp_path / name
+        path.write_bytes(content.encode('utf-8'))
+        for options in ({}, {'optimize_domains': True, 'aggregate_cidrs': True}):
+            for behavior in (None, 'domain', 'classical'):
+                serial = RuleConverter(**options)
+                parallel = RuleConverter(**options)
+                expected = serial.convert_file(str(path), behavior)
+                assert parallel.convert_file(str(path), behavior, jobs=2, chunk_size=4096) == expected, name
+
+                serial_stats = serial.get_conversion_stats()
+                parallel_stats = parallel.get_conversion_stats()
+                for key in ('total_rules', 'converted_rules', 'skipped_rules', 'eliminated_rules',
+                            'rule_provider_format'):
+                    assert parallel_stats[key] == serial_stats[key], (name, key)
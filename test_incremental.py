@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+增量重新转换测试，使用本地上游桩服务，无需启动转换服务
+
+python -m pytest -q test_incremental.py
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import app as core
+import asgi
+from incremental import IncrementalState, IncrementalStore
+from rule_converter import RuleConverter, StreamLineReader
+
+CLASSICAL = '\n'.join(['# classical', 'DOMAIN-SUFFIX,ads.com', 'DOMAIN,track.example.com', 'ads.com',
+                       'IP-CIDR,10.0.0.0/24,no-resolve', 'IP-CIDR,10.0.1.0/24', 'DST-PORT,443', 'DOMAIN,track.example.com',
+                       'GEOIP,cn'] + [f'DOMAIN-SUFFIX,site{i}.com' for i in range(40)])
+DOMAINS = '\n'.join(['.example.com', 'www.example.com', 'not a domain'] + [f'host{i}.example.net' for i in range(40)])
+CIDRS = '\n'.join([f'10.0.{i}.0/24' for i in range(40)] + ['2001:db8::/32'])
+PAYLOAD = '\n'.join(['payload:'] + ["  - 'DOMAIN-SUFFIX,ads.com'", '  - DOMAIN,cdn.example.net # cdn'] +
+                    [f'  - DOMAIN-SUFFIX,site{i}.com' for i in range(40)])
+LIST = '\n'.join([f'- .site{i}.com' for i in range(40)])
+
+# 每种内容的修改：删除第3行、复制第5行、追加两行
+EDITS = {
+    'classical': ['DOMAIN-KEYWORD,tracker', 'IP-CIDR,10.0.2.0/24'],
+    'domain': ['.example.net', 'new.example.org'],
+    'cidr': ['10.0.40.0/24', '192.168.0.0/16'],
+    'payload': ['  - DOMAIN,new.example.org', "  - 'IP-CIDR,10.0.0.0/8'"],
+    'list': ['- .example.org', '- www.site1.com'],
+}
+CONTENTS = {'classical': CLASSICAL, 'domain': DOMAINS, 'cidr': CIDRS, 'payload': PAYLOAD, 'list': LIST}
+
+
+def edit(content, added):
+    lines = content.split('\n')
+    del lines[3]
+    lines.insert(6, lines[5])
+    return '\n'.join(lines + added)
+
+
+@pytest.mark.parametrize('name', sorted(CONTENTS))
+@pytest.mark.parametrize('options', [(False, False), (True, True)])
+def test_update_matches_full_conversion(name, options):
+    converter = RuleConverter(*options)
+    content = CONTENTS[name]
+    state = IncrementalState.build(content, None, converter)
+    assert state.result(converter) == converter.convert(content)
+
+    updated = edit(content, EDITS[name])
+    assert state.update(updated, converter) == converter.convert(updated)
+    assert state.changed_lines == 3
+    # 改回原内容
+    assert state.update(content, converter) == converter.convert(content)
+
+
+def test_shared_values_are_reference_counted():
+    converter = RuleConverter()
+    state = IncrementalState.build('DOMAIN-SUFFIX,ads.com\n.ads.com\nDOMAIN,a.com\nDOMAIN,a.com\nDOMAIN,b.com',
+                                   'classical', converter)
+    assert state.fields['domain_suffix']['ads.com'] == 2
+
+    # 另一行仍产生 ads.com，重复的行删去一次仍然存在
+    result = state.update('.ads.com\nDOMAIN,a.com\nDOMAIN,b.com\nDOMAIN,c.com', converter)
+    assert result['rules'] == [{'domain': ['a.com', 'b.com', 'c.com']}, {'domain_suffix': ['ads.com']}]
+    result = state.update('DOMAIN,a.com\nDOMAIN,b.com\nDOMAIN,c.com', converter)
+    assert result['rules'] == [{'domain': ['a.com', 'b.com', 'c.com']}]
+    assert 'ads.com' not in state.fields['domain_suffix']
+
+
+@pytest.mark.parametrize('updated', [
+    # 自动检测的behavior变化
+    PAYLOAD.replace('payload:', 'payload:\n' + '\n'.join(f'  - 10.{i}.0.0/16' for i in range(10))),
+    # 变化的行过多
+    '\n'.join(['payload:'] + [f'  - DOMAIN,host{i}.com' for i in range(40)]),
+    # 无法逐行解析的内容
+    PAYLOAD + '\n  - {nested: value}',
+    PAYLOAD + '\n    - DOMAIN,deeper.example.com',
+    PAYLOAD.replace('payload:', 'payload: # rules\nother: 1'),
+    PAYLOAD.replace('payload:\n', ''),
+    '',
+])
+def test_unsupported_changes_fall_back(updated):
+    converter = RuleConverter()
+    state = IncrementalState.build(PAYLOAD, None, converter)
+    lines = state.lines.copy()
+    assert state.update(updated, converter) is None
+    assert state.lines == lines
+
+
+def test_unsupported_content_has_no_state():
+    converter = RuleConverter()
+    assert IncrementalState.build('payload:\n  - a.com\n  - [b.com]', None, converter) is None
+    assert IncrementalState.build('payload:\n  - "escaped\\tvalue"', None, converter) is None
+    assert IncrementalState.build('# only comments', None, converter) is None
+
+
+def test_store_evicts_least_recently_used():
+    converter = RuleConverter()
+    states = [IncrementalState.build(DOMAINS, None, converter) for _ in range(3)]
+    store = IncrementalStore(states[0].size * 2)
+    for i, state in enumerate(states):
+        store.put(str(i), state)
+    assert store.take('0') is None
+    assert store.take('1') is states[1]
+    assert store.take('1') is None
+    assert store.get_stats()['evictions'] == 1
+    assert store.get_stats()['entries'] == 1
+
+
+# 上游当前返回的内容
+upstream_content = {'content': PAYLOAD}
+
+
+def upstream_response(path):
+    return upstream_content['content'], 'text/yaml; charset=utf-8'
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = IncrementalStore(core.INCREMENTAL_MAX_BYTES)
+    monkeypatch.setattr(core, 'incremental_states', store)
+    upstream_content['content'] = PAYLOAD
+    yield store
+    upstream_content['content'] = PAYLOAD
+
+
+def test_changed_upstream_is_reconverted_incrementally(upstream, store, monkeypatch):
+    # 较大的内容连同解析状态在进程池中按行比较
+    monkeypatch.setattr(core, 'CONVERT_OFFLOAD_MIN_BYTES', len(PAYLOAD) // 2)
+    completed = core.conversion_pool.get_stats()['completed']
+    client = core.app.test_client()
+    url = f'/rules/{upstream}/provider.yaml'
+    assert client.get(url).status_code == 200
+
+    # 缓存过期后上游内容变化
+    upstream_content['content'] = edit(PAYLOAD, EDITS['payload'])
+    core.rule_cache._entries.clear()
+    response = client.get(url)
+    assert response.get_json() == RuleConverter().convert(upstream_content['content'])
+
+    stats = client.get('/api/stats').get_json()['incremental']
+    assert stats['full'] == 1 and stats['incremental'] == 1
+    assert stats['changed_lines'] == 3 and stats['entries'] == 1
+    assert core.conversion_pool.get_stats()['completed'] == completed + 2
+
+    # 无法增量转换时在同一子进程中完整转换
+    upstream_content['content'] = PAYLOAD.replace('payload:\n', '')
+    core.rule_cache._entries.clear()
+    response = client.get(url)
+    assert response.get_json() == RuleConverter().convert(upstream_content['content'])
+    stats = store.get_stats()
+    assert stats['fallbacks'] == 1 and stats['full'] == 2 and stats['entries'] == 1
+
+
+def test_small_upstream_is_streamed_until_a_state_exists(upstream, store, monkeypatch):
+    client = core.app.test_client()
+    url = f'/rules/{upstream}/provider.yaml'
+    streamed = []
+    monkeypatch.setattr(core, 'StreamLineReader', lambda *args, **kwargs: streamed.append(1) or
+                        StreamLineReader(*args, **kwargs))
+
+    # 首次下载的小文件逐行转换，不建立解析状态
+    assert client.get(url).get_json() == RuleConverter().convert(PAYLOAD)
+    assert streamed == [1] and store.get_stats()['entries'] == 0
+
+    # 已有解析状态时读取完整内容，在请求线程中只转换变化的行
+    key = core.source_cache_key(f'{upstream}/provider.yaml')
+    store.put(key, IncrementalState.build(PAYLOAD, None, RuleConverter()))
+    upstream_content['content'] = edit(PAYLOAD, EDITS['payload'])
+    core.rule_cache._entries.clear()
+    assert client.get(url).get_json() == RuleConverter().convert(upstream_content['content'])
+    assert streamed == [1] and store.get_stats()['incremental'] == 1
+
+
+def test_asgi_reconverts_incrementally(upstream, store, monkeypatch):
+    monkeypatch.setattr(core, 'CONVERT_OFFLOAD_MIN_BYTES', len(PAYLOAD) // 2)
+    url = f'/rules/{upstream}/provider.yaml'
+
+    async def main():
+        transport = httpx.ASGITransport(app=asgi.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                await client.get(url)
+                upstream_content['content'] = edit(PAYLOAD, EDITS['payload'])
+                core.rule_cache._entries.clear()
+                return await client.get(url, headers={'Accept-Encoding': 'identity'})
+        finally:
+            await asgi.shutdown()
+
+    response = asyncio.run(main())
+    assert json.loads(response.content) == RuleConverter().convert(upstream_content['content'])
+    assert store.get_stats()['incremental'] == 1
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+多源合并接口测试，使用本地上游桩服务，无需启动转换服务
+
+python -m pytest -q test_merge.py
+"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import app as core
+import asgi
+from rule_cache import normalize_url
+from srs import read_rule_set
+
+UPSTREAM_DELAY = 0.5
+
+SOURCES = {
+    '/ads.txt': 'DOMAIN-SUFFIX,ads.com\nDOMAIN,track.example.com\nIP-CIDR,10.0.0.0/8',
+    '/cdn.yaml': "payload:\n  - 'DOMAIN-SUFFIX,ads.com'\n  - DOMAIN,cdn.example.net\n  - DST-PORT,443",
+    '/plain.txt': 'example.org\n.example.io',
+}
+
+
+def upstream_response(path):
+    if path.startswith('/slow/'):
+        time.sleep(UPSTREAM_DELAY)
+        path = '/ads.txt'
+    return SOURCES.get(path)
+
+
+def merge_url(upstream, *paths):
+    return '/merge?' + '&'.join(f"url={path.replace('{}', upstream)}" for path in paths)
+
+
+def test_merge_deduplicates_sources(upstream, upstream_hits):
+    client = core.app.test_client()
+    response = client.get(merge_url(upstream, '{}/ads.txt', '{}/cdn.yaml', 'domain,{}/plain.txt'))
+    assert response.status_code == 200
+    assert response.get_json() == {'version': 2, 'rules': [
+        {'domain': ['cdn.example.net', 'example.org', 'track.example.com']},
+        {'domain_suffix': ['ads.com', 'example.io']},
+        {'ip_cidr': ['10.0.0.0/8']},
+        {'port': [443]},
+    ]}
+
+    # 来源顺序不影响结果，客户端携带 If-None-Match 时返回304
+    reordered = client.get(merge_url(upstream, 'domain,{}/plain.txt', '{}/cdn.yaml', '{}/ads.txt'),
+                           headers={'If-None-Match': response.headers['ETag']})
+    assert reordered.status_code == 304
+
+    # POST 与 GET 结果一致，也可以输出二进制规则集
+    posted = client.post('/merge?format=srs', json={'sources': [
+        f'{upstream}/ads.txt', {'url': f'{upstream}/cdn.yaml'}, {'url': f'{upstream}/plain.txt', 'behavior': 'domain'}]})
+    assert posted.status_code == 200
+    # 二进制规则集中域名按后缀树顺序排列
+    decoded = {key: sorted(values) for rule in read_rule_set(posted.data)['rules'] for key, values in rule.items()}
+    assert decoded == {key: values for rule in response.get_json()['rules'] for key, values in rule.items()}
+    assert sum(upstream_hits.values()) == 3
+
+
+def test_changed_source_reconverts_only_that_source(upstream, upstream_hits):
+    client = core.app.test_client()
+    url = merge_url(upstream, '{}/ads.txt', '{}/cdn.yaml')
+    first = client.get(url).get_json()
+
+    # 单独请求 /rules 时复用合并时缓存的来源
+    assert client.get(f'/rules/{upstream}/ads.txt').status_code == 200
+    assert upstream_hits == {'/ads.txt': 1, '/cdn.yaml': 1}
+
+    core.rule_cache._entries.pop(normalize_url(f'{upstream}/cdn.yaml'))
+    original = SOURCES['/cdn.yaml']
+    SOURCES['/cdn.yaml'] = 'DOMAIN,new.example.net'
+    try:
+        second = client.get(url).get_json()
+    finally:
+        SOURCES['/cdn.yaml'] = original
+
+    assert upstream_hits == {'/ads.txt': 1, '/cdn.yaml': 2}
+    assert first != second
+    assert second['rules'][0] == {'domain': ['new.example.net', 'track.example.com']}
+
+
+def test_sources_are_fetched_concurrently(upstream):
+    client = core.app.test_client()
+    start = time.perf_counter()
+    response = client.get(merge_url(upstream, *[f'{{}}/slow/{i}.txt' for i in range(6)]))
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200
+    assert elapsed < 6 * UPSTREAM_DELAY / 2
+
+
+def test_invalid_requests(upstream, monkeypatch):
+    client = core.app.test_client()
+    assert client.get('/merge').status_code == 400
+    assert client.get('/merge?url=not-a-url').status_code == 400
+    assert client.get(merge_url(upstream, 'bogus,{}/ads.txt')).status_code == 400
+    assert client.post('/merge', json={'sources': 'x'}).status_code == 400
+
+    monkeypatch.setattr(core, 'MERGE_MAX_SOURCES', 2)
+    assert client.get(merge_url(upstream, '{}/a.txt', '{}/b.txt', '{}/c.txt')).status_code == 400
+
+    response = client.get(merge_url(upstream, '{}/ads.txt', '{}/missing.txt'))
+    assert response.status_code == 500
+    assert f'{upstream}/missing.txt' in response.get_json()['error']
+
+
+def test_asgi_merge_matches_sync_mode(upstream):
+    url = merge_url(upstream, '{}/ads.txt', '{}/cdn.yaml', 'domain,{}/plain.txt')
+    expected = core.app.test_client().get(url, headers={'Accept-Encoding': 'identity'})
+    core.rule_cache._entries.clear()
+    core.merge_cache._entries.clear()
+
+    async def main():
+        transport = httpx.ASGITransport(app=asgi.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+                return (await client.get(url, headers={'Accept-Encoding': 'identity'}),
+                        await client.get(merge_url(upstream, '{}/missing.txt')))
+        finally:
+            await asgi.shutdown()
+
+    merged, missing = asyncio.run(main())
+    assert merged.status_code == 200
+    assert merged.content == expected.data
+    assert merged.headers['ETag'] == expected.headers['ETag']
+    assert missing.status_code == 500 and 'missing.txt' in missing.json()['error']
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+启动预热与就绪检查测试，使用本地上游桩服务，无需启动转换服务
+
+python -m pytest -q test_preload.py
+"""
+
+import time
+from collections import Counter
+
+import pytest
+
+import app as core
+from preload import PreloadError, Warmup, load_preload_manifest
+from shared_store import MemoryStore
+
+UPSTREAM_DELAY = 0.3
+
+SOURCES = {
+    '/ads.txt': 'DOMAIN-SUFFIX,ads.com\nDOMAIN,track.example.com',
+    '/direct.txt': 'example.org\n.example.io',
+}
+
+
+def upstream_response(path):
+    time.sleep(UPSTREAM_DELAY)
+    return SOURCES.get(path)
+
+
+def new_warmup(path, store=None):
+    # 与 app 中的配置相同，每个实例相当于一个worker，共享同一个存储
+    return Warmup(str(path) if path else None, core.preload_source,
+                  store=store or MemoryStore(), is_warm=core.source_is_warm)
+
+
+def use_warmup(monkeypatch, path, store=None):
+    warmup = new_warmup(path, store)
+    monkeypatch.setattr(core, 'warmup', warmup)
+    return warmup
+
+
+def wait_ready(client):
+    for _ in range(100):
+        response = client.get('/ready')
+        if response.status_code == 200:
+            return response.get_json()
+        time.sleep(0.05)
+    raise AssertionError('warm-up did not finish')
+
+
+def test_load_manifest(tmp_path):
+    manifest = tmp_path / 'preload.yaml'
+    manifest.write_text('sources:\n  - https://a.example/list.txt\n  - domain,https://b.example/list.txt\n'
+                        '  - {url: "https://c.example/cidr.yaml", behavior: ipcidr}\n  - https://a.example/list.txt\n',
+                        encoding='utf-8')
+    assert load_preload_manifest(str(manifest)) == [
+        ('https://a.example/list.txt', None),
+        ('https://b.example/list.txt', 'domain'),
+        ('https://c.example/cidr.yaml', 'ipcidr'),
+    ]
+
+    manifest.write_text('["https://a.example/list.txt"]', encoding='utf-8')
+    assert load_preload_manifest(str(manifest)) == [('https://a.example/list.txt', None)]
+
+    for content in ('sources: 1', '- not-a-url', '- {url: "https://a.example/x", behavior: bogus}'):
+        manifest.write_text(content, encoding='utf-8')
+        with pytest.raises(PreloadError):
+            load_preload_manifest(str(manifest))
+    with pytest.raises(PreloadError):
+        load_preload_manifest(str(tmp_path / 'missing.yaml'))
+
+
+def test_ready_after_warmup(upstream, upstream_hits, tmp_path, monkeypatch):
+    manifest = tmp_path / 'preload.yaml'
+    manifest.write_text(f'- {upstream}/ads.txt\n- domain,{upstream}/direct.txt\n', encoding='utf-8')
+    warmup = use_warmup(monkeypatch, manifest)
+    client = core.app.test_client()
+
+    # 预热开始前和进行中都未就绪
+    assert client.get('/ready').status_code == 503
+    warmup.start()
+    response = client.get('/ready')
+    assert response.status_code == 503
+    assert response.get_json()['state'] == 'running'
+
+    status = wait_ready(client)
+    assert status['total'] == status['done'] == 2 and status['failed'] == 0
+    # 两个上游并发下载
+    assert status['elapsed_ms'] < 2 * UPSTREAM_DELAY * 1000
+
+    # 预热后的请求直接命中缓存
+    assert client.get(f'/rules/{upstream}/ads.txt').status_code == 200
+    assert client.get(f'/merge?url=domain,{upstream}/direct.txt').status_code == 200
+    assert upstream_hits == {'/ads.txt': 1, '/direct.txt': 1}
+    assert client.get('/api/stats').get_json()['warmup']['done'] == 2
+
+
+def test_failed_sources_do_not_block_readiness(upstream, tmp_path, monkeypatch):
+    manifest = tmp_path / 'preload.yaml'
+    manifest.write_text(f'- {upstream}/ads.txt\n- {upstream}/missing.txt\n', encoding='utf-8')
+    use_warmup(monkeypatch, manifest).start()
+
+    status = wait_ready(core.app.test_client())
+    assert status['done'] == 2 and status['failed'] == 1
+    assert status['errors'][0]['url'] == f'{upstream}/missing.txt'
+
+
+def test_without_manifest_ready_immediately(tmp_path, monkeypatch):
+    use_warmup(monkeypatch, None).start()
+    assert wait_ready(core.app.test_client())['total'] == 0
+
+    # 清单无法读取时记录错误并就绪，不让健康检查一直失败
+    use_warmup(monkeypatch, tmp_path / 'missing.yaml').start()
+    status = wait_ready(core.app.test_client())
+    assert status['failed'] == 0 and len(status['errors']) == 1
+
+
+def test_workers_warm_each_source_once(tmp_path):
+    manifest = tmp_path / 'preload.yaml'
+    manifest.write_text('- https://a.example/ads.txt\n- domain,https://a.example/direct.txt\n'
+                        '- https://a.example/missing.txt\n', encoding='utf-8')
+    # 各worker的进程内缓存互不可见，只通过共享存储协调
+    calls = Counter()
+    warmed = set()
+
+    def warm(url, behavior):
+        calls[url.rsplit('/', 1)[1]] += 1
+        time.sleep(UPSTREAM_DELAY)
+        if url.endswith('missing.txt'):
+            raise RuntimeError('404 Not Found')
+        warmed.add((url, behavior))
+
+    store = MemoryStore()
+    workers = [Warmup(str(manifest), warm, store=store, is_warm=lambda url, behavior: (url, behavior) in warmed)
+               for _ in range(4)]
+    for warmup in workers:
+        warmup.start()
+    for warmup in workers:
+        warmup._thread.join(5)
+
+    # 每个来源只由持有租约的worker下载一次，失败的来源其他worker不再重试
+    assert calls == {'ads.txt': 1, 'direct.txt': 1, 'missing.txt': 1}
+    for warmup in workers:
+        status = warmup.status()
+        assert status['ready'] and status['done'] == 3 and status['failed'] == 1
+        assert status['errors'] == [{'url': 'https://a.example/missing.txt', 'error': '404 Not Found'}]
+
+
+def test_ready_from_shared_state(upstream, upstream_hits, tmp_path, monkeypatch):
+    manifest = tmp_path / 'preload.yaml'
+    manifest.write_text(f'- {upstream}/ads.txt\n- {upstream}/missing.txt\n', encoding='utf-8')
+    store = MemoryStore()
+    first = new_warmup(manifest, store)
+    # 另一个worker的预热尚未开始，来源都已在共享缓存中或最近失败时即就绪
+    second = use_warmup(monkeypatch, manifest, store)
+    client = core.app.test_client()
+    assert client.get('/ready').status_code == 503
+
+    first.start()
+    first._thread.join(5)
+    response = client.get('/ready')
+    assert response.status_code == 200
+    assert response.get_json()['state'] == 'pending'
+    assert upstream_hits == {'/ads.txt': 1, '/missing.txt': 1}
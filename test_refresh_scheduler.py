@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+后台刷新调度测试，使用本地上游桩服务，无需启动转换服务
+
+python -m pytest -q test_refresh_scheduler.py
+"""
+
+import threading
+import time
+from collections import Counter
+
+import app as core
+from refresh_scheduler import RefreshScheduler
+from rule_cache import RuleCache, normalize_url
+
+# 每次下载返回新版本的内容
+versions = Counter()
+
+
+def upstream_response(path):
+    versions[path] += 1
+    return f'DOMAIN-SUFFIX,version{versions[path]}.example.com'
+
+
+class Recorder:
+    """记录刷新调用，release 之前刷新一直进行中"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, cache_key, url, entry, behavior):
+        self.calls.append((cache_key, url, entry, behavior))
+        self.release.wait(5)
+        self.cache.end_refresh(cache_key)
+
+
+def wait_idle(scheduler):
+    while scheduler.get_stats()['in_flight']:
+        time.sleep(0.01)
+
+
+def make_scheduler(**kwargs):
+    cache = RuleCache(ttl=600, stale_ttl=3600)
+    recorder = Recorder(cache)
+    return cache, recorder, RefreshScheduler(cache, recorder, **kwargs)
+
+
+def test_only_hot_sources_are_refreshed_before_expiry():
+    cache, recorder, scheduler = make_scheduler(top_n=1)
+    for _ in range(3):
+        scheduler.record('domain|http://a/list', 'http://a/list', 'domain')
+    for _ in range(2):
+        scheduler.record('http://b/list', 'http://b/list')
+    scheduler.record('http://c/list', 'http://c/list')
+    entry = cache.store('domain|http://a/list', b'{}')
+    cache.store('http://b/list', b'{}')
+
+    assert [key for key, _ in scheduler.hot_sources()] == ['domain|http://a/list']
+    assert scheduler.tick(entry.stored_at + 1) == 0
+
+    due = scheduler.due_at('domain|http://a/list', entry)
+    assert entry.fresh_until - 0.1 * 600 - scheduler.check_interval <= due < entry.fresh_until
+    assert scheduler.due_at('domain|http://a/list', entry) == due
+    assert scheduler.tick(due) == 1
+    wait_idle(scheduler)
+    assert recorder.calls == [('domain|http://a/list', 'http://a/list', entry, 'domain')]
+    # 统计检查不计入缓存命中
+    assert cache.get_stats()['hits'] == 0
+
+
+def test_declared_interval_is_bounded():
+    cache, recorder, scheduler = make_scheduler(min_interval=60)
+    scheduler.set_interval('http://a/list', 1)
+    scheduler.set_interval('http://b/list', 86400)
+    assert scheduler.period('http://a/list') == 60
+    assert scheduler.period('http://b/list') == 600
+    assert scheduler.period('http://c/list') == 600
+
+    # 保留声明过的最长值，之后较短的声明不生效
+    scheduler.set_interval('http://a/list', 120)
+    scheduler.set_interval('http://a/list', 90)
+    assert scheduler.period('http://a/list') == 120
+
+    for _ in range(2):
+        scheduler.record('http://a/list', 'http://a/list')
+    entry = cache.store('http://a/list', b'{}')
+    assert scheduler.tick(entry.stored_at + 60) == 0
+    assert scheduler.tick(entry.stored_at + 120) == 1
+
+    # 声明的 interval 不缩短配置的刷新间隔，下限至少为检查周期的倍数
+    cache, recorder, scheduler = make_scheduler(interval=240, min_interval=60)
+    scheduler.set_interval('http://a/list', 120)
+    scheduler.set_interval('http://b/list', 480)
+    assert scheduler.period('http://a/list') == 240
+    assert scheduler.period('http://b/list') == 480
+    assert make_scheduler(min_interval=0, check_interval=30)[2].min_interval == 180
+
+
+def test_concurrent_refreshes_are_capped():
+    cache, recorder, scheduler = make_scheduler(concurrency=1)
+    recorder.release.clear()
+    for name in 'abc':
+        for _ in range(2):
+            scheduler.record(name, f'http://{name}/list')
+
+    # 已被淘汰的热门来源立即刷新
+    assert scheduler.tick() == 1
+    assert scheduler.tick() == 0
+    assert scheduler.get_stats()['deferred'] == 4
+
+    recorder.release.set()
+    wait_idle(scheduler)
+    assert [call[2] for call in recorder.calls] == [None]
+    # 已刷新的来源未到期，请求触发的后台刷新进行中的来源不重复刷新
+    cache.store('a', b'{}')
+    cache.begin_refresh('b')
+    assert scheduler.tick() == 1
+    wait_idle(scheduler)
+    assert [call[0] for call in recorder.calls] == ['a', 'c']
+
+
+def test_request_counts_decay():
+    cache, recorder, scheduler = make_scheduler(decay_interval=60)
+    for _ in range(4):
+        scheduler.record('a', 'http://a/list')
+    scheduler.record('b', 'http://b/list')
+    scheduler.set_interval('b', 30)
+
+    scheduler._decay(time.time() + 60)
+    assert scheduler.hot_sources()[0][1]['hits'] == 2
+    scheduler._decay(time.time() + 120)
+    scheduler._decay(time.time() + 180)
+    assert scheduler.get_stats()['tracked'] == 1
+    assert scheduler.hot_sources() == []
+    assert 'b' not in scheduler._intervals
+
+
+def test_hot_upstream_is_refreshed_in_background(upstream, upstream_hits, monkeypatch):
+    scheduler = RefreshScheduler(core.rule_cache, core.refresh_cached_rules)
+    monkeypatch.setattr(core, 'refresh_scheduler', scheduler)
+    versions.clear()
+
+    client = core.app.test_client()
+    url = f'/rules/{upstream}/hot.txt'
+    for _ in range(3):
+        assert client.get(url).get_json()['rules'] == [{'domain_suffix': ['version1.example.com']}]
+
+    key = normalize_url(f'{upstream}/hot.txt')
+    entry = core.rule_cache.peek(key)
+    assert scheduler.tick(entry.fresh_until) == 1
+    wait_idle(scheduler)
+
+    # 刷新后的结果已经在缓存中，客户端请求不再等待下载和转换
+    assert upstream_hits['/hot.txt'] == 2
+    assert core.rule_cache.peek(key).stored_at > entry.stored_at
+    assert client.get(url).get_json()['rules'] == [{'domain_suffix': ['version2.example.com']}]
+    assert upstream_hits['/hot.txt'] == 2
+    assert client.get('/api/stats').get_json()['refresh_scheduler']['scheduled'] == 1
+
+
+def test_config_records_provider_intervals(upstream, monkeypatch):
+    scheduler = RefreshScheduler(core.rule_cache, core.refresh_cached_rules)
+    monkeypatch.setattr(core, 'refresh_scheduler', scheduler)
+
+    config = (f"rule-providers:\n  hot:\n    type: http\n    behavior: domain\n    url: {upstream}/hot.txt\n"
+              f"    interval: 60\nrules:\n  - RULE-SET,hot,PROXY\n")
+    assert core.app.test_client().post('/config', data=config).status_code == 200
+    key = core.source_cache_key(f'{upstream}/hot.txt', 'domain')
+    # interval: 60 低于下限
+    assert scheduler.period(key) == scheduler.min_interval == 300
+    assert scheduler.get_stats()['tracked'] == 1
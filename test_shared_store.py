@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+多worker共享存储测试，无需启动服务
+
+python -m pytest -q test_shared_store.py
+"""
+
+import multiprocessing
+import time
+
+import pytest
+
+from rule_cache import RuleCache
+from shared_store import MemoryStore, SQLiteStore, create_store
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    return create_store(request.param, str(tmp_path / 'store.db'))
+
+
+def hit_rate_limit(path, count, results):
+    store = SQLiteStore(path)
+    results.put(sum(store.rate_limit_hit('rate:1.2.3.4', 20, 60) for _ in range(count)))
+
+
+def increment(path, count):
+    store = SQLiteStore(path)
+    for _ in range(count):
+        store.update_state('stats', lambda state: {'total': (state or {'total': 0})['total'] + 1})
+        store.incr('requests')
+    # fork出的子进程退出时不执行 atexit
+    store.flush()
+
+
+def run_workers(target, *args):
+    """模拟gunicorn的4个worker进程"""
+    workers = [multiprocessing.Process(target=target, args=args) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+
+def test_rate_limit_is_shared_across_processes(tmp_path):
+    """4个进程共用一个限流窗口，总放行数等于配置的上限"""
+    path = str(tmp_path / 'store.db')
+    SQLiteStore(path)
+    results = multiprocessing.Queue()
+    run_workers(hit_rate_limit, path, 10, results)
+    assert sum(results.get() for _ in range(4)) == 20
+
+
+def test_counters_are_shared_across_processes(tmp_path):
+    """并发的读改写不丢失更新"""
+    path = str(tmp_path / 'store.db')
+    store = SQLiteStore(path)
+    run_workers(increment, path, 50)
+    assert store.get_state('stats') == {'total': 200}
+    assert store.counters('req') == {'uests': 200}
+
+
+def test_rate_limit_window(store):
+    assert all(store.rate_limit_hit('rate:a', 3, 60) for _ in range(3))
+    assert not store.rate_limit_hit('rate:a', 3, 60)
+    assert store.rate_limit_hit('rate:b', 3, 60)
+    assert store.rate_limit_hit('rate:c', 1, 0.01)
+
+
+def test_expired_rate_events_are_pruned_for_all_keys(store):
+    """不再访问的IP的过期记录也会被定期删除"""
+    def rate_keys():
+        if isinstance(store, SQLiteStore):
+            return {row[0] for row in store._connection().execute('SELECT DISTINCT key FROM rate_events')}
+        return set(store._rate_events)
+
+    assert store.rate_limit_hit('rate:a', 5, 0.01)
+    time.sleep(0.05)
+    store._next_prune = 0
+    assert store.rate_limit_hit('rate:b', 5, 0.01)
+    assert rate_keys() == {'rate:b'}
+
+
+def test_counters_and_state_updates_are_buffered(tmp_path):
+    """计数器和延迟的状态更新不在调用时写入，定时或读取前批量写入"""
+    path = str(tmp_path / 'store.db')
+    store, other = SQLiteStore(path), SQLiteStore(path)
+    store.FLUSH_INTERVAL = 0.1
+    for _ in range(3):
+        store.incr('cache.hits')
+        store.update_state_later('stats', lambda state: (state or []) + [len(state or [])])
+    assert other.counters('cache.') == {}
+    assert other.get_state('stats') is None
+
+    # 本进程读取时先写入自己的缓冲
+    assert store.counters('cache.') == {'hits': 3}
+    assert other.get_state('stats') == [0, 1, 2]
+
+    # 没有读取时由定时器写入
+    store.incr('cache.hits', 2)
+    for _ in range(50):
+        if other.counters('cache.') == {'hits': 5}:
+            break
+        time.sleep(0.02)
+    assert other.counters('cache.') == {'hits': 5}
+
+
+def test_leases(store):
+    assert store.acquire_lease('refresh:x', 60)
+    assert not store.acquire_lease('refresh:x', 60)
+    store.release_lease('refresh:x')
+    assert store.acquire_lease('refresh:x', 60)
+    assert store.acquire_lease('refresh:y', -1)
+    assert store.acquire_lease('refresh:y', 60)
+
+
+def test_cache_shared_between_workers(tmp_path):
+    """一个worker写入的转换结果，另一个worker无需转换即可命中"""
+    path = str(tmp_path / 'store.db')
+    compressor = lambda body: {'gzip': b'gz:' + body}
+    first = RuleCache(shared_store=SQLiteStore(path), compressor=compressor)
+    second = RuleCache(shared_store=SQLiteStore(path), compressor=compressor)
+
+    assert second.lookup('https://example.com/a')[1] == 'miss'
+    stored = first.store('https://example.com/a', b'{"rules":[]}', upstream_etag='"v1"')
+
+    entry, state = second.lookup('https://example.com/a')
+    assert state == 'fresh'
+    assert entry.body == stored.body
+    assert entry.etag == stored.etag
+    assert entry.encoded == {'gzip': b'gz:{"rules":[]}'}
+    assert entry.conditional_headers() == {'If-None-Match': '"v1"'}
+
+    # 内容未变化时复用进程内条目
+    assert second.lookup('https://example.com/a')[0] is entry
+
+    # 内容更新后重新加载
+    first.store('https://example.com/a', b'{"rules":[{}]}')
+    assert second.lookup('https://example.com/a')[0].body == b'{"rules":[{}]}'
+
+    # 其他worker的计数在下次写入缓冲后可见
+    second.shared_store.flush()
+    stats = first.get_stats()
+    assert stats['hits'] == 3 and stats['misses'] == 1 and stats['entries'] == 1
+
+    # 同一时间只有一个worker执行后台刷新
+    assert first.begin_refresh('https://example.com/a')
+    assert not second.begin_refresh('https://example.com/a')
+    first.end_refresh('https://example.com/a')
+    assert second.begin_refresh('https://example.com/a')
+
+
+def test_shared_cache_eviction(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'store.db'))
+    cache = RuleCache(max_bytes=2000, shared_store=store)
+    for index in range(5):
+        cache.store(f'key{index}', bytes(600))
+
+    entries, size = store.artifact_usage('rules')
+    assert entries == 2 and size <= 2000
+    assert cache.get_stats()['evictions'] == 3
+    assert cache.lookup('key4')[1] == 'fresh'
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_store('redis')
+    assert not MemoryStore.shared and SQLiteStore.shared
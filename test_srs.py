@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+sing-box 二进制规则集编码测试，无需启动服务
+
+python -m pytest -q test_srs.py
+"""
+
+import ipaddress
+import random
+import zlib
+
+import pytest
+
+from rule_converter import RuleConverter
+from srs import (
+    MAGIC, PREFIX_LABEL, SRSError, _Reader, build_succinct_set, domain_matcher_keys,
+    read_rule_set, write_rule_set
+)
+
+
+def get_bit(words, index):
+    return (index >> 6) < len(words) and words[index >> 6] >> (index & 63) & 1
+
+
+def count_zeros(words, end):
+    """[0, end) 范围内0的个数"""
+    return sum(1 for index in range(end) if not get_bit(words, index))
+
+
+def select_ith_one(words, i):
+    """第i个(从0开始)1所在的位置"""
+    seen = -1
+    index = 0
+    while True:
+        if get_bit(words, index):
+            seen += 1
+            if seen == i:
+                return index
+        index += 1
+
+
+def succinct_has(leaves, label_bitmap, labels, key: bytes) -> bool:
+    """与 sing-box succinctSet.Has 相同的查找流程，依赖层序位图的精确布局"""
+    node_id = bm_index = 0
+    for current in key:
+        while True:
+            if get_bit(label_bitmap, bm_index):
+                return False
+            next_label = labels[bm_index - node_id]
+            if next_label == ord(PREFIX_LABEL):
+                return True
+            if next_label == current:
+                break
+            bm_index += 1
+        node_id = count_zeros(label_bitmap, bm_index + 1)
+        bm_index = select_ith_one(label_bitmap, node_id - 1) + 1
+
+    if get_bit(leaves, node_id):
+        return True
+    while True:
+        if get_bit(label_bitmap, bm_index):
+            return False
+        if labels[bm_index - node_id] == ord(PREFIX_LABEL):
+            return True
+        bm_index += 1
+
+
+def expected_match(domains, suffixes, name):
+    """Sing-box 的 domain / domain_suffix 匹配语义"""
+    if name in domains:
+        return True
+    for suffix in suffixes:
+        if suffix.startswith('.'):
+            if name.endswith(suffix):
+                return True
+        elif name == suffix or name.endswith('.' + suffix):
+            return True
+    return False
+
+
+def read_domain_item(data):
+    """读取只有一个 domain 条目的规则集中的字典树"""
+    reader = _Reader(zlib.decompress(data[4:]))
+    assert reader.uvarint() == 1
+    assert reader.byte() == 0
+    assert reader.byte() == 2
+    assert reader.byte() == 1
+    return reader.words(), reader.words(), reader.read(reader.uvarint())
+
+
+def canonical(rule_set):
+    """按字段合并规则，网段统一为合并后的网段列表"""
+    fields = {}
+    for rule in rule_set['rules']:
+        for key, values in rule.items():
+            fields.setdefault(key, set()).update(values)
+    for key in ('ip_cidr', 'source_ip_cidr'):
+        if key in fields:
+            networks = [ipaddress.ip_network(value, strict=False) for value in fields[key]]
+            fields[key] = {str(network) for version in (4, 6)
+                           for network in ipaddress.collapse_addresses(n for n in networks if n.version == version)}
+    return fields
+
+
+def test_header_and_compression():
+    """文件头为 SRS + 版本1，其后为 zlib 数据"""
+    data = write_rule_set({"rules": [{"domain": ["example.com"]}], "version": 2})
+    assert data[:3] == MAGIC
+    assert data[3] == 1
+    zlib.decompress(data[4:])
+
+
+def test_succinct_set_layout():
+    """简洁字典树的位图和标签与手工推导的层序编码一致"""
+    leaves, label_bitmap, labels = build_succinct_set([b'ab', b'ac', b'b'])
+    # 根节点: a b | 节点1(a): b c | 节点2(b): 叶子 | 节点3(ab)、节点4(ac): 叶子
+    assert labels == b'abbc'
+    assert label_bitmap == [0b111100100]
+    assert leaves == [0b11100]
+
+
+def test_domain_matcher_semantics():
+    """字典树的匹配结果与 domain / domain_suffix 的语义一致"""
+    rng = random.Random(7)
+    labels = ['a', 'b', 'com', 'cn', 'x-y', '例子']
+
+    for _ in range(300):
+        def name():
+            return '.'.join(rng.choice(labels) for _ in range(rng.randint(1, 3)))
+        domains = {name() for _ in range(rng.randint(0, 4))}
+        suffixes = {rng.choice(['', '.']) + name() for _ in range(rng.randint(0, 4))}
+        if not domains and not suffixes:
+            continue
+
+        data = write_rule_set({"rules": [{"domain": sorted(domains), "domain_suffix": sorted(suffixes)}], "version": 2})
+        leaves, label_bitmap, labels_bytes = read_domain_item(data)
+
+        for _ in range(30):
+            probe = name()
+            if rng.random() < 0.3 and (domains or suffixes):
+                probe = rng.choice(labels) + '.' + rng.choice(sorted(domains | suffixes)).lstrip('.')
+            key = probe[::-1].encode('utf-8')
+            assert succinct_has(leaves, label_bitmap, labels_bytes, key) == expected_match(domains, suffixes, probe), \
+                (domains, suffixes, probe)
+
+
+def test_round_trip_all_items():
+    """所有支持的字段编码后可以完整还原"""
+    rule_set = {
+        "rules": [
+            {"domain": ["example.com", "www.example.org"]},
+            {"domain_suffix": ["example.net", ".only-sub.org"]},
+            {"domain_keyword": ["google", "例子"]},
+            {"domain_regex": ["^ads\\."]},
+            {"ip_cidr": ["1.0.0.0/24", "1.0.1.0/24", "10.0.0.1", "2001:db8::/32"]},
+            {"source_ip_cidr": ["192.168.0.0/16"]},
+            {"port": [80, 443]},
+            {"port_range": ["1000:2000"]},
+            {"source_port": [53]},
+            {"source_port_range": ["10000:20000"]},
+            {"process_path": ["/usr/bin/curl"]},
+        ],
+        "version": 2
+    }
+
+    decoded = read_rule_set(write_rule_set(rule_set))
+    assert decoded['version'] == 1
+    assert len(decoded['rules']) == len(rule_set['rules'])
+    assert canonical(decoded) == canonical(rule_set)
+    assert decoded['rules'][4]['ip_cidr'] == ['1.0.0.0/23', '10.0.0.1/32', '2001:db8::/32']
+
+
+def test_round_trip_converted_rules():
+    """转换结果编码后还原，与JSON输出一致；geoip/geosite 不属于 headless 规则而被跳过"""
+    content = '\n'.join([
+        'DOMAIN-SUFFIX,example.com',
+        'DOMAIN,www.example.org',
+        'DOMAIN-KEYWORD,tracker',
+        'IP-CIDR,10.0.0.0/8,no-resolve',
+        'IP-CIDR6,2001:db8::/32,no-resolve',
+        'SRC-IP-CIDR,192.168.1.0/24',
+        'DST-PORT,443',
+        'SRC-PORT,1000-2000',
+        'PROCESS-PATH,/usr/bin/app',
+        'GEOIP,CN',
+    ])
+    result = RuleConverter().convert(content)
+
+    decoded = read_rule_set(write_rule_set(result))
+    expected = canonical(result)
+    del expected['geoip']
+    assert canonical(decoded) == expected
+
+
+def test_matcher_keys_follow_sing_box_rules():
+    """后缀同时生成自身和子域名两个键，重复或已覆盖的条目不重复生成"""
+    keys = domain_matcher_keys(['a.com', 'x.com'], ['x.com', '.x.com', '.b.com', ''])
+    assert keys == sorted([b'moc.a', b'moc.x', b'moc.x.\r', b'moc.b.\r'])
+
+
+def test_invalid_input():
+    with pytest.raises(SRSError):
+        read_rule_set(b'JSON')
+    with pytest.raises(SRSError):
+        read_rule_set(MAGIC + bytes([9]) + zlib.compress(b'\x00'))
+    with pytest.raises(SRSError):
+        read_rule_set(MAGIC + bytes([1]) + zlib.compress(b'\x01\x00\x63'))
+    with pytest.raises(SRSError):
+        write_rule_set({"rules": [{"ip_cidr": ["not-a-network"]}], "version": 2})
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+上游HTTP客户端测试，使用本地上游桩服务
+
+python -m pytest -q test_upstream.py
+"""
+
+import asyncio
+import threading
+import time
+
+import upstream as upstream_module
+from upstream import AsyncUpstreamClient, DNSCache, UpstreamClient
+
+UPSTREAM_DELAY = 0.2
+
+
+def upstream_response(path):
+    if path.startswith('/slow/'):
+        time.sleep(UPSTREAM_DELAY)
+    return 'DOMAIN,a.com'
+
+
+def test_dns_cache_is_bounded(monkeypatch):
+    resolved = []
+
+    def getaddrinfo(host, port, *args):
+        resolved.append(host)
+        return [(None, None, None, None, ('10.0.0.1', port))]
+
+    monkeypatch.setattr(upstream_module.socket, 'getaddrinfo', getaddrinfo)
+    cache = DNSCache(ttl=60, max_entries=3)
+    for host in ('a.example', 'b.example', 'c.example'):
+        cache.resolve(host, 443)
+    # 命中的条目移到最近使用，新条目淘汰最久未使用的
+    cache.resolve('a.example', 443)
+    cache.resolve('d.example', 443)
+    assert cache.get_stats()['entries'] == 3
+    cache.resolve('a.example', 443)
+    cache.resolve('b.example', 443)
+    assert resolved == ['a.example', 'b.example', 'c.example', 'd.example', 'b.example']
+
+    # 超过上限时先丢弃已过期的条目
+    cache.ttl = 0
+    for i in range(10):
+        cache.resolve(f'host{i}.example', 443)
+    assert cache.get_stats()['entries'] <= 3
+
+
+def test_host_slots_are_released(upstream):
+    client = UpstreamClient(per_host_limit=1)
+
+    def fetch():
+        with client.stream(f'{upstream}/slow/a.txt') as response:
+            response.content
+
+    threads = [threading.Thread(target=fetch) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with client.stream(f'{upstream}/a.txt') as response:
+        assert response.status_code == 200
+        assert len(client._host_slots) == 1
+    assert client._host_slots == {} and not client._host_users
+    assert client.get_stats()['host_limit_waits'] >= 1
+
+
+def test_async_host_slots_are_released(upstream):
+    async def main():
+        client = AsyncUpstreamClient(per_host_limit=1)
+
+        async def fetch(path):
+            async with client.stream(f'{upstream}{path}') as response:
+                await response.aread()
+                return response.status_code
+
+        try:
+            statuses = await asyncio.gather(*[fetch(f'/slow/{i}.txt') for i in range(3)])
+            return statuses, client
+        finally:
+            await client.aclose()
+
+    statuses, client = asyncio.run(main())
+    assert statuses == [200, 200, 200]
+    assert client._host_slots == {} and not client._host_users
+    assert client.get_stats()['host_limit_waits'] == 2
@@ -0,0 +1,291 @@
+"""
+上游HTTP客户端
+
+每个worker进程共享一个带连接池的客户端，用于下载上游规则文件：
+- requests.Session + HTTPAdapter 保持长连接，重复访问同一主机时复用TCP/TLS连接
+- 每个上游主机的并发请求数上限
+- 连接超时与读取超时分开配置
+- 缓存DNS解析结果
+
+主机名来自请求参数，按主机保存的状态都有上限：DNS缓存按LRU淘汰，主机并发名额只在有请求占用或等待时保留。
+
+异步服务模式使用基于 httpx 的 AsyncUpstreamClient，等待上游时不占用worker。httpx 为可选依赖。
+"""
+
+import asyncio
+import ipaddress
+import socket
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.connection import allowed_gai_family
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class DNSCache:
+    """带TTL和条目上限的DNS解析缓存"""
+
+    def __init__(self, ttl: float = 300, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache: 'OrderedDict[Tuple[str, int], Tuple[str, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0
+        }
+
+    def resolve(self, host: str, port: int) -> str:
+        """解析主机名为IP地址，命中缓存时不发起DNS查询"""
+        # IP地址无需解析
+        try:
+            ipaddress.ip_address(host)
+            return host
+        except ValueError:
+            pass
+
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[1] > now:
+                self._cache.move_to_end(key)
+                self.stats['hits'] += 1
+                return cached[0]
+
+        infos = socket.getaddrinfo(host, port, allowed_gai_family(), socket.SOCK_STREAM)
+        address = infos[0][4][0]
+        with self._lock:
+            self._cache[key] = (address, now + self.ttl)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.max_entries:
+                # 先丢弃已过期的条目，仍超过上限时淘汰最久未使用的
+                for expired in [k for k, (_, expires) in self._cache.items() if expires <= now]:
+                    del self._cache[expired]
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+            self.stats['misses'] += 1
+        return address
+
+    def invalidate(self, host: str, port: int):
+        """连接失败时丢弃缓存的解析结果"""
+        with self._lock:
+            self._cache.pop((host, port), None)
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取DNS缓存统计信息"""
+        with self._lock:
+            stats = self.stats.copy()
+            stats['entries'] = len(self._cache)
+            return stats
+
+
+def _build_pool_classes(client: 'UpstreamClient'):
+    """构造使用DNS缓存并统计新建连接数的连接池类"""
+
+    class _CachedDNSMixin:
+        def _new_conn(self):
+            host = self._dns_host
+            try:
+                self._dns_host = client.dns_cache.resolve(host, self.port)
+            except socket.gaierror:
+                # 交给urllib3按原流程解析并报告错误
+                pass
+            try:
+                sock = super()._new_conn()
+            except Exception:
+                client.dns_cache.invalidate(host, self.port)
+                raise
+            finally:
+                self._dns_host = host
+            client._count('connections_opened')
+            return sock
+
+    class CachedHTTPConnection(_CachedDNSMixin, HTTPConnection):
+        pass
+
+    class CachedHTTPSConnection(_CachedDNSMixin, HTTPSConnection):
+        pass
+
+    class CachedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = CachedHTTPConnection
+
+    class CachedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = CachedHTTPSConnection
+
+    return {
+        'http': CachedHTTPConnectionPool,
+        'https': CachedHTTPSConnectionPool
+    }
+
+
+def response_encoding(headers) -> str:
+    """按响应头确定上游内容的编码，同步和异步模式相同
+
+    沿用 requests 的规则：text/* 未声明 charset 时为 ISO-8859-1，其他类型未声明时为 UTF-8
+    """
+    return requests.utils.get_encoding_from_headers(headers) or 'utf-8'
+
+
+class _PooledAdapter(HTTPAdapter):
+    """替换连接池类的HTTPAdapter"""
+
+    def __init__(self, pool_classes, **kwargs):
+        self._pool_classes = pool_classes
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
+
+
+class UpstreamClient:
+    """带连接池、主机并发上限和DNS缓存的上游HTTP客户端"""
+
+    def __init__(self, per_host_limit: int = 4, max_hosts: int = 32,
+                 connect_timeout: float = 5, read_timeout: float = 25,
+                 dns_ttl: float = 300, headers: Optional[Dict[str, str]] = None):
+        self.per_host_limit = per_host_limit
+        self.timeout = (connect_timeout, read_timeout)
+        self.dns_cache = DNSCache(dns_ttl)
+
+        # 主机 -> 并发名额，以及占用或等待名额的请求数，计数归零时删除
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._host_users = Counter()
+        self._lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'connections_opened': 0,
+            'host_limit_waits': 0
+        }
+
+        adapter = _PooledAdapter(
+            _build_pool_classes(self),
+            pool_connections=max_hosts,
+            pool_maxsize=per_host_limit
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def _count(self, key: str, value: int = 1):
+        with self._lock:
+            self.stats[key] += value
+
+    @contextmanager
+    def _host_slot(self, url: str):
+        """占用目标主机的并发名额，已满时等待"""
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            self._host_users[host] += 1
+        try:
+            if not slot.acquire(blocking=False):
+                self._count('host_limit_waits')
+                slot.acquire()
+            try:
+                self._count('requests')
+                yield
+            finally:
+                slot.release()
+        finally:
+            with self._lock:
+                self._host_users[host] -= 1
+                if not self._host_users[host]:
+                    del self._host_users[host]
+                    del self._host_slots[host]
+
+    @contextmanager
+    def stream(self, url: str, headers: Optional[Dict[str, str]] = None, **kwargs):
+        """流式GET请求，同一主机的并发请求数不超过上限，响应体读取完毕并关闭前一直占用名额"""
+        kwargs.setdefault('timeout', self.timeout)
+        with self._host_slot(url):
+            response = self.session.get(url, headers=headers, stream=True, **kwargs)
+            try:
+                yield response
+            finally:
+                response.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接池统计信息"""
+        with self._lock:
+            stats = self.stats.copy()
+        dns_stats = self.dns_cache.get_stats()
+        stats['dns_hits'] = dns_stats['hits']
+        stats['dns_misses'] = dns_stats['misses']
+        stats['dns_entries'] = dns_stats['entries']
+        # 未新建连接的请求即复用了连接池中的长连接
+        stats['pool_misses'] = stats['connections_opened']
+        stats['pool_hits'] = max(stats['requests'] - stats['connections_opened'], 0)
+        stats['reuse_ratio'] = round(stats['pool_hits'] / stats['requests'] * 100, 1) if stats['requests'] else 0
+        return stats
+
+
+class AsyncUpstreamClient:
+    """异步上游HTTP客户端，连接池与每个主机的并发上限由同一事件循环内的所有请求共享"""
+
+    def __init__(self, per_host_limit: int = 4, max_connections: int = 100,
+                 connect_timeout: float = 5, read_timeout: float = 25,
+                 headers: Optional[Dict[str, str]] = None):
+        if httpx is None:
+            raise RuntimeError('httpx is required for the async serving mode')
+        self.per_host_limit = per_host_limit
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections),
+            follow_redirects=True
+        )
+
+        # 与同步客户端相同，只保留有请求占用或等待的主机
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self._host_users = Counter()
+        self.stats = {
+            'requests': 0,
+            'host_limit_waits': 0
+        }
+
+    @asynccontextmanager
+    async def stream(self, url: str, headers: Optional[Dict[str, str]] = None):
+        """流式GET请求，响应体读取完毕并关闭前一直占用主机并发名额"""
+        host = urlsplit(url).netloc.lower()
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = asyncio.Semaphore(self.per_host_limit)
+        self._host_users[host] += 1
+        try:
+            if slot.locked():
+                self.stats['host_limit_waits'] += 1
+            async with slot:
+                self.stats['requests'] += 1
+                async with self.client.stream('GET', url, headers=headers) as response:
+                    yield response
+        finally:
+            self._host_users[host] -= 1
+            if not self._host_users[host]:
+                del self._host_users[host]
+                del self._host_slots[host]
+
+    async def aclose(self):
+        """关闭连接池"""
+        await self.client.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计信息"""
+        return self.stats.copy()